@@ -5,7 +5,6 @@ import argparse
 import json
 import os
 import sys
-import time
 
 from .. import compat, Catalog
 
@@ -80,19 +79,15 @@ def provide_narration(fn):
     return fn_
 
 def wait_on_tool_run(result_object, silent=False):
-    message_length = 0
-    while result_object.running:
-        time.sleep(0.125)
-        messages = getattr(result_object, 'messages', [])
-        if len(messages) > message_length:
-            for message_object in messages[message_length:]:
-                if not silent:
-                    print (message_object.description)
-                    sys.stdout.flush()
-            message_length = len(messages)
-    if not silent:
-        for message_object in messages[message_length:]:
-            print (message_object.description)
+    def print_messages(status, messages):
+        if not silent:
+            for message_object in messages:
+                print (message_object.description)
+            sys.stdout.flush()
+    if hasattr(result_object, 'poll'):
+        result_object.wait(progress=print_messages)
+    else:
+        print_messages(None, getattr(result_object, 'messages', []))
 
 createserviceargs = argparse.ArgumentParser(prog=PROG_NAME,
                                             description='Creates a service',
@@ -541,8 +536,7 @@ def convertcachestorageformat(action):
     with action("converting format"):
         result_object = convert_cache_tool(args.name,
                                            args.instances)
-        while result_object.running:
-            time.sleep(0.125)
+        result_object.wait()
         print ("\n".join(msg.description for msg in result_object.messages))
 
 importcacheargs = argparse.ArgumentParser(prog=PROG_NAME,
@@ -578,8 +572,7 @@ def importcache(action):
                                            args.instances,
                                            args.extent,
                                            args.levels)
-        while result_object.running:
-            time.sleep(0.125)
+        result_object.wait()
         print ("\n".join(msg.description for msg in result_object.messages))
 
 @provide_narration
@@ -597,6 +590,5 @@ def exportcache(action):
     with action("converting format"):
         result_object = convert_cache_tool(args.name,
                                            args.instances)
-        while result_object.running:
-            time.sleep(0.125)
+        result_object.wait()
         print ("\n".join(msg.description for msg in result_object.messages))
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""Bulk export of a layer's attachments to disk. The attachment infos of
+   many features are looked up per request with the layer's queryAttachments
+   operation, then the attachments are downloaded a few at a time and each
+   one is streamed straight to its file rather than held in memory.
+
+      >>> import arcrest.attachments
+      >>> exporter = arcrest.attachments.AttachmentExporter(feature_layer,
+      ...                                                   "photos")
+      >>> report = exporter.export(where="INSPECTED = 1")
+      >>> report
+      <AttachmentExport 20312 downloaded, 0 skipped, 0 failed, 8.41 MB/s>
+
+   Each attachment is saved as C{<directory>/<objectId>/<id>-<name>}. An
+   export that is run again skips every attachment whose file is already
+   there with the size the server reports, so an interrupted export resumes
+   where it stopped.
+   """
+
+import os
+import re
+import time
+
+from . import compat
+from . import utils
+from .server import AttachmentInfos, JsonResult, RETRY_EXCEPTIONS
+
+__all__ = ['AttachmentExport', 'AttachmentExporter']
+
+#: Errors that fail the download of one attachment rather than the export:
+#: failed requests, connections dropped while streaming and file errors
+DOWNLOAD_EXCEPTIONS = RETRY_EXCEPTIONS + (EnvironmentError,
+                                          compat.IncompleteRead)
+
+class AttachmentExport(object):
+    """The outcome of an attachment export. downloaded and skipped list the
+       attachment infos of the attachments that were saved and of the ones
+       already on disk; failed lists (attachment info, exception) pairs.
+       Each attachment info has the parentObjectId of its feature and the
+       path it was saved to."""
+    def __init__(self):
+        self.downloaded, self.skipped, self.failed = [], [], []
+        self.bytes = 0
+        self.started = time.time()
+        self.finished = None
+    @property
+    def seconds(self):
+        "Wall clock time of the export so far"
+        return (self.finished or time.time()) - self.started
+    @property
+    def bytes_per_second(self):
+        "Download throughput of the export"
+        return self.bytes / max(self.seconds, 1e-6)
+    @property
+    def files_per_second(self):
+        "Attachments downloaded per second"
+        return len(self.downloaded) / max(self.seconds, 1e-6)
+    def __repr__(self):
+        return ("<AttachmentExport %i downloaded, %i skipped, %i failed, "
+                "%.2f MB/s>" % (len(self.downloaded), len(self.skipped),
+                                len(self.failed),
+                                self.bytes_per_second / 1048576.))
+
+class AttachmentExporter(object):
+    """Downloads the attachments of a map or feature layer into directory
+       on up to workers threads. Attachment infos are queried for up to
+       group_size features per queryAttachments request; servers without
+       that operation fall back to one attachment infos request per
+       feature. A download that fails is tried again up to retries times,
+       retry_delay seconds later (doubling each time). If set, progress is
+       called with the running
+       L{AttachmentExport<arcrest.attachments.AttachmentExport>} and the
+       attachment info after every attachment."""
+    def __init__(self, layer, directory, workers=8, group_size=500,
+                 retries=2, retry_delay=0.5, progress=None):
+        self.layer = layer
+        self.directory = directory
+        self.workers = workers
+        self.group_size = group_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress = progress
+    def _object_ids(self, where):
+        "The object IDs of the features in the layer matching where"
+        out = self.layer._get_subfolder("./query", JsonResult,
+                                        {'where': where or '1=1',
+                                         'returnIdsOnly': True})
+        return sorted(out._json_struct.get('objectIds') or [])
+    def _feature_attachment_infos(self, objectId):
+        "The attachment infos of one feature, without queryAttachments"
+        infos = self.layer._get_subfolder("%i/attachments/" % objectId,
+                                          AttachmentInfos)
+        return [dict(info, parentObjectId=objectId)
+                for info in infos._json_struct.get('attachmentInfos', [])]
+    def attachment_infos(self, objectIds=None, where=None):
+        """Yield the attachment info of every attachment of the features
+           with objectIds, or of the features matching where, with the
+           parentObjectId of its feature added"""
+        if objectIds is None and where is not None:
+            try:
+                result = self.layer.QueryAttachments(
+                                                definitionExpression=where)
+            except RETRY_EXCEPTIONS:
+                # queryAttachments isn't supported, ask feature by feature
+                groups = []
+                objectIds = self._object_ids(where)
+            else:
+                groups = [result]
+        else:
+            if objectIds is None:
+                objectIds = self._object_ids(None)
+            objectIds = list(objectIds)
+            groups = (self.layer.QueryAttachments(
+                                    objectIds=objectIds[index:index +
+                                                        self.group_size])
+                      for index in range(0, len(objectIds), self.group_size))
+        answered = False
+        try:
+            for result in groups:
+                answered = True
+                for group in result.get('attachmentGroups', []):
+                    for info in group.get('attachmentInfos', []):
+                        yield dict(info,
+                                   parentObjectId=group['parentObjectId'])
+        except RETRY_EXCEPTIONS:
+            # Only fall back if the very first request failed
+            if answered:
+                raise
+        if answered:
+            return
+        for infos in utils.imap_parallel(self._feature_attachment_infos,
+                                         objectIds, self.workers):
+            for info in infos:
+                yield info
+    def path(self, info):
+        "The file an attachment is saved to"
+        name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', info.get('name') or '')
+        return os.path.join(self.directory, str(info['parentObjectId']),
+                            "%i-%s" % (info['id'], name))
+    def _save(self, info, partial):
+        "Stream an attachment to the file partial"
+        return self.layer.Attachment(info['parentObjectId'],
+                                     info['id']).save(partial)
+    def download(self, info):
+        """Save one attachment to its file unless it is already there with
+           the right size. Returns (info, bytes written or None if skipped,
+           None) or (info, None, exception) if it couldn't be downloaded."""
+        info = dict(info, path=self.path(info))
+        path = info['path']
+        if (info.get('size') is not None and os.path.isfile(path) and
+                os.path.getsize(path) == info['size']):
+            return info, None, None
+        partial = path + ".part"
+        save = utils.with_retries(self._save, self.retries,
+                                  DOWNLOAD_EXCEPTIONS, self.retry_delay)
+        try:
+            folder = os.path.dirname(path)
+            if not os.path.isdir(folder):
+                try:
+                    os.makedirs(folder)
+                except OSError:
+                    # Created by another worker in the meantime
+                    if not os.path.isdir(folder):
+                        raise
+            written = save(info, partial)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(partial, path)
+        except DOWNLOAD_EXCEPTIONS as e:
+            try:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            except OSError:
+                pass
+            return info, None, e
+        return info, written, None
+    def export(self, objectIds=None, where=None):
+        """Download the attachments of the features with objectIds, of the
+           features matching where or of every feature in the layer, and
+           return an L{AttachmentExport<arcrest.attachments.AttachmentExport>}
+           report"""
+        report = AttachmentExport()
+        for info, written, error in utils.imap_parallel(
+                                    self.download,
+                                    self.attachment_infos(objectIds, where),
+                                    self.workers, ordered=False):
+            if error is not None:
+                report.failed.append((info, error))
+            elif written is None:
+                report.skipped.append(info)
+            else:
+                report.downloaded.append(info)
+                report.bytes += written
+            if self.progress is not None:
+                self.progress(report, info)
+        report.finished = time.time()
+        return report
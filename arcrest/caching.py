@@ -0,0 +1,345 @@
+# coding: utf-8
+"""Client-side caches for the results of REST operations, so that repeating
+   an operation on the same input becomes a local lookup. Values are any
+   json-serializable structure, None included; keys are strings, usually
+   built with L{make_key}. Values are copied going in and out of a cache,
+   so changing one doesn't change what the cache holds.
+
+      >>> import arcrest
+      >>> geometry_service.cache = arcrest.caching.ResultCache(
+      ...                                        path="geometry_cache.sqlite")
+
+   Geocode services take the same caches. Their keys are built from a
+   normalized form of the address (L{normalize_address}), so "380 New York
+   Street" and "380  NEW YORK ST." are one entry, and from the grid cell a
+   reverse geocoded location falls in (L{make_location_key}). Geocodes
+   change as locators are updated, so give those caches a ttl:
+
+      >>> geocode_service.cache = arcrest.caching.ResultCache(
+      ...                path="geocode_cache.sqlite", ttl=30 * 24 * 3600)
+      >>> geocode_service.cache.stats
+      {'hits': 18211, 'misses': 2204, 'hit_rate': 0.892...}
+   """
+
+import collections
+import copy
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+
+from . import geometry
+
+__all__ = ['make_key', 'normalize_address', 'make_address_key',
+           'make_location_key', 'MemoryCache', 'SqliteCache', 'ResultCache']
+
+def _canonical(value):
+    "Reduce spatial references and geometries to plain json structures"
+    if isinstance(value, geometry.SpatialReference):
+        return value.wkid
+    elif isinstance(value, geometry.Geometry):
+        return value._json_struct_without_sr
+    return value
+
+def make_key(operation, struct, params=None):
+    """Return a content-addressed cache key (a hex digest) for applying the
+       named operation to struct -- a geometry or other json-serializable
+       structure -- with the given dict of parameters."""
+    payload = json.dumps([operation,
+                          _canonical(struct),
+                          sorted((key, _canonical(value))
+                                 for key, value in (params or {}).items())],
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+#: Address words replaced by their usual abbreviation in normalize_address
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd',
+    'boulevard': 'blvd', 'drive': 'dr', 'lane': 'ln', 'court': 'ct',
+    'place': 'pl', 'terrace': 'ter', 'highway': 'hwy', 'parkway': 'pkwy',
+    'circle': 'cir', 'square': 'sq', 'trail': 'trl',
+    'expressway': 'expy', 'freeway': 'fwy', 'mount': 'mt', 'saint': 'st',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se',
+    'southwest': 'sw', 'apartment': 'apt', 'suite': 'ste',
+    'building': 'bldg', 'floor': 'fl', 'room': 'rm'}
+
+def _text(value):
+    "value as text, whatever its type"
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value if isinstance(value, type(u'')) else u'%s' % (value,)
+
+def _normalize_text(text):
+    "Lowercase text, drop punctuation and abbreviate its words"
+    words = re.findall(r"[^\s.,;:#'\"()]+", _text(text).lower())
+    return ' '.join(ADDRESS_ABBREVIATIONS.get(word, word) for word in words)
+
+def normalize_address(fields):
+    """Return a normalized copy of a dict of address fields: case, spacing
+       and punctuation are dropped, common words (street, avenue, north...)
+       are abbreviated and empty fields are left out, so that different
+       spellings of one address compare equal."""
+    normalized = {}
+    for name, value in fields.items():
+        if value is None:
+            continue
+        value = _normalize_text(value)
+        if value:
+            normalized[name.lower()] = value
+    return normalized
+
+def make_address_key(operation, fields, params=None):
+    """Return a cache key for applying operation to the address in a dict
+       of address fields; see L{normalize_address}"""
+    return make_key(operation, normalize_address(fields), params)
+
+def make_location_key(operation, location, distance, cell_size,
+                      params=None):
+    """Return a cache key for applying operation to a location (a Point, an
+       (x, y) pair or an "x,y" string) within distance, with the location
+       snapped to a grid of cell_size (in the units of its coordinates), so
+       that all the locations in a cell share one entry."""
+    if isinstance(location, geometry.Point):
+        wkid = location.spatialReference.wkid \
+                    if location.spatialReference else None
+        x, y = location.x, location.y
+    else:
+        wkid = None
+        if isinstance(location, (type(u''), bytes, str)):
+            location = _text(location).split(',')
+        x, y = [float(value) for value in location[:2]]
+    cell = [int(math.floor(x / cell_size)), int(math.floor(y / cell_size)),
+            cell_size, wkid]
+    return make_key(operation, cell, dict(params or {}, distance=distance))
+
+class MemoryCache(object):
+    """An in-memory cache holding at most maxsize entries, evicting the least
+       recently used entry first. Entries older than ttl seconds (if set)
+       are treated as missing."""
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits, self.misses = 0, 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._entries)
+    def get(self, key, default=None):
+        "Return the value stored under key, or default"
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and self.ttl is not None and \
+                    entry[1] < time.time() - self.ttl:
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+        return copy.deepcopy(entry[0])
+    def set(self, key, value):
+        "Store a copy of value under key, evicting old entries as needed"
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    @property
+    def stats(self):
+        "A dict of the hits, misses and hit rate of this cache"
+        return _stats(self.hits, self.misses)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+#: What get returns for a key with no entry, telling it from a stored None
+_MISSING = object()
+
+def _stats(hits, misses):
+    return {'hits': hits, 'misses': misses,
+            'hit_rate': float(hits) / (hits + misses) if hits + misses
+                                                       else 0.0}
+
+class SqliteCache(object):
+    """A persistent cache stored in a SQLite database at path, holding at
+       most maxsize entries (None for no limit) and evicting the least
+       recently used entry first. Values are stored as json text. Entries
+       stored more than ttl seconds ago (if set) are treated as missing and
+       deleted. The hit and miss counts are kept in the database too, so
+       they add up across runs.
+
+       Lookups don't write to the database. Hit and miss counts and the
+       access times of the entries read are kept in memory until the next
+       set(), expire() or close(), or until flush_every lookups have
+       gathered."""
+    #: Lookups after which their counts and access times are written out
+    flush_every = 1000
+    def __init__(self, path, maxsize=None, ttl=None):
+        self.path, self.maxsize, self.ttl = path, maxsize, ttl
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'misses': 0}
+        self._accessed = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cache "
+                                     "(key TEXT PRIMARY KEY, "
+                                     " value TEXT NOT NULL, "
+                                     " accessed REAL NOT NULL, "
+                                     " stored REAL)")
+            columns = [row[1] for row in self._connection.execute(
+                                            "PRAGMA table_info(cache)")]
+            if 'stored' not in columns:
+                # A cache made before entries expired
+                self._connection.execute("ALTER TABLE cache "
+                                         "ADD COLUMN stored REAL")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS "
+                                     "cache_accessed ON cache (accessed)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS stats "
+                                     "(name TEXT PRIMARY KEY, "
+                                     " value INTEGER NOT NULL)")
+            self._connection.execute("INSERT OR IGNORE INTO stats "
+                                     "(name, value) VALUES ('hits', 0), "
+                                     "('misses', 0)")
+            self._connection.commit()
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache"
+                                            ).fetchone()[0]
+    def _write_lookups(self):
+        """Add the lookups counted in memory to the database; the caller
+           holds the lock and commits"""
+        self._connection.executemany("UPDATE stats SET value = value + ? "
+                                     "WHERE name = ?",
+                                     [(count, name) for name, count
+                                      in self._counts.items() if count])
+        self._connection.executemany("UPDATE cache SET accessed = ? "
+                                     "WHERE key = ?",
+                                     [(accessed, key) for key, accessed
+                                      in self._accessed.items()])
+        self._counts = {'hits': 0, 'misses': 0}
+        self._accessed = {}
+    def flush(self):
+        "Write the lookups counted in memory to the database"
+        with self._lock:
+            self._write_lookups()
+            self._connection.commit()
+    def get(self, key, default=None):
+        "Return the value stored under key, or default"
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, "
+                                           "COALESCE(stored, accessed) "
+                                           "FROM cache "
+                                           "WHERE key = ?", (key,)
+                                           ).fetchone()
+            if row is not None and self.ttl is not None and \
+                    row[1] < now - self.ttl:
+                # Left for expire() to delete
+                row = None
+            if row is None:
+                self._counts['misses'] += 1
+            else:
+                self._counts['hits'] += 1
+                self._accessed[key] = now
+            if sum(self._counts.values()) >= self.flush_every:
+                self._write_lookups()
+                self._connection.commit()
+        if row is None:
+            return default
+        return json.loads(row[0])
+    def set(self, key, value):
+        "Store value under key, evicting old entries as needed"
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO cache "
+                                     "(key, value, accessed, stored) "
+                                     "VALUES (?, ?, ?, ?)",
+                                     (key, json.dumps(value), now, now))
+            self._accessed.pop(key, None)
+            self._write_lookups()
+            if self.maxsize is not None:
+                self._connection.execute("DELETE FROM cache WHERE key IN "
+                                         "(SELECT key FROM cache "
+                                         " ORDER BY accessed DESC "
+                                         " LIMIT -1 OFFSET ?)",
+                                         (self.maxsize,))
+            self._connection.commit()
+    @property
+    def stats(self):
+        "A dict of the hits, misses and hit rate of this cache"
+        with self._lock:
+            counts = dict(self._connection.execute("SELECT name, value "
+                                                   "FROM stats").fetchall())
+            hits = counts.get('hits', 0) + self._counts['hits']
+            misses = counts.get('misses', 0) + self._counts['misses']
+        return _stats(hits, misses)
+    def expire(self):
+        "Delete the entries older than ttl"
+        if self.ttl is None:
+            return
+        with self._lock:
+            self._write_lookups()
+            self._connection.execute("DELETE FROM cache "
+                                     "WHERE COALESCE(stored, accessed) < ?",
+                                     (time.time() - self.ttl,))
+            self._connection.commit()
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+            self._connection.execute("UPDATE stats SET value = 0")
+            self._connection.commit()
+            self._counts = {'hits': 0, 'misses': 0}
+            self._accessed = {}
+    def close(self):
+        with self._lock:
+            self._write_lookups()
+            self._connection.commit()
+            self._connection.close()
+
+class ResultCache(object):
+    """A two-tier cache: a MemoryCache of up to maxsize entries in front of
+       an optional SqliteCache at path (of up to disk_maxsize entries). Hits
+       on the disk tier are promoted into memory. Entries of both tiers
+       expire ttl seconds (if set) after they were stored."""
+    def __init__(self, maxsize=10000, path=None, disk_maxsize=None,
+                 ttl=None):
+        self.memory = MemoryCache(maxsize, ttl)
+        self.disk = SqliteCache(path, disk_maxsize, ttl) if path else None
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+    def get(self, key, default=None):
+        "Return the value stored under key in either tier, or default"
+        value = self.memory.get(key, _MISSING)
+        if value is _MISSING and self.disk is not None:
+            value = self.disk.get(key, _MISSING)
+            if value is not _MISSING:
+                self.memory.set(key, value)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return value
+    def set(self, key, value):
+        "Store value under key in both tiers"
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+    @property
+    def stats(self):
+        """A dict of the hits, misses and hit rate of this cache since it was
+           made; the disk tier's stats add up across runs"""
+        return _stats(self.hits, self.misses)
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+    def close(self):
+        "Write out and close the disk tier, if any"
+        if self.disk is not None:
+            self.disk.close()
@@ -4,8 +4,10 @@
    location in the running Python's standard library."""
 
 __all__ = ['cookielib', 'urllib2', 'HTTPError', 'URLError', 'urlsplit',
-           'urljoin', 'urlunsplit', 'urlencode', 'quote', 'string_type',
-           'ensure_string', 'ensure_bytes', 'get_headers']
+           'urljoin', 'urlunsplit', 'urlencode', 'quote', 'quote_plus',
+           'parse_qs', 'string_type', 'ensure_string', 'ensure_bytes',
+           'get_headers', 'queue', 'array_frombytes', 'array_tobytes',
+           'xrange', 'IncompleteRead']
 
 try:
     import cookielib
@@ -17,20 +19,40 @@ try:
 except ImportError:
     import urllib.request as urllib2
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 try:
     from urllib2 import HTTPError, URLError
 except ImportError:
     from urllib.error import HTTPError, URLError
 
+try:
+    from httplib import IncompleteRead
+except ImportError:
+    from http.client import IncompleteRead
+
 try:
     from urlparse import urlsplit, urljoin, urlunsplit
 except ImportError:
     from urllib.parse import urlsplit, urljoin, urlunsplit
 
 try:
-    from urllib import urlencode, quote
+    from urllib import urlencode, quote, quote_plus
+except ImportError:
+    from urllib.parse import urlencode, quote, quote_plus
+
+try:
+    from urlparse import parse_qs
 except ImportError:
-    from urllib.parse import urlencode, quote
+    from urllib.parse import parse_qs
+
+try:
+    xrange = xrange
+except NameError:
+    xrange = range
 
 string_type = str
 
@@ -56,3 +78,16 @@ def get_headers(handle):
     if hasattr(handle.headers, 'headers'):
         return handle.headers.headers
     return dict(handle.headers.items())
+
+def array_frombytes(arr, payload_bytes):
+    "Append the machine values in payload_bytes to an array.array"
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(payload_bytes)
+    else:
+        arr.fromstring(payload_bytes)
+
+def array_tobytes(arr):
+    "The machine values of an array.array as a byte string"
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
@@ -0,0 +1,680 @@
+# coding: utf-8
+"""Bulk loading of edits into a feature layer. Adds, updates and deletes are
+   split into chunks bounded by feature count and by request size, sent to
+   the layer's applyEdits operation a few at a time, and the per-feature
+   edit results are gathered back into a single summary in input order.
+
+      >>> import arcrest.edits
+      >>> loader = arcrest.edits.EditLoader(feature_layer, max_features=500)
+      >>> summary = loader.load(adds=features, deletes=[12, 13])
+      >>> summary.succeeded, summary.failed
+      (499998, 4)
+
+   With an L{EditJournal<arcrest.edits.EditJournal>}, every chunk and its
+   edit results are recorded in a local SQLite database as the load goes.
+   Running the same load again with the same journal skips the chunks that
+   were already committed, so a load that died part way through picks up
+   where it stopped without adding anything twice:
+
+      >>> journal = arcrest.edits.EditJournal("parcels_load.sqlite")
+      >>> loader = arcrest.edits.EditLoader(feature_layer, journal=journal)
+      >>> summary = loader.load(adds=read_features("parcels.json"))
+   """
+
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from . import compat
+from . import geometry
+from . import utils
+from .server import JsonArrayParameter, JsonPostResult, JsonResult
+from .server import RETRY_EXCEPTIONS, is_transient
+
+__all__ = ['EditChunk', 'EditSummary', 'EditJournal', 'EditLoader',
+           'EditBuffer']
+
+def _sql_literal(value):
+    "value as a literal in a where clause"
+    if isinstance(value, compat.string_type):
+        return "'%s'" % value.replace("'", "''")
+    return repr(value)
+
+class EditChunk(object):
+    """A set of edits sent in a single applyEdits request. adds and updates
+       are lists of features already serialized to JSON text, deletes a list
+       of object IDs (or global IDs). first maps 'adds', 'updates' and
+       'deletes' to the position in the input of the chunk's first edit of
+       that kind."""
+    def __init__(self, index):
+        self.index = index
+        self.adds, self.updates, self.deletes = [], [], []
+        self.first = {}
+        self.size = 0
+    def __len__(self):
+        return len(self.adds) + len(self.updates) + len(self.deletes)
+    def __repr__(self):
+        return "<EditChunk %i (%i adds, %i updates, %i deletes, %i bytes)>" % (
+                    self.index, len(self.adds), len(self.updates),
+                    len(self.deletes), self.size)
+    @property
+    def params(self):
+        "The adds, updates and deletes parameters for applyEdits"
+        return {'adds': JsonArrayParameter(self.adds) if self.adds else None,
+                'updates': JsonArrayParameter(self.updates)
+                                if self.updates else None,
+                'deletes': ",".join(str(objectid) for objectid in self.deletes)
+                                if self.deletes else None}
+    @property
+    def digest(self):
+        "A hash of the edits in this chunk, to recognize it in a journal"
+        payload = json.dumps([self.adds, self.updates, self.deletes])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    def failed_results(self, error):
+        """Edit results marking every edit in this chunk as failed because the
+           request itself failed with error."""
+        def failures(count):
+            return [{'success': False,
+                     'error': {'code': None, 'description': str(error)}}
+                    for i in range(count)]
+        return {'addResults': failures(len(self.adds)),
+                'updateResults': failures(len(self.updates)),
+                'deleteResults': failures(len(self.deletes))}
+
+class EditSummary(object):
+    """The outcome of an L{EditLoader<arcrest.edits.EditLoader>} run. The
+       addResults, updateResults and deleteResults lists hold one applyEdits
+       edit result per input edit, in input order. failedChunks lists the
+       (chunk, exception) pairs of requests that failed even after
+       retrying; their edits are reported as failed edit results."""
+    def __init__(self):
+        self.addResults, self.updateResults, self.deleteResults = [], [], []
+        self.chunks = 0
+        self.failedChunks = []
+    def _add(self, results):
+        self.chunks += 1
+        self.addResults.extend(results.get('addResults', []))
+        self.updateResults.extend(results.get('updateResults', []))
+        self.deleteResults.extend(results.get('deleteResults', []))
+    @property
+    def results(self):
+        "Every edit result, adds then updates then deletes"
+        return self.addResults + self.updateResults + self.deleteResults
+    @property
+    def succeeded(self):
+        "The number of edits that succeeded"
+        return sum(1 for result in self.results if result.get('success'))
+    @property
+    def failed(self):
+        "The number of edits that failed"
+        return sum(1 for result in self.results if not result.get('success'))
+    @property
+    def errors(self):
+        "The edit results of the edits that failed"
+        return [result for result in self.results if not result.get('success')]
+    def __repr__(self):
+        return "<EditSummary %i chunks: %i succeeded, %i failed>" % (
+                    self.chunks, self.succeeded, self.failed)
+
+class EditJournal(object):
+    """A write-ahead record of the chunks sent by an
+       L{EditLoader<arcrest.edits.EditLoader>}, kept in a SQLite database at
+       path. Each chunk is recorded as 'submitted' before its request is
+       made, then as 'committed' with the edit results the server returned
+       (object IDs, global IDs and success flags) or as 'failed' with the
+       error. A loader using the journal does not send committed chunks
+       again.
+
+       A chunk left as 'submitted' (the process died while its request was
+       in flight) or as 'failed' may or may not have been applied by the
+       server. Before sending it again, the loader looks up which of its adds
+       are already in the layer by the loader's key_field and only sends the
+       others; see L{EditLoader<arcrest.edits.EditLoader>}."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS chunks "
+                                     "(chunk INTEGER PRIMARY KEY, "
+                                     " digest TEXT NOT NULL, "
+                                     " adds INTEGER NOT NULL, "
+                                     " updates INTEGER NOT NULL, "
+                                     " deletes INTEGER NOT NULL, "
+                                     " status TEXT NOT NULL, "
+                                     " results TEXT, "
+                                     " error TEXT, "
+                                     " updated REAL NOT NULL)")
+            self._connection.commit()
+    def _record(self, chunk, status, results=None, error=None):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO chunks "
+                                     "(chunk, digest, adds, updates, deletes, "
+                                     " status, results, error, updated) "
+                                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (chunk.index, chunk.digest,
+                                      len(chunk.adds), len(chunk.updates),
+                                      len(chunk.deletes), status,
+                                      json.dumps(results)
+                                          if results is not None else None,
+                                      str(error) if error is not None else None,
+                                      time.time()))
+            self._connection.commit()
+    def record_submitted(self, chunk):
+        "Note that chunk's request is about to be made"
+        self._record(chunk, 'submitted')
+    def record_results(self, chunk, results):
+        "Store the edit results the server returned for chunk"
+        self._record(chunk, 'committed', results=results)
+    def record_failure(self, chunk, error):
+        "Note that chunk's request failed with error"
+        self._record(chunk, 'failed', error=error)
+    def _row(self, chunk):
+        "The (digest, status, results) row of chunk, or None"
+        with self._lock:
+            row = self._connection.execute("SELECT digest, status, results "
+                                           "FROM chunks WHERE chunk = ?",
+                                           (chunk.index,)).fetchone()
+        if row is not None and row[0] != chunk.digest:
+            raise ValueError("Chunk %i does not match the edits recorded in "
+                             "journal %r" % (chunk.index, self.path))
+        return row
+    def lookup(self, chunk):
+        """Return the stored edit results of chunk if it was committed, or
+           None. Raises ValueError if the journal holds different edits under
+           the same chunk number, as it would for a different input."""
+        row = self._row(chunk)
+        if row is None or row[1] != 'committed':
+            return None
+        return json.loads(row[2])
+    def chunk_status(self, chunk):
+        """The status recorded for chunk ('submitted', 'committed' or
+           'failed'), or None if it was never sent. Raises ValueError like
+           lookup."""
+        row = self._row(chunk)
+        return row[1] if row is not None else None
+    @property
+    def status(self):
+        "A dict of the number of chunks in each status"
+        with self._lock:
+            return dict(self._connection.execute("SELECT status, COUNT(*) "
+                                                 "FROM chunks "
+                                                 "GROUP BY status").fetchall())
+    def results(self):
+        """Yield (chunk number, edit results) for every committed chunk, in
+           chunk order"""
+        with self._lock:
+            rows = self._connection.execute("SELECT chunk, results "
+                                            "FROM chunks "
+                                            "WHERE status = 'committed' "
+                                            "ORDER BY chunk").fetchall()
+        for index, results in rows:
+            yield index, json.loads(results)
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM chunks")
+            self._connection.commit()
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class EditLoader(object):
+    """Loads any number of edits into a
+       L{FeatureLayer<arcrest.server.FeatureLayer>} through a series of
+       applyEdits requests.
+
+       @param layer: The FeatureLayer to edit
+       @param max_features: The most edits to send in one request
+       @param max_bytes: The largest size (of the serialized adds, updates
+                         and deletes) to send in one request. A single
+                         feature bigger than this is sent on its own.
+       @param workers: The number of requests to have in flight at once
+       @param retries: The number of times to retry a request that failed
+                       on a transient error (see
+                       L{is_transient<arcrest.server.is_transient>}); only
+                       the failed chunks are sent again, after all of the
+                       others are done.
+       @param useGlobalIds: Passed to applyEdits; deletes are then global IDs
+       @param rollbackOnFailure: Passed to applyEdits; the edits in a chunk
+                                 are then applied all together or not at all
+       @param journal: An optional L{EditJournal<arcrest.edits.EditJournal>}
+                       to record the load in and to resume it from. The
+                       input and the chunk limits must be the same when
+                       resuming, so the chunks come out the same.
+       @param key_field: An attribute whose value uniquely identifies each
+                         added feature, such as a client-assigned key or,
+                         with useGlobalIds, the layer's globalIdField (the
+                         default then). When a journal shows a chunk was
+                         sent before without its results coming back, the
+                         layer is queried for these keys and the adds it
+                         already holds are not added again. Without a
+                         key_field, resuming a chunk left 'submitted' that
+                         holds adds raises ValueError rather than risk
+                         adding them twice.
+    """
+    def __init__(self, layer, max_features=1000, max_bytes=2000000,
+                 workers=4, retries=2, useGlobalIds=None,
+                 rollbackOnFailure=None, journal=None, key_field=None):
+        self.layer = layer
+        self.max_features, self.max_bytes = max_features, max_bytes
+        self.workers, self.retries = workers, retries
+        self.useGlobalIds = useGlobalIds
+        self.rollbackOnFailure = rollbackOnFailure
+        self.journal = journal
+        if key_field is None and useGlobalIds:
+            key_field = layer._json_struct.get('globalIdField')
+        self.key_field = key_field
+    def chunks(self, adds=None, updates=None, deletes=None):
+        """Yield EditChunks covering adds, then updates, then deletes. Each of
+           these may be any iterable (such as a generator over a large file);
+           features are serialized one at a time as the chunks are needed."""
+        edits = []
+        if adds:
+            edits.append(('adds', self.layer._serialized_features(adds)))
+        if updates:
+            edits.append(('updates', self.layer._serialized_features(updates)))
+        if deletes:
+            edits.append(('deletes', (str(objectid) for objectid in deletes)))
+        chunk = EditChunk(0)
+        for kind, items in edits:
+            for position, item in enumerate(items):
+                size = len(item) + 1
+                if len(chunk) and (len(chunk) >= self.max_features or
+                                   chunk.size + size > self.max_bytes):
+                    yield chunk
+                    chunk = EditChunk(chunk.index + 1)
+                chunk.first.setdefault(kind, position)
+                getattr(chunk, kind).append(item)
+                chunk.size += size
+        if len(chunk):
+            yield chunk
+    def submit(self, chunk):
+        "Send a chunk in one applyEdits request and return its edit results"
+        params = chunk.params
+        params['useGlobalIds'] = self.useGlobalIds
+        params['rollbackOnFailure'] = self.rollbackOnFailure
+        result = self.layer._get_subfolder("./applyEdits", JsonPostResult,
+                                           params)
+        return result._json_struct
+    def _existing_adds(self, chunk):
+        """For each add of chunk, the edit result of the feature already in
+           the layer with its key_field value, or None if there is none"""
+        if self.key_field is None:
+            raise ValueError("Chunk %i may already have been applied; set "
+                             "key_field so its adds aren't added twice" %
+                             chunk.index)
+        keys = [json.loads(add)['attributes'].get(self.key_field)
+                for add in chunk.adds]
+        if all(key is None for key in keys):
+            return keys
+        objectIdField = self.layer._json_struct.get('objectIdField',
+                                                    'OBJECTID')
+        where = "%s IN (%s)" % (self.key_field,
+                                ", ".join(_sql_literal(key) for key in keys
+                                          if key is not None))
+        found = self.layer._get_subfolder("./query", JsonResult,
+                                          {'where': where,
+                                           'outFields': ",".join(
+                                               (objectIdField,
+                                                self.key_field)),
+                                           'returnGeometry': False})
+        existing = {}
+        for feature in found._json_struct.get('features', []):
+            attributes = feature['attributes']
+            result = {'objectId': attributes.get(objectIdField),
+                      'success': True}
+            if self.useGlobalIds:
+                result['globalId'] = attributes.get(self.key_field)
+            existing[attributes.get(self.key_field)] = result
+        return [existing.get(key) if key is not None else None
+                for key in keys]
+    def _reconcile(self, chunk):
+        """Submit a chunk that may have been applied before, leaving out the
+           adds the layer already holds; their edit results are made up from
+           the features found"""
+        existing = self._existing_adds(chunk)
+        remaining = EditChunk(chunk.index)
+        remaining.adds = [add for add, result in zip(chunk.adds, existing)
+                          if result is None]
+        remaining.updates, remaining.deletes = chunk.updates, chunk.deletes
+        results = self.submit(remaining) if len(remaining) else {}
+        sent = iter(results.get('addResults', []))
+        results['addResults'] = [result if result is not None else next(sent)
+                                 for result in existing]
+        results.setdefault('updateResults', [])
+        results.setdefault('deleteResults', [])
+        return results
+    def _attempt(self, chunk):
+        """Submit a chunk (unless the journal shows it was committed before),
+           returning (chunk, results, None) or (chunk, None, exception)"""
+        journal, sent_before = self.journal, False
+        if journal is not None:
+            results = journal.lookup(chunk)
+            if results is not None:
+                return chunk, results, None
+            status = journal.chunk_status(chunk)
+            # A failed request may have timed out after the server applied it
+            sent_before = chunk.adds and (status == 'submitted' or
+                                          (status == 'failed' and
+                                           self.key_field is not None))
+            journal.record_submitted(chunk)
+        try:
+            if sent_before:
+                results = self._reconcile(chunk)
+            else:
+                results = self.submit(chunk)
+        except RETRY_EXCEPTIONS as e:
+            if journal is not None:
+                journal.record_failure(chunk, e)
+            return chunk, None, e
+        if journal is not None:
+            journal.record_results(chunk, results)
+        return chunk, results, None
+    def _run(self, chunks):
+        """Submit every chunk, then resubmit the chunks whose requests failed
+           on transient errors up to retries times. Returns (chunk, results,
+           error) for every chunk in chunk order; chunk is None for chunks
+           that succeeded, so their serialized features need not be held in
+           memory."""
+        outcomes, pending = {}, chunks
+        for attempt in range(self.retries + 1):
+            failed = []
+            for chunk, results, error in utils.imap_parallel(self._attempt,
+                                                             pending,
+                                                             self.workers):
+                if error is None:
+                    outcomes[chunk.index] = (None, results, None)
+                else:
+                    outcomes[chunk.index] = (chunk, None, error)
+                    if is_transient(error):
+                        failed.append(chunk)
+            if not failed:
+                break
+            pending = failed
+        return [outcomes[index] for index in sorted(outcomes)]
+    def load(self, adds=None, updates=None, deletes=None):
+        """Apply all of the adds, updates and deletes and return an
+           L{EditSummary<arcrest.edits.EditSummary>}."""
+        summary = EditSummary()
+        for chunk, results, error in self._run(self.chunks(adds, updates,
+                                                           deletes)):
+            if results is None:
+                summary.failedChunks.append((chunk, error))
+                results = chunk.failed_results(error)
+            summary._add(results)
+        return summary
+
+class EditBuffer(object):
+    """Collects adds, updates and deletes for a
+       L{FeatureLayer<arcrest.server.FeatureLayer>} and sends them together
+       through L{EditLoader<arcrest.edits.EditLoader>} once max_edits are
+       pending, once the oldest pending edit is max_age seconds old, or when
+       flush() is called. Repeated updates to the same object ID are merged
+       into one (later attribute values win), and deleting an object drops
+       its pending update.
+
+       If a flush is running and max_pending edits are already waiting,
+       further edits block until there is room again, as does an edit that
+       fills the buffer while the previous flush is still running; the time
+       spent waiting is reported as back-pressure in the metrics.
+
+       The edits of a request that still failed after the loader's retries
+       are put back in the buffer, ahead of newer edits, to be sent with the
+       next flush. If the request failed on a permanent server error instead
+       (see L{is_transient<arcrest.server.is_transient>}), retrying won't
+       help: flush raises that error, keeping the summary in last_summary.
+
+          >>> with feature_layer.edit_buffer(max_edits=500, max_age=5) as edits:
+          ...     for event in stream:
+          ...         edits.update(event_to_feature(event))
+          >>> edits.metrics['requests_saved']
+          48213
+
+       @param layer: The FeatureLayer to edit
+       @param max_edits: Flush once this many edits are pending
+       @param max_age: Flush once the oldest pending edit is this many
+                       seconds old (checked by a background thread); None
+                       to only flush on size or by hand
+       @param max_pending: Block new edits while a flush is running and
+                           this many are already waiting; defaults to four
+                           times max_edits
+       @param objectIdField: The attribute holding the object ID of updated
+                             features; taken from the layer if not given
+       @param loader_options: Passed on to the EditLoader (max_features,
+                              workers, rollbackOnFailure and so on)
+    """
+    def __init__(self, layer, max_edits=1000, max_age=None, max_pending=None,
+                 objectIdField=None, **loader_options):
+        self.layer = layer
+        self.max_edits, self.max_age = max_edits, max_age
+        self.max_pending = max_pending or max_edits * 4
+        if objectIdField is None:
+            objectIdField = layer._json_struct.get('objectIdField',
+                                                   'OBJECTID')
+        self.objectIdField = objectIdField
+        self.loader = EditLoader(layer, **loader_options)
+        self.last_summary = self.last_error = None
+        self._adds, self._updates, self._deletes = [], {}, []
+        self._oldest = None
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._flushing = False
+        self._closed = False
+        self._stats = {'edits': 0, 'merged': 0, 'flushes': 0, 'requests': 0,
+                       'failed': 0, 'requeued': 0, 'flush_seconds': 0.0,
+                       'max_flush_seconds': 0.0, 'blocked_seconds': 0.0}
+        self._thread = None
+        if max_age is not None:
+            self._thread = threading.Thread(target=self._age_flusher)
+            self._thread.daemon = True
+            self._thread.start()
+    def __len__(self):
+        with self._lock:
+            return self._pending
+    def __enter__(self):
+        return self
+    def __exit__(self, t, ex, tb):
+        self.close()
+    @property
+    def _pending(self):
+        return len(self._adds) + len(self._updates) + len(self._deletes)
+    def _object_id(self, feature):
+        attributes = getattr(feature, 'attributes', None) or {}
+        if self.objectIdField in attributes:
+            return attributes[self.objectIdField]
+        field = self.objectIdField.lower()
+        for key, value in attributes.items():
+            if key.lower() == field:
+                return value
+        raise ValueError("Feature has no %r attribute to update by" %
+                         self.objectIdField)
+    def _queue(self, store):
+        """Wait out back-pressure, then call store (which adds to the pending
+           edits) and flush if that filled the buffer"""
+        with self._lock:
+            if self._closed:
+                raise ValueError("Edit buffer is closed")
+            if self._flushing and self._pending >= self.max_pending:
+                started = time.time()
+                while self._flushing and self._pending >= self.max_pending:
+                    self._lock.wait()
+                self._stats['blocked_seconds'] += time.time() - started
+            store()
+            self._stats['edits'] += 1
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = self._pending >= self.max_edits
+        if full:
+            self._flush(producer=True)
+    def add(self, feature):
+        "Queue a new feature to be added"
+        self._queue(lambda: self._adds.append(feature))
+    def update(self, feature):
+        """Queue an update to the feature with feature's object ID, merging it
+           into any update to the same feature already pending"""
+        objectid = self._object_id(feature)
+        def store():
+            pending = self._updates.get(objectid)
+            if pending is None:
+                self._updates[objectid] = feature
+                return
+            self._stats['merged'] += 1
+            self._updates[objectid] = self._merge(pending, feature)
+        self._queue(store)
+    def _merge(self, pending, feature):
+        "An update to a feature combining a pending update and a newer one"
+        # The newest geometry wins, unless this update is attributes only
+        merged = copy.copy(pending if isinstance(feature,
+                                                 geometry.NullGeometry)
+                           else feature)
+        merged.attributes = dict(getattr(pending, 'attributes', None) or {})
+        merged.attributes.update(getattr(feature, 'attributes', None) or {})
+        return merged
+    def delete(self, objectid):
+        "Queue the feature with objectid for deletion"
+        def store():
+            if self._updates.pop(objectid, None) is not None:
+                self._stats['merged'] += 1
+            self._deletes.append(objectid)
+        self._queue(store)
+    def flush(self):
+        """Send every pending edit now. Returns the
+           L{EditSummary<arcrest.edits.EditSummary>} of the flush, or None if
+           nothing was pending."""
+        return self._flush()
+    def _flush(self, producer=False):
+        """flush(); a producer (a caller of add, update or delete) waiting for
+           a running flush to end is counted as blocked"""
+        if not self._flush_lock.acquire(False):
+            started = time.time()
+            self._flush_lock.acquire()
+            if producer:
+                with self._lock:
+                    self._stats['blocked_seconds'] += time.time() - started
+        try:
+            with self._lock:
+                adds, updates, deletes = (self._adds, self._updates,
+                                          self._deletes)
+                oldest = self._oldest
+                self._adds, self._updates, self._deletes = [], {}, []
+                self._oldest = None
+                if not (adds or updates or deletes):
+                    return None
+                self._flushing = True
+            started = time.time()
+            update_list = list(updates.values())
+            try:
+                summary = self.loader.load(adds, update_list, deletes)
+                retry = [(chunk, error) for chunk, error
+                         in summary.failedChunks if is_transient(error)]
+                failed_adds, failed_updates, failed_deletes = \
+                    self._failed_edits(retry, adds, update_list, deletes)
+                self._restore(failed_adds, failed_updates, failed_deletes,
+                              oldest)
+            except:
+                self._restore(adds, updates, deletes, oldest)
+                raise
+            finally:
+                elapsed = time.time() - started
+                with self._lock:
+                    self._flushing = False
+                    self._lock.notify_all()
+            with self._lock:
+                self.last_summary = summary
+                stats = self._stats
+                stats['flushes'] += 1
+                stats['requests'] += summary.chunks
+                stats['failed'] += summary.failed
+                stats['requeued'] += sum(len(chunk) for chunk, error in retry)
+                stats['flush_seconds'] += elapsed
+                stats['max_flush_seconds'] = max(stats['max_flush_seconds'],
+                                                 elapsed)
+            for chunk, error in summary.failedChunks:
+                if not is_transient(error):
+                    raise error
+            return summary
+        finally:
+            self._flush_lock.release()
+    def _failed_edits(self, failed_chunks, adds, updates, deletes):
+        """The adds, updates (by object ID) and deletes sent in
+           failed_chunks, from the adds, updates and deletes of a flush"""
+        failed_adds, failed_updates, failed_deletes = [], {}, []
+        for chunk, error in failed_chunks:
+            def sent(kind, edits):
+                start = chunk.first.get(kind, 0)
+                return edits[start:start + len(getattr(chunk, kind))]
+            failed_adds.extend(sent('adds', adds))
+            for feature in sent('updates', updates):
+                failed_updates[self._object_id(feature)] = feature
+            failed_deletes.extend(sent('deletes', deletes))
+        return failed_adds, failed_updates, failed_deletes
+    def _restore(self, adds, updates, deletes, oldest):
+        """Put the edits of a failed flush back, ahead of the edits queued
+           since"""
+        if not (adds or updates or deletes):
+            return
+        with self._lock:
+            for objectid, feature in self._updates.items():
+                if objectid in updates:
+                    feature = self._merge(updates[objectid], feature)
+                updates[objectid] = feature
+            deleted = set(self._deletes)
+            self._updates = dict((objectid, feature)
+                                 for objectid, feature in updates.items()
+                                 if objectid not in deleted)
+            self._adds = adds + self._adds
+            self._deletes = deletes + self._deletes
+            if self._oldest is None or oldest < self._oldest:
+                self._oldest = oldest
+    def _age_flusher(self):
+        "Background thread flushing once the oldest pending edit is too old"
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                if self._oldest is None:
+                    wait = self.max_age
+                else:
+                    wait = self._oldest + self.max_age - time.time()
+                if wait > 0:
+                    self._lock.wait(wait)
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                # Nobody is waiting on this thread; keep the error around,
+                # and give the server a while before trying the edits again
+                self.last_error = e
+                with self._lock:
+                    if not self._closed:
+                        self._lock.wait(self.max_age)
+    @property
+    def metrics(self):
+        """A dict of counters for this buffer: edits received, edits merged
+           away, flushes and applyEdits requests made, requests saved over
+           one request per edit, failed edits and those of them put back to
+           retry, pending edits and the age in
+           seconds of the oldest one, flush latency (total, mean and max
+           seconds) and seconds callers spent blocked by back-pressure."""
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics['pending'] = self._pending
+            metrics['pending_age'] = (time.time() - self._oldest
+                                      if self._oldest is not None else 0.0)
+        metrics['mean_flush_seconds'] = (metrics['flush_seconds'] /
+                                         metrics['flushes']
+                                         if metrics['flushes'] else 0.0)
+        metrics['requests_saved'] = max(metrics['edits'] - metrics['pending'] -
+                                        metrics['requests'], 0)
+        return metrics
+    def close(self):
+        "Flush anything still pending and stop the background thread"
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._closed = True
+                self._lock.notify_all()
@@ -0,0 +1,154 @@
+# coding: utf-8
+"""Geocoding of any number of addresses with a geocode service. Addresses
+   are sent in batches to the locator's geocodeAddresses operation, a few
+   batches at a time, or one by one to findAddressCandidates on locators
+   without batch geocoding. Input is read lazily and results come out in
+   input order as they are ready, so addresses may be streamed from a file:
+
+      >>> import csv
+      >>> import arcrest.geocoding
+      >>> geocoder = arcrest.geocoding.BatchGeocoder(geocode_service,
+      ...                                            workers=4)
+      >>> rows = csv.DictReader(open("customers.csv"))
+      >>> addresses = ({'Address': row['street'], 'City': row['city'],
+      ...               'Zip': row['zip']} for row in rows)
+      >>> for address, match in geocoder.geocode(addresses):
+      ...     if match is not None:
+      ...         print(match['location'], match['score'])
+
+   Each match is a candidate dict like those of
+   L{FindAddressCandidatesResult<arcrest.server.FindAddressCandidatesResult>}:
+   the matched address, its score and attributes and its location as a
+   Point. Addresses the locator couldn't match come out with None.
+   """
+
+from . import geometry
+from . import utils
+from .server import RETRY_EXCEPTIONS, is_transient
+
+__all__ = ['BatchGeocoder']
+
+#: The batch size used with locators that don't suggest one
+DEFAULT_BATCH_SIZE = 100
+
+#: Error codes of a geocodeAddresses request the locator can't serve at all
+NO_BATCH_ERROR_CODES = frozenset([403, 404, 405, 501])
+
+def _error_code(error):
+    "The HTTP or server error code of a failed request, or None"
+    try:
+        return int(getattr(error, 'code', None))
+    except (TypeError, ValueError):
+        return None
+
+class BatchGeocoder(object):
+    """Geocodes addresses with a
+       L{GeocodeService<arcrest.server.GeocodeService>} on up to workers
+       threads. Addresses are dicts of the locator's address fields, or
+       strings for its single line address field.
+
+       Batches are batch_size addresses, by default the locator's
+       SuggestedBatchSize, and never more than its MaxBatchSize. Locators
+       that don't advertise a MaxBatchSize, or that turn out not to
+       support geocodeAddresses, are asked one address at a time with
+       findAddressCandidates, keeping the best scoring candidate. A batch
+       whose request fails in passing is tried again up to retries times,
+       then its addresses are asked one at a time. outFields is passed on
+       to the locator to pick the candidate attributes returned."""
+    def __init__(self, service, batch_size=None, workers=4, outSR=None,
+                 outFields='*', retries=2):
+        self.service = service
+        self.workers = workers
+        self.retries = retries
+        self.outSR = outSR
+        self.outFields = outFields
+        properties = service.locatorProperties
+        max_batch_size = properties.get('MaxBatchSize')
+        self.batch_size = min(batch_size or
+                                properties.get('SuggestedBatchSize') or
+                                DEFAULT_BATCH_SIZE,
+                              max_batch_size or DEFAULT_BATCH_SIZE)
+        self.batch = bool(max_batch_size)
+    def _fields(self, address):
+        "The address fields of an address dict or single line string"
+        if isinstance(address, dict):
+            return address
+        field = self.service.singleLineAddressField
+        if not field:
+            raise ValueError("This locator has no single line address "
+                             "field; pass addresses as dicts of fields")
+        return {field['name']: address}
+    def _chunks(self, addresses):
+        """Split addresses into the lists sent to workers: batches while
+           batch geocoding works, single addresses once it doesn't"""
+        chunk = []
+        for address in addresses:
+            chunk.append(address)
+            if len(chunk) >= (self.batch_size if self.batch else 1):
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    def _candidate(self, location):
+        "A geocoded location as a candidate dict, or None for no match"
+        point = location.get('location') or {}
+        x = point.get('x')
+        # Unmatched addresses have a score of 0 and a NaN location
+        if not location.get('score') or x is None or x == 'NaN' or x != x:
+            return None
+        candidate = dict(location)
+        candidate['location'] = geometry.fromJson(point)
+        return candidate
+    def geocode_batch(self, addresses):
+        """Geocode a list of addresses with one geocodeAddresses request and
+           return the match (or None) of each, in order"""
+        records = []
+        for index, address in enumerate(addresses):
+            fields = dict(self._fields(address))
+            # Object IDs start at 1
+            fields['OBJECTID'] = index + 1
+            records.append(fields)
+        result = self.service.GeocodeAddresses(records, self.outSR)
+        matches = [None] * len(addresses)
+        for location in result.get('locations', []):
+            objectid = (location.get('attributes') or {}).get('ResultID')
+            if objectid is not None and 0 < objectid <= len(matches):
+                matches[objectid - 1] = self._candidate(location)
+        return matches
+    def geocode_one(self, address):
+        """Geocode an address with findAddressCandidates and return its
+           best scoring candidate, or None"""
+        candidates = self.service.FindAddressCandidates(
+                                                outFields=self.outFields,
+                                                outSR=self.outSR,
+                                                **self._fields(address)
+                                                        ).candidates
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: candidate['score'])
+    def _geocode_chunk(self, chunk):
+        if self.batch and len(chunk) > 1:
+            geocode_batch = utils.with_retries(
+                self.geocode_batch, self.retries, RETRY_EXCEPTIONS,
+                retry_if=lambda error: (is_transient(error) and
+                                        _error_code(error) not in
+                                            NO_BATCH_ERROR_CODES))
+            try:
+                return chunk, geocode_batch(chunk)
+            except RETRY_EXCEPTIONS as e:
+                if _error_code(e) in NO_BATCH_ERROR_CODES:
+                    # No batch geocoding after all: this chunk and the rest
+                    # go one address at a time, on every worker
+                    self.batch = False
+                # Otherwise just this chunk goes one address at a time
+        return chunk, [self.geocode_one(address) for address in chunk]
+    def geocode(self, addresses):
+        """Yield (address, match) for every address in addresses, in input
+           order; match is the best candidate dict, or None if the address
+           couldn't be matched. addresses may be any iterable, and is only
+           read a few batches ahead of the results."""
+        for chunk, matches in utils.imap_parallel(self._geocode_chunk,
+                                                  self._chunks(addresses),
+                                                  self.workers):
+            for address, match in zip(chunk, matches):
+                yield address, match
@@ -3,10 +3,23 @@
    as returned by the REST API. The REST API supports 4 geometry types - 
    points, polylines, polygons and envelopes."""
 
+import array
+import binascii
+import heapq
+import itertools
 import json
+import re
+import struct
+import sys
 
+from . import compat
 from .projections import projected, geographic
 
+try:
+    basestring
+except NameError:
+    basestring = str
+
 def pointlist(points, sr):
     """Convert a list of the form [[x, y] ...] to a list of Point instances
        with the given x, y coordinates."""
@@ -21,6 +34,198 @@ def listofpointlist(ptlist, sr):
        Point instances with the given x, y coordinates."""
     return [pointlist(listofpoints, sr) for listofpoints in ptlist]
 
+def boundsoflistofpointlist(ptlist):
+    """Return the (xmin, ymin, xmax, ymax) bounds of a list of lists of Point
+       instances, or None if there are no points. The coordinates are pulled
+       out in one pass and reduced with the builtin min/max."""
+    xs = [pt.x for points in ptlist for pt in points]
+    if not xs:
+        return None
+    ys = [pt.y for points in ptlist for pt in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def partsfromlistofpointlist(ptlist):
+    """Convert a list of lists of Point instances (or [x, y] pairs) to a list
+       of flat array('d') buffers of interleaved x, y coordinates."""
+    return [array.array('d', [coord for pt in points
+                                    for coord in ((pt.x, pt.y)
+                                                  if isinstance(pt, Point)
+                                                  else (pt[0], pt[1]))])
+            for points in ptlist]
+
+def listofpointlistfromparts(parts, sr):
+    """Convert a list of flat array('d') buffers of interleaved x, y
+       coordinates to a list of lists of Point instances."""
+    return [[Point(x, y, sr) for x, y in zip(part[0::2], part[1::2])]
+            for part in parts]
+
+def jsonfromparts(parts):
+    """Convert a list of flat array('d') buffers of interleaved x, y
+       coordinates to a list of lists of [x, y] pairs, as in the JSON
+       representation of paths and rings."""
+    return [[[x, y] for x, y in zip(part[0::2], part[1::2])]
+            for part in parts]
+
+def boundsofparts(parts):
+    """Return the (xmin, ymin, xmax, ymax) bounds of a list of flat
+       array('d') coordinate buffers, or None if they are all empty. Each
+       buffer is reduced with the builtin min/max over strided slices."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return None
+    return (min(min(part[0::2]) for part in parts),
+            min(min(part[1::2]) for part in parts),
+            max(max(part[0::2]) for part in parts),
+            max(max(part[1::2]) for part in parts))
+
+def unionofbounds(boundslist):
+    """Return the (xmin, ymin, xmax, ymax) bounds enclosing every bounds
+       tuple in boundslist, skipping empty (None) entries. Returns None if
+       there is nothing to enclose."""
+    boundslist = [bounds for bounds in boundslist if bounds is not None]
+    if not boundslist:
+        return None
+    return (min(bounds[0] for bounds in boundslist),
+            min(bounds[1] for bounds in boundslist),
+            max(bounds[2] for bounds in boundslist),
+            max(bounds[3] for bounds in boundslist))
+
+# Compressed geometry strings are a series of signed base 32 integers
+_compressed_number = re.compile("[+-][0-9a-v]+")
+_base32_digits = "0123456789abcdefghijklmnopqrstuv"
+# All 1 and 2 digit base 32 strings, so numbers are converted 10 bits at a time
+_base32_pairs = [_base32_digits[value >> 5] + _base32_digits[value & 0x1F]
+                 for value in range(1024)]
+_base32_small = [_base32_pairs[value].lstrip('0') or '0'
+                 for value in range(1024)]
+
+def _compressed_number_string(number):
+    "Format an integer as a signed base 32 compressed geometry number"
+    sign = '+'
+    if number < 0:
+        sign, number = '-', -number
+    if number < 1024:
+        return sign + _base32_small[number]
+    chunks = []
+    while number >= 1024:
+        chunks.append(_base32_pairs[number & 0x3FF])
+        number >>= 10
+    chunks.append(_base32_small[number] if number else '')
+    return sign + ''.join(reversed(chunks))
+
+def _douglas_peucker(part, tolerance):
+    """Douglas-Peucker simplification of a flat coordinate buffer: keep the
+       end points and, recursively, any vertex more than tolerance map units
+       from the chord between the vertices kept on either side of it."""
+    count = len(part) // 2
+    if count < 3:
+        return array.array('d', part)
+    xs, ys = part[0::2], part[1::2]
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    squared_tolerance = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = xs[first], ys[first]
+        dx, dy = xs[last] - x0, ys[last] - y0
+        length = dx * dx + dy * dy
+        farthest, farthest_distance = None, squared_tolerance
+        for index in range(first + 1, last):
+            px, py = xs[index] - x0, ys[index] - y0
+            if length:
+                # Squared distance to the chord, clamped to its end points
+                t = max(0.0, min(1.0, (px * dx + py * dy) / length))
+                px, py = px - t * dx, py - t * dy
+            distance = px * px + py * py
+            if distance > farthest_distance:
+                farthest, farthest_distance = index, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    simplified = array.array('d')
+    for index in range(count):
+        if keep[index]:
+            simplified.extend((xs[index], ys[index]))
+    return simplified
+
+def _visvalingam_whyatt(part, tolerance):
+    """Visvalingam-Whyatt simplification of a flat coordinate buffer:
+       repeatedly drop the vertex whose triangle with its two neighbors has
+       the smallest area, until every remaining triangle has an area of at
+       least tolerance squared. The end points are always kept."""
+    count = len(part) // 2
+    if count < 3:
+        return array.array('d', part)
+    xs, ys = part[0::2], part[1::2]
+    previous, following = list(range(-1, count - 1)), list(range(1, count + 1))
+    def area(index):
+        before, after = previous[index], following[index]
+        return abs((xs[before] - xs[index]) * (ys[after] - ys[index]) -
+                   (xs[after] - xs[index]) * (ys[before] - ys[index])) / 2.0
+    areas = [None] + [area(index) for index in range(1, count - 1)] + [None]
+    heap = [(areas[index], index) for index in range(1, count - 1)]
+    heapq.heapify(heap)
+    threshold, removed = tolerance * tolerance, [False] * count
+    while heap:
+        vertex_area, index = heapq.heappop(heap)
+        if removed[index] or vertex_area != areas[index]:
+            # A stale entry left behind when a neighbor was removed
+            continue
+        if vertex_area >= threshold:
+            break
+        removed[index] = True
+        before, after = previous[index], following[index]
+        following[before], previous[after] = after, before
+        for neighbor in (before, after):
+            if 0 < neighbor < count - 1:
+                # Never let a vertex's area drop below one already removed,
+                # so the removal order stays monotonic
+                areas[neighbor] = max(area(neighbor), vertex_area)
+                heapq.heappush(heap, (areas[neighbor], neighbor))
+    simplified = array.array('d')
+    for index in range(count):
+        if not removed[index]:
+            simplified.extend((xs[index], ys[index]))
+    return simplified
+
+_generalizers = {'douglas-peucker': _douglas_peucker,
+                 'visvalingam': _visvalingam_whyatt}
+
+def _generalizer(method):
+    try:
+        return _generalizers[method]
+    except KeyError:
+        raise ValueError("Unknown generalization method %r (expected one of "
+                         "%s)" % (method, ", ".join(sorted(_generalizers))))
+
+def _generalized_ring(ring, simplify, tolerance):
+    """Simplify a closed ring by splitting it at the vertex farthest from
+       its start, so neither half is a closed loop. Rings that would
+       collapse below a triangle are returned unchanged."""
+    count = len(ring) // 2
+    if count < 5:
+        return ring
+    x0, y0 = ring[0], ring[1]
+    split = max(range(1, count - 1),
+                key=lambda index: (ring[2 * index] - x0) ** 2 +
+                                  (ring[2 * index + 1] - y0) ** 2)
+    simplified = simplify(ring[:2 * split + 2], tolerance)
+    simplified.extend(simplify(ring[2 * split:], tolerance)[2:])
+    if len(simplified) < 8:
+        return ring
+    return simplified
+
+def generalize(geometries, tolerance, method='douglas-peucker'):
+    """Return a list holding a generalized copy of each geometry; see
+       L{Polyline.generalize<arcrest.geometry.Polyline.generalize>}. Only
+       polylines and polygons have vertices to remove, other geometries are
+       passed through as they are."""
+    if isinstance(geometries, Geometry):
+        geometries = [geometries]
+    return [geom.generalize(tolerance, method) for geom in geometries]
+
 class Geometry(object):
     """Represents an abstract base for json-represented geometries on
        the ArcGIS Server REST API. Please refer to 
@@ -40,6 +245,28 @@ class Geometry(object):
     def __geo_interface__(self):
         raise NotImplementedError("Unimplemented conversion to GeoJSON")
     @property
+    def _bounds(self):
+        "The (xmin, ymin, xmax, ymax) tuple of this geometry, None if empty"
+        raise NotImplementedError("Bounds not implemented for %r" %
+                                   self.__class__.__name__)
+    @property
+    def _vertex_count(self):
+        "The number of vertices needed to describe this geometry"
+        return 0
+    @property
+    def envelope(self):
+        """The bounding L{Envelope<arcrest.geometry.Envelope>} of this
+           geometry in its spatial reference, or None if it is empty."""
+        bounds = self._bounds
+        if bounds is None:
+            return None
+        return Envelope(bounds[0], bounds[1], bounds[2], bounds[3],
+                        self.spatialReference)
+    @property
+    def extent(self):
+        "Synonym for .envelope"
+        return self.envelope
+    @property
     def _json_struct_without_sr(self):
         return self._json_struct
     @property
@@ -54,6 +281,23 @@ class Geometry(object):
                  'attributes': getattr(self, 'attributes', {})}
     def __str__(self):
         return json.dumps(self._json_struct)
+    def generalize(self, tolerance, method='douglas-peucker'):
+        """Return a copy of this geometry with vertices that are within
+           tolerance map units of the generalized line removed. Only
+           polylines and polygons are generalized; this returns the geometry
+           itself for other types."""
+        return self
+    def asWKT(self):
+        "Return this geometry as OGC well-known text"
+        return toWKT(self)
+    def asWKB(self):
+        "Return this geometry as OGC well-known binary"
+        return toWKB(self)
+    def asEWKB(self):
+        """Return this geometry as PostGIS extended well-known binary, with
+           the SRID taken from its spatial reference"""
+        return toWKB(self, self.spatialReference.wkid
+                               if self.spatialReference else None)
     @classmethod
     def fromJson(cls, struct):
         raise NotImplementedError("Unimplemented convert from JSON")
@@ -69,6 +313,9 @@ class NullGeometry(Geometry):
     def __geo_interface__(self):
         return None
     @property
+    def _bounds(self):
+        return None
+    @property
     def _json_struct(self):
         return None
     def __repr__(self):
@@ -182,6 +429,12 @@ class Point(Geometry):
     def __getitem__(self, index):
         return [self.x, self.y][index]
     @property
+    def _bounds(self):
+        return (self.x, self.y, self.x, self.y)
+    @property
+    def _vertex_count(self):
+        return 1
+    @property
     def __geo_interface__(self):
         retval = {
             'type': 'Point',
@@ -241,7 +494,51 @@ class Polyline(Geometry):
         if not isinstance(spatialReference, SpatialReference):
             spatialReference = SpatialReference(spatialReference)
         self.spatialReference = spatialReference
-        self.paths = listofpointlist(paths, spatialReference)
+        self.paths = paths
+    _parts = None
+    @property
+    def paths(self):
+        """The list of paths (lists of Points) in this Polyline. The lists and
+           Points handed out here may be modified in place; the envelope
+           always reflects them."""
+        if self._paths is None:
+            self._paths = listofpointlistfromparts(self._parts,
+                                                  self.spatialReference)
+            self._parts = None
+        return self._paths
+    @paths.setter
+    def paths(self, paths):
+        self._paths = listofpointlist(paths, self.spatialReference)
+        self._parts = None
+        self._cached_bounds = None
+    @property
+    def _coordinate_parts(self):
+        """The paths as a list of flat array('d') buffers of interleaved x, y
+           coordinates"""
+        if self._parts is not None:
+            return self._parts
+        return partsfromlistofpointlist(self._paths)
+    @classmethod
+    def _from_parts(cls, parts, spatialReference=None):
+        """Create a Polyline directly from a list of flat array('d') coordinate
+           buffers (one per path) without building Point instances."""
+        geom = cls([], spatialReference)
+        geom._paths, geom._parts = None, list(parts)
+        return geom
+    @property
+    def _bounds(self):
+        if self._parts is None:
+            # Points may change under us, so only the bounds of the flat
+            # buffers (which are never handed out) are kept
+            return boundsoflistofpointlist(self._paths)
+        if self._cached_bounds is None:
+            self._cached_bounds = boundsofparts(self._parts)
+        return self._cached_bounds
+    @property
+    def _vertex_count(self):
+        if self._parts is not None:
+            return sum(len(part) // 2 for part in self._parts)
+        return sum(len(path) for path in self._paths)
     def __repr__(self):
         return "MULTILINESTRING(%s)" % " ".join(
                                         "(%s)"%"".join(
@@ -252,7 +549,9 @@ class Polyline(Geometry):
                                             for pt in path)) 
                                         for path in self._json_paths)
     def __len__(self):
-        return len(self.paths)
+        if self._parts is not None:
+            return len(self._parts)
+        return len(self._paths)
     @property
     def __geo_interface__(self):
         retval = {
@@ -266,6 +565,8 @@ class Polyline(Geometry):
         return retval
     @property
     def _json_paths(self):
+        if self._parts is not None:
+            return jsonfromparts(self._parts)
         def fixpath(somepath):
             for pt in somepath:
                 if isinstance(pt, Point):
@@ -277,7 +578,7 @@ class Polyline(Geometry):
                     yield [pt.x, pt.y]
                 else:
                     yield list(pt)
-        return [list(fixpath(path)) for path in self.paths]
+        return [list(fixpath(path)) for path in self._paths]
     @property
     def _json_struct_without_sr(self):
         return {'paths': self._json_paths}
@@ -296,44 +597,60 @@ class Polyline(Geometry):
             return [cls(struct['coordinates'])]
     @classmethod
     def fromCompressedGeometry(cls, compressedstring, attributes=None):
-        result = []
-        import re
-        ints = [(-1 if number[0] == '-' else 1) * int(number[1:], 32)
-                   for number in re.findall("([+-][a-v0-9]*)",
-                                            compressedstring)]
-        multiplier = float(ints.pop(0))
-        oldx, oldy = 0, 0
-        while ints:
-            x, y = ints[:2]
-            ints = ints[2:]
-            x += oldx
-            y += oldy
-            result.append(Point(x/multiplier, y/multiplier))
-            oldx, oldy = x, y
-        retval = cls([result])
+        """Decode a compressedGeometry string, as returned by network
+           analysis operations, into a single-path Polyline. The coordinates
+           are accumulated straight into a flat array('d') buffer."""
+        ints = [int(number, 32)
+                for number in _compressed_number.findall(compressedstring)]
+        multiplier = float(ints[0])
+        xs, ys = ints[1::2], ints[2::2]
+        del xs[len(ys):]
+        x = y = 0
+        for index in range(len(xs)):
+            x += xs[index]
+            y += ys[index]
+            xs[index], ys[index] = x / multiplier, y / multiplier
+        coordinates = array.array('d', (0.0,)) * (len(xs) * 2)
+        coordinates[0::2] = array.array('d', xs)
+        coordinates[1::2] = array.array('d', ys)
+        retval = cls._from_parts([coordinates])
         if attributes:
             retval.attributes = attributes
         return retval
+    def generalize(self, tolerance, method='douglas-peucker'):
+        """Return a new Polyline with fewer vertices, computed locally rather
+           than with a GeometryService.Generalize round trip.
+
+           @param tolerance: The maximum offset in map units. The
+                             'douglas-peucker' method keeps any vertex
+                             further than tolerance from the simplified
+                             line; the 'visvalingam' method drops vertices
+                             that form triangles with their neighbors with
+                             an area of less than tolerance squared.
+           @param method: 'douglas-peucker' (the default) or 'visvalingam'
+        """
+        simplify = _generalizer(method)
+        geom = self._from_parts([simplify(part, tolerance)
+                                 for part in self._coordinate_parts],
+                                self.spatialReference)
+        if hasattr(self, 'attributes'):
+            geom.attributes = self.attributes
+        return geom
     def asCompressedGeometry(self, multiplier=55000):
-        def base32(num):
-            sign = "+" if num >= 0 else "-"
-            if num < 0:
-                num = -num
-            digits = "0123456789abcdefghijklmnopqrstuv"
-            nums = []
-            while num:
-                nums.append(num & 0x1F)
-                num = num >> 5
-            return sign + ''.join(digits[x] for x in reversed(nums))
-        def compressedstring():
-            yield base32(multiplier)
-            oldx, oldy = 0, 0
-            for ints in self._json_paths:
-                for (x, y) in ints:
-                    yield base32(int((x - oldx)*multiplier))
-                    yield base32(int((y - oldy)*multiplier))
-                    oldx, oldy = x, y
-        return ''.join(compressedstring())
+        """Encode this Polyline's vertices (all paths joined end to end) as a
+           compressedGeometry string. Coordinates are rounded to integers of
+           1/multiplier units first so the deltas are exact."""
+        coordinates = array.array('d')
+        for part in self._coordinate_parts:
+            coordinates.extend(part)
+        scaled = [int(round(coordinate * multiplier))
+                  for coordinate in coordinates]
+        # Each delta is the difference to the coordinate one vertex back
+        deltas = [scaled[0], scaled[1]] if scaled else []
+        deltas.extend(current - previous
+                      for current, previous in zip(scaled[2:], scaled))
+        return ''.join([_compressed_number_string(multiplier)] +
+                       [_compressed_number_string(delta) for delta in deltas])
 
 class Polygon(Geometry):
     """A polygon contains an array of rings and a spatialReference. Each ring 
@@ -365,7 +682,50 @@ class Polygon(Geometry):
         if not isinstance(spatialReference, SpatialReference):
             spatialReference = SpatialReference(spatialReference)
         self.spatialReference = spatialReference
-        self.rings = listofpointlist(rings, spatialReference)
+        self.rings = rings
+    _parts = None
+    @property
+    def rings(self):
+        """The list of rings (lists of Points) in this Polygon. The lists and
+           Points handed out here may be modified in place; the envelope
+           always reflects them."""
+        if self._rings is None:
+            self._rings = listofpointlistfromparts(self._parts,
+                                                  self.spatialReference)
+            self._parts = None
+        return self._rings
+    @rings.setter
+    def rings(self, rings):
+        self._rings = listofpointlist(rings, self.spatialReference)
+        self._parts = None
+        self._cached_bounds = None
+    @property
+    def _coordinate_parts(self):
+        """The rings as a list of flat array('d') buffers of interleaved x, y
+           coordinates"""
+        if self._parts is not None:
+            return self._parts
+        return partsfromlistofpointlist(self._rings)
+    @classmethod
+    def _from_parts(cls, parts, spatialReference=None):
+        """Create a Polygon directly from a list of flat array('d') coordinate
+           buffers (one per ring) without building Point instances."""
+        geom = cls([], spatialReference)
+        geom._rings, geom._parts = None, list(parts)
+        return geom
+    @property
+    def _bounds(self):
+        if self._parts is None:
+            # As for Polyline._bounds
+            return boundsoflistofpointlist(self._rings)
+        if self._cached_bounds is None:
+            self._cached_bounds = boundsofparts(self._parts)
+        return self._cached_bounds
+    @property
+    def _vertex_count(self):
+        if self._parts is not None:
+            return sum(len(part) // 2 for part in self._parts)
+        return sum(len(ring) for ring in self._rings)
     def __repr__(self):
         return "POLYGON(%s)" % " ".join(
                                         "(%s)"%"".join(
@@ -376,7 +736,9 @@ class Polygon(Geometry):
                                             for pt in ring)) 
                                         for ring in self._json_rings)
     def __len__(self):
-        return len(self.rings)
+        if self._parts is not None:
+            return len(self._parts)
+        return len(self._rings)
     @property
     def __geo_interface__(self):
         retval = {
@@ -388,6 +750,18 @@ class Polygon(Geometry):
         if self.spatialReference:
             retval['@esri.sr'] = self.spatialReference._json_struct
         return retval
+    def generalize(self, tolerance, method='douglas-peucker'):
+        """Return a new Polygon with fewer vertices, computed locally. See
+           L{Polyline.generalize<arcrest.geometry.Polyline.generalize>}; each
+           ring stays closed, and rings that would collapse are kept as
+           they are."""
+        simplify = _generalizer(method)
+        geom = self._from_parts([_generalized_ring(part, simplify, tolerance)
+                                 for part in self._coordinate_parts],
+                                self.spatialReference)
+        if hasattr(self, 'attributes'):
+            geom.attributes = self.attributes
+        return geom
     def contains(self, pt):
         "Tests if the provided point is in the polygon."
         if isinstance(pt, Point):
@@ -425,6 +799,8 @@ class Polygon(Geometry):
         return self.contains(pt)
     @property
     def _json_rings(self):
+        if self._parts is not None:
+            return jsonfromparts(self._parts)
         def fixring(somering):
             for pt in somering:
                 if isinstance(pt, Point):
@@ -434,7 +810,7 @@ class Polygon(Geometry):
                     yield [pt.x, pt.y]
                 else:
                     yield list(pt)
-        return [list(fixring(ring)) for ring in self.rings]
+        return [list(fixring(ring)) for ring in self._rings]
     @property
     def _json_struct_without_sr(self):
         return {'rings': self._json_rings}
@@ -456,17 +832,63 @@ class Multipoint(Geometry):
     """A multipoint contains an array of points and a spatialReference. Each
        point is represented as a 2-element array. The 0-index is the
        x-coordinate and the 1-index is the y-coordinate."""
+    __geometry_type__ = "esriGeometryMultipoint"
     def __init__(self, points=[], spatialReference=None):
         if not isinstance(spatialReference, SpatialReference):
             spatialReference = SpatialReference(spatialReference)
         self.spatialReference = spatialReference
-        self.points = pointlist(points, spatialReference)
+        self.points = points
+    _parts = None
+    @property
+    def points(self):
+        """The list of Points in this Multipoint. The list and Points handed
+           out here may be modified in place; the envelope always reflects
+           them."""
+        if self._points is None:
+            self._points = listofpointlistfromparts(self._parts,
+                                                    self.spatialReference)[0]
+            self._parts = None
+        return self._points
+    @points.setter
+    def points(self, points):
+        self._points = pointlist(points, self.spatialReference)
+        self._parts = None
+        self._cached_bounds = None
+    @property
+    def _coordinate_parts(self):
+        """The points as a one-item list holding a flat array('d') buffer of
+           interleaved x, y coordinates"""
+        if self._parts is not None:
+            return self._parts
+        return partsfromlistofpointlist([self._points])
+    @classmethod
+    def _from_parts(cls, parts, spatialReference=None):
+        """Create a Multipoint directly from a one-item list of flat
+           array('d') coordinate buffers without building Point instances."""
+        geom = cls([], spatialReference)
+        geom._points, geom._parts = None, list(parts)
+        return geom
+    @property
+    def _bounds(self):
+        if self._parts is None:
+            # As for Polyline._bounds
+            return boundsoflistofpointlist([self._points])
+        if self._cached_bounds is None:
+            self._cached_bounds = boundsofparts(self._parts)
+        return self._cached_bounds
+    @property
+    def _vertex_count(self):
+        if self._parts is not None:
+            return len(self._parts[0]) // 2
+        return len(self._points)
     def __repr__(self):
         return "MULTIPOINT(%s)" % ",".join("%0.5f %0.5f" % tuple(map(float,
                                                                      pt))
                                            for pt in self._json_points)
     def __len__(self):
-        return len(self.points)
+        if self._parts is not None:
+            return len(self._parts[0]) // 2
+        return len(self._points)
     @property
     def __geo_interface__(self):
         retval = {
@@ -480,6 +902,8 @@ class Multipoint(Geometry):
         return retval
     @property
     def _json_points(self):
+        if self._parts is not None:
+            return jsonfromparts(self._parts)[0]
         def fixpoint(somepointarray):
             for pt in somepointarray:
                 if isinstance(pt, Point):
@@ -489,7 +913,7 @@ class Multipoint(Geometry):
                     yield [pt.x, pt.y]
                 else:
                     yield list(pt)
-        return list(fixpoint(self.points))
+        return list(fixpoint(self._points))
     @property
     def _json_struct_without_sr(self):
         return {'points': self._json_points}
@@ -525,8 +949,18 @@ class Envelope(Geometry):
         else:
             x, y = pt[:2]
         return (self.xmax >= x >= self.xmin) and (self.ymax >= y >= self.ymin)
-    def __bool__(self):
-        return bool(self.wkid is not None)
+    def __len__(self):
+        # Like a point, an envelope is never empty: it has its two corners
+        return 2
+    @property
+    def _bounds(self):
+        return (self.xmin, self.ymin, self.xmax, self.ymax)
+    @property
+    def _vertex_count(self):
+        return 2
+    @property
+    def envelope(self):
+        return self
     @property
     def __geo_interface__(self):
         retval = {
@@ -587,17 +1021,91 @@ def fromJson(struct, attributes=None):
         return Envelope(*map(float, struct.split(',')))
     # Look for telltale attributes in the dict
     if isinstance(struct, dict):
-        for key, cls in indicative_attributes.iteritems():
+        for key, cls in indicative_attributes.items():
             if key in struct:
                 ret = cls.fromJson(dict((str(key), value)
-                                   for (key, value) in struct.iteritems()))
+                                   for (key, value) in struct.items()))
                 if attributes:
                     ret.attributes = dict((str(key.lower()), val) 
                                            for (key, val)
-                                           in attributes.iteritems())
+                                           in attributes.items())
                 return ret
     raise ValueError("Unconvertible to geometry")
 
+def _flat_part(points):
+    "Flatten a JSON list of [x, y, ...] vertices into an array('d') buffer"
+    try:
+        flat = array.array('d', itertools.chain.from_iterable(points))
+    except TypeError:
+        # A null z or m value
+        flat = None
+    if flat is None or len(flat) != 2 * len(points):
+        # Vertices carry z and/or m values; keep only x and y
+        flat = array.array('d', [coordinate for point in points
+                                            for coordinate in point[:2]])
+    return flat
+
+def _point_from_json(struct, sr):
+    return Point(struct['x'], struct['y'], sr)
+
+def _polyline_from_json(struct, sr):
+    return Polyline._from_parts([_flat_part(path) for path in struct['paths']],
+                                sr)
+
+def _polygon_from_json(struct, sr):
+    return Polygon._from_parts([_flat_part(ring) for ring in struct['rings']],
+                               sr)
+
+def _multipoint_from_json(struct, sr):
+    return Multipoint._from_parts([_flat_part(struct['points'])], sr)
+
+def _envelope_from_json(struct, sr):
+    return Envelope(struct['xmin'], struct['ymin'], struct['xmax'],
+                    struct['ymax'], sr)
+
+_json_builders = {
+    Point.__geometry_type__: _point_from_json,
+    Polyline.__geometry_type__: _polyline_from_json,
+    Polygon.__geometry_type__: _polygon_from_json,
+    Multipoint.__geometry_type__: _multipoint_from_json,
+    Envelope.__geometry_type__: _envelope_from_json
+}
+
+def fromJsonFeatures(features, geometryType, spatialReference=None):
+    """Convert a homogeneous JSON array of features (dicts of 'geometry' and
+       'attributes', as in a query, identify or geoprocessing result) to a
+       list of Geometries, each with the feature's attributes.
+
+       Unlike L{fromJson<arcrest.geometry.fromJson>}, the geometry type is
+       taken once from the geometryType of the response rather than sniffed
+       per feature, the geometry dicts are read in place rather than copied,
+       and paths, rings and points go straight into flat coordinate buffers.
+       Geometries without a spatial reference of their own share
+       spatialReference, and features without a geometry become
+       L{NullGeometry<arcrest.geometry.NullGeometry>} instances."""
+    build = _json_builders.get(geometryType)
+    if build is None:
+        raise ValueError("Unknown geometry type %r" % geometryType)
+    if not isinstance(spatialReference, SpatialReference):
+        spatialReference = SpatialReference(spatialReference)
+    geometries = []
+    append = geometries.append
+    for feature in features:
+        struct = feature.get('geometry')
+        if struct:
+            sr = struct.get('spatialReference')
+            geom = build(struct, spatialReference if sr is None
+                                 else SpatialReference(sr))
+        else:
+            geom = NullGeometry()
+        attributes = feature.get('attributes')
+        if attributes:
+            # Lower-cased keys, matching fromJson
+            geom.attributes = dict((key.lower(), value)
+                                   for key, value in attributes.items())
+        append(geom)
+    return geometries
+
 def fromGeoJson(struct, attributes=None):
     "Convert a GeoJSON-like struct to a Geometry based on its structure"
     if isinstance(struct, basestring):
@@ -638,7 +1146,7 @@ def fromGeoJson(struct, attributes=None):
             if attributes:
                 if not hasattr(instance, 'attributes'):
                     instance.attributes = {}
-                for k, v in attributes.iteritems():
+                for k, v in attributes.items():
                     instance.attributes[k] = v
             i.append(instance)
         if i:
@@ -646,3 +1154,349 @@ def fromGeoJson(struct, attributes=None):
                 return i
             return i[0]
     raise ValueError("Unconvertible to geometry")
+
+# Well-known text and binary (OGC simple features) conversion. Geometries are
+# written from and read into flat array('d') coordinate buffers, so no Point
+# instances are built on either side. Esri polygons are a flat list of rings
+# with clockwise exterior rings, so rings are grouped into (multi)polygons on
+# the way out and re-oriented on the way in.
+
+_wkb_types = {1: 'POINT', 2: 'LINESTRING', 3: 'POLYGON', 4: 'MULTIPOINT',
+              5: 'MULTILINESTRING', 6: 'MULTIPOLYGON',
+              7: 'GEOMETRYCOLLECTION'}
+_wkb_type_codes = dict((name, code) for code, name in _wkb_types.items())
+_EWKB_Z, _EWKB_M, _EWKB_SRID = 0x80000000, 0x40000000, 0x20000000
+_wkt_token = re.compile(r"[A-Za-z]+|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+                        r"|[(),;=]")
+_hex_string = re.compile(r"^[0-9A-Fa-f]+$")
+
+def _check_dims(dims, source):
+    """Esri geometries here are 2D only; refuse Z or M values rather than
+       quietly losing them"""
+    if dims is not None and dims > 2:
+        raise ValueError("%s with Z or M values is not supported; only 2D "
+                         "geometries can be read" % source)
+
+def _ring_area(part):
+    "Twice the signed area of a ring in a flat buffer (positive if CCW)"
+    xs, ys = part[0::2], part[1::2]
+    return sum(x0 * y1 - x1 * y0
+               for x0, y0, x1, y1 in zip(xs, ys, xs[1:] + xs[:1],
+                                         ys[1:] + ys[:1]))
+
+def _reversed_part(part):
+    "A copy of a flat coordinate buffer with its vertices in reverse order"
+    reverse = array.array('d', part)
+    reverse[0::2], reverse[1::2] = part[-2::-2], part[-1::-2]
+    return reverse
+
+def _ring_contains(part, x, y):
+    "Even-odd test of whether (x, y) is inside the ring in a flat buffer"
+    xs, ys = part[0::2], part[1::2]
+    inside = False
+    for x0, y0, x1, y1 in zip(xs, ys, xs[1:] + xs[:1], ys[1:] + ys[:1]):
+        if (y0 > y) != (y1 > y) and x < (x1 - x0) * (y - y0) / (y1 - y0) + x0:
+            inside = not inside
+    return inside
+
+def _polygons_from_rings(rings):
+    """Group Esri-style rings (clockwise exteriors, counterclockwise holes)
+       into a list of polygons, each a list of rings with the exterior
+       first."""
+    areas = [_ring_area(ring) for ring in rings]
+    if not any(area < 0 for area in areas):
+        # No Esri-oriented exteriors; treat every ring as its own polygon
+        return [[ring] for ring in rings]
+    polygons = [[ring] for ring, area in zip(rings, areas) if area < 0]
+    for ring, area in zip(rings, areas):
+        if area < 0:
+            continue
+        for polygon in polygons:
+            if len(ring) and _ring_contains(polygon[0], ring[0], ring[1]):
+                polygon.append(ring)
+                break
+        else:
+            polygons.append([ring])
+    return polygons
+
+def _esri_rings(polygons):
+    """Flatten a list of polygons (lists of rings, exterior first) into Esri
+       ring order: exteriors clockwise and holes counterclockwise."""
+    rings = []
+    for polygon in polygons:
+        for index, ring in enumerate(polygon):
+            clockwise = _ring_area(ring) < 0
+            if clockwise != (index == 0):
+                ring = _reversed_part(ring)
+            rings.append(ring)
+    return rings
+
+def _well_known_parts(geom):
+    """Break a geometry down into its OGC type name and coordinates: a flat
+       buffer for POINT and MULTIPOINT, a list of buffers for MULTILINESTRING
+       and POLYGON, and a list of lists of buffers for MULTIPOLYGON."""
+    if isinstance(geom, Point):
+        return 'POINT', array.array('d', (geom.x, geom.y))
+    elif isinstance(geom, Multipoint):
+        return 'MULTIPOINT', geom._coordinate_parts[0]
+    elif isinstance(geom, Polyline):
+        return 'MULTILINESTRING', geom._coordinate_parts
+    elif isinstance(geom, Polygon):
+        polygons = _polygons_from_rings(geom._coordinate_parts)
+        if len(polygons) <= 1:
+            return 'POLYGON', polygons[0] if polygons else []
+        return 'MULTIPOLYGON', polygons
+    elif isinstance(geom, Envelope):
+        return 'POLYGON', [array.array('d', (geom.xmin, geom.ymin,
+                                             geom.xmin, geom.ymax,
+                                             geom.xmax, geom.ymax,
+                                             geom.xmax, geom.ymin,
+                                             geom.xmin, geom.ymin))]
+    raise TypeError("No well-known representation for %r" %
+                    geom.__class__.__name__)
+
+def _geometry_from_well_known(name, coordinates, spatialReference):
+    "Build an Esri geometry from the output of the WKT or WKB readers"
+    if name == 'POINT':
+        if not len(coordinates):
+            return NullGeometry()
+        return Point(coordinates[0], coordinates[1], spatialReference)
+    elif name == 'MULTIPOINT':
+        return Multipoint._from_parts([coordinates], spatialReference)
+    elif name == 'LINESTRING':
+        return Polyline._from_parts([coordinates] if len(coordinates) else [],
+                                    spatialReference)
+    elif name == 'MULTILINESTRING':
+        return Polyline._from_parts(coordinates, spatialReference)
+    elif name == 'POLYGON':
+        return Polygon._from_parts(_esri_rings([coordinates]
+                                               if coordinates else []),
+                                   spatialReference)
+    elif name == 'MULTIPOLYGON':
+        return Polygon._from_parts(_esri_rings(coordinates),
+                                   spatialReference)
+    raise ValueError("Unsupported geometry type %s" % name)
+
+def _wkt_coordinates(part):
+    return ", ".join("%r %r" % pair for pair in zip(part[0::2], part[1::2]))
+
+def _wkt_parts(parts):
+    return ", ".join("(%s)" % _wkt_coordinates(part) for part in parts)
+
+def toWKT(geom):
+    "Return the OGC well-known text representation of a geometry"
+    name, coordinates = _well_known_parts(geom)
+    if name == 'POINT':
+        return "POINT (%s)" % _wkt_coordinates(coordinates)
+    elif name == 'MULTIPOINT':
+        body = ", ".join("(%r %r)" % pair for pair in zip(coordinates[0::2],
+                                                          coordinates[1::2]))
+    elif name == 'MULTIPOLYGON':
+        body = ", ".join("(%s)" % _wkt_parts(polygon)
+                         for polygon in coordinates)
+    else:
+        body = _wkt_parts(coordinates)
+    return "%s (%s)" % (name, body) if body else "%s EMPTY" % name
+
+class _WKTReader(object):
+    "Recursive descent parser over the tokens of a WKT string"
+    def __init__(self, text):
+        self.tokens = _wkt_token.findall(text)
+        self.index = 0
+    def peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return None
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise ValueError("Malformed WKT: expected %r, found %r" %
+                             (expected, token))
+        self.index += 1
+        return token
+    def empty(self):
+        "Consume an EMPTY keyword if it is next"
+        if (self.peek() or '').upper() == 'EMPTY':
+            self.index += 1
+            return True
+        return False
+    def coordinate_list(self, dims):
+        "(x y ..., x y ...) as a flat buffer of x, y values"
+        coordinates = array.array('d')
+        if self.empty():
+            return coordinates
+        self.take('(')
+        while True:
+            if self.peek() == '(':
+                # MULTIPOINT ((x y), (x y)) style
+                self.take('(')
+                values = self.numbers()
+                self.take(')')
+            else:
+                values = self.numbers()
+            if dims is None:
+                dims = len(values)
+                _check_dims(dims, "WKT")
+            if len(values) != dims or dims < 2:
+                raise ValueError("Malformed WKT: inconsistent coordinates")
+            coordinates.extend(values)
+            if self.take() == ')':
+                return coordinates
+    def numbers(self):
+        values = []
+        while self.peek() not in (',', ')', '(', None):
+            values.append(float(self.take()))
+        return values
+    def nested(self, reader):
+        "(item, item, ...) where each item is read with reader"
+        items = []
+        if self.empty():
+            return items
+        self.take('(')
+        while True:
+            items.append(reader())
+            if self.take() == ')':
+                return items
+    def geometry(self):
+        srid = None
+        if (self.peek() or '').upper() == 'SRID':
+            self.take()
+            self.take('=')
+            srid = int(self.take())
+            self.take(';')
+        name = self.take().upper()
+        dims = None
+        modifier = (self.peek() or '').upper()
+        if modifier in ('Z', 'M', 'ZM'):
+            self.take()
+            dims = 2 + len(modifier)
+            _check_dims(dims, "WKT")
+        point_list = lambda: self.coordinate_list(dims)
+        if name in ('POINT', 'LINESTRING', 'MULTIPOINT'):
+            coordinates = point_list()
+        elif name in ('POLYGON', 'MULTILINESTRING'):
+            coordinates = self.nested(point_list)
+        elif name == 'MULTIPOLYGON':
+            coordinates = self.nested(lambda: self.nested(point_list))
+        else:
+            raise ValueError("Unsupported geometry type %s" % name)
+        if self.peek() is not None:
+            raise ValueError("Malformed WKT: trailing %r" % self.peek())
+        return name, coordinates, srid
+
+def fromWKT(text, spatialReference=None):
+    """Convert OGC well-known text (or PostGIS EWKT with an SRID=...; prefix)
+       to a Geometry. Text with Z or M values raises ValueError. An SRID in
+       the text takes precedence over the spatialReference argument."""
+    name, coordinates, srid = _WKTReader(text).geometry()
+    if srid is not None:
+        spatialReference = srid
+    if not isinstance(spatialReference, SpatialReference):
+        spatialReference = SpatialReference(spatialReference)
+    return _geometry_from_well_known(name, coordinates, spatialReference)
+
+def _little_endian(part):
+    "The bytes of a flat coordinate buffer as little endian doubles"
+    if sys.byteorder != 'little':
+        part = array.array('d', part)
+        part.byteswap()
+    return compat.array_tobytes(part)
+
+def _wkb_header(name, srid=None):
+    if srid is None:
+        return struct.pack('<BI', 1, _wkb_type_codes[name])
+    return struct.pack('<BII', 1, _wkb_type_codes[name] | _EWKB_SRID, srid)
+
+def _wkb_points(part):
+    return struct.pack('<I', len(part) // 2) + _little_endian(part)
+
+def _wkb_rings(parts):
+    return struct.pack('<I', len(parts)) + b''.join(_wkb_points(part)
+                                                    for part in parts)
+
+def toWKB(geom, srid=None):
+    """Return the OGC well-known binary (little endian) representation of a
+       geometry. If srid is set, write PostGIS extended WKB with that SRID."""
+    name, coordinates = _well_known_parts(geom)
+    header = _wkb_header(name, srid)
+    if name == 'POINT':
+        return header + _little_endian(coordinates)
+    elif name == 'MULTIPOINT':
+        point_header = _wkb_header('POINT')
+        return (header + struct.pack('<I', len(coordinates) // 2) +
+                b''.join(point_header + _little_endian(coordinates[i:i + 2])
+                         for i in range(0, len(coordinates), 2)))
+    elif name == 'MULTILINESTRING':
+        line_header = _wkb_header('LINESTRING')
+        return (header + struct.pack('<I', len(coordinates)) +
+                b''.join(line_header + _wkb_points(part)
+                         for part in coordinates))
+    elif name == 'POLYGON':
+        return header + _wkb_rings(coordinates)
+    polygon_header = _wkb_header('POLYGON')
+    return (header + struct.pack('<I', len(coordinates)) +
+            b''.join(polygon_header + _wkb_rings(polygon)
+                     for polygon in coordinates))
+
+class _WKBReader(object):
+    "Reader over a (possibly nested) WKB or EWKB byte string"
+    def __init__(self, data):
+        self.data, self.offset = data, 0
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+    def coordinates(self, count, order):
+        "count vertices of two doubles each, as a flat x, y buffer"
+        size = count * 16
+        values = array.array('d')
+        compat.array_frombytes(values,
+                               bytes(self.data[self.offset:self.offset + size]))
+        self.offset += size
+        if (order == '<') != (sys.byteorder == 'little'):
+            values.byteswap()
+        return values
+    def geometry(self):
+        "Returns the OGC type name, coordinates and SRID (or None)"
+        order = '<' if self.unpack('B')[0] == 1 else '>'
+        code = self.unpack(order + 'I')[0]
+        srid = self.unpack(order + 'I')[0] if code & _EWKB_SRID else None
+        dims = 2 + bool(code & _EWKB_Z) + bool(code & _EWKB_M)
+        code &= 0x0FFFFFFF
+        dims += {0: 0, 1: 1, 2: 1, 3: 2}.get(code // 1000, 0)
+        _check_dims(dims, "WKB")
+        name = _wkb_types.get(code % 1000)
+        count = lambda: self.unpack(order + 'I')[0]
+        points = lambda: self.coordinates(count(), order)
+        if name == 'POINT':
+            coordinates = self.coordinates(1, order)
+            if coordinates[0] != coordinates[0]:
+                # NaN coordinates are how an empty point is written
+                coordinates = array.array('d')
+        elif name == 'LINESTRING':
+            coordinates = points()
+        elif name == 'POLYGON':
+            coordinates = [points() for i in range(count())]
+        elif name == 'MULTIPOINT':
+            coordinates = array.array('d')
+            for i in range(count()):
+                coordinates.extend(self.geometry()[1])
+        elif name in ('MULTILINESTRING', 'MULTIPOLYGON'):
+            coordinates = [self.geometry()[1] for i in range(count())]
+        else:
+            raise ValueError("Unsupported WKB geometry type %r" % code)
+        return name, coordinates, srid
+
+def fromWKB(data, spatialReference=None):
+    """Convert OGC well-known binary or PostGIS extended WKB (as bytes, or as
+       a hex string) to a Geometry. Data with Z or M values raises
+       ValueError. An SRID in the data takes precedence over the
+       spatialReference argument."""
+    if isinstance(data, basestring) and _hex_string.match(data):
+        data = binascii.unhexlify(data)
+    name, coordinates, srid = _WKBReader(data).geometry()
+    if srid is not None:
+        spatialReference = srid
+    if not isinstance(spatialReference, SpatialReference):
+        spatialReference = SpatialReference(spatialReference)
+    return _geometry_from_well_known(name, coordinates, spatialReference)
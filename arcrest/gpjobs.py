@@ -0,0 +1,385 @@
+# coding: utf-8
+"""Monitoring of many asynchronous geoprocessing jobs at once. Rather than
+   a thread polling each job, a single scheduler keeps every job on one
+   timetable, hands the status requests that are due to a few worker
+   threads no faster than a global rate limit, and fetches the results of
+   jobs as they finish, while the others are still being polled:
+
+      >>> import arcrest.gpjobs
+      >>> with arcrest.gpjobs.JobMonitor(workers=4,
+      ...                                polls_per_second=5) as monitor:
+      ...     futures = [monitor.submit(task, county)
+      ...                for county in counties]
+      ...     for future in monitor.as_completed(futures):
+      ...         print(future.status, future.result()['Output'])
+
+   Each job is polled with the same adaptive schedule as
+   L{GPJobStatus.wait<arcrest.server.GPJobStatus.wait>}: often at first, then
+   less and less often for as long as nothing about it changes.
+
+   A L{JobPool<arcrest.gpjobs.JobPool>}, also behind
+   L{GPTask.map<arcrest.server.GPTask.map>}, runs a task over many sets of
+   parameters with a bounded number of jobs on the server at a time:
+
+      >>> for county, results in task.map(counties, max_in_flight=6):
+      ...     print(county, results['Output'])
+   """
+
+import heapq
+import itertools
+import threading
+import time
+
+from . import compat
+from . import utils
+from .server import GPJob, GPJobStatus, RETRY_EXCEPTIONS, is_transient
+
+__all__ = ['JobTimeout', 'JobFuture', 'JobMonitor', 'JobPool']
+
+class JobTimeout(Exception):
+    "A job didn't finish in the time allowed"
+
+class JobFuture(object):
+    """The eventual outcome of a GP job tracked by a
+       L{JobMonitor<arcrest.gpjobs.JobMonitor>}. status is the last job
+       status seen and messages every GPMessage received so far. Once the
+       job is done, result() returns its results dict, or raises the error
+       that ended it."""
+    def __init__(self, job):
+        self.job = job
+        self.status = None
+        self.messages = []
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+        self._jobId = None
+        # Polling schedule
+        self._interval = getattr(job, 'poll_interval', 0)
+        self._failures = 0
+    def done(self):
+        "Whether the job has finished and its outcome is known"
+        return self._event.is_set()
+    def _wait(self, timeout):
+        self._event.wait(timeout)
+        if not self._event.is_set():
+            raise JobTimeout("Job %s still %s after %r seconds" %
+                             (self.jobId, self.status, timeout))
+    def result(self, timeout=None):
+        """The results dict of the job, waiting up to timeout seconds (or for
+           as long as it takes) for it to finish"""
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+    def exception(self, timeout=None):
+        """The exception that ended the job, or None if it succeeded, waiting
+           up to timeout seconds for it to finish"""
+        self._wait(timeout)
+        return self._exception
+    def add_done_callback(self, function):
+        """Call function with this future once the job is done, on the
+           thread that finished it; right away if it is done already"""
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(function)
+                return
+        function(self)
+    def _finish(self, result=None, exception=None):
+        with self._lock:
+            self._result, self._exception = result, exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for function in callbacks:
+            try:
+                function(self)
+            except Exception:
+                # A broken callback mustn't take a monitor thread down
+                pass
+    @property
+    def jobId(self):
+        "The job's ID, asked of the server once"
+        if self._jobId is None and self.job is not None:
+            self._jobId = self.job.jobId
+        return self._jobId
+    def __repr__(self):
+        return "<JobFuture %s %s>" % (self.jobId,
+                                      "done" if self.done() else self.status)
+
+class JobMonitor(object):
+    """Tracks any number of GP jobs from one scheduler thread. Status
+       requests that are due go to up to workers threads, at most
+       polls_per_second of them a second across all jobs (None for no
+       limit); the same threads fetch the results of jobs that finish. A
+       status request that fails is tried again poll_retries times before
+       the job is given up on, as is fetching the results of a finished job
+       (on transient errors, backing off from the job's poll_interval). If
+       set, progress is called with the L{JobFuture<arcrest.gpjobs.JobFuture>}
+       and its list of new GPMessages after every poll, on a worker
+       thread."""
+    #: Failed status requests in a row before a job is given up on
+    poll_retries = 3
+    def __init__(self, workers=4, polls_per_second=10.0, progress=None):
+        self.workers = workers
+        self.polls_per_second = polls_per_second
+        self.progress = progress
+        self.polls = 0
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._tasks = compat.queue.Queue()
+        self._active = set()
+        self._threads = []
+        self._closed = False
+    def __len__(self):
+        "The number of jobs still being tracked"
+        with self._condition:
+            return len(self._active)
+    def __enter__(self):
+        return self
+    def __exit__(self, t, ex, tb):
+        self.close(wait=t is None)
+    def _start(self):
+        if self._threads:
+            return
+        threads = [threading.Thread(target=self._scheduler)]
+        threads.extend(threading.Thread(target=self._worker)
+                       for i in range(max(self.workers, 1)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self._threads = threads
+    def add(self, job):
+        """Start tracking job, a GPJobStatus as returned by
+           L{GPTask.SubmitJob<arcrest.server.GPTask.SubmitJob>} or a GPJob,
+           and return its L{JobFuture<arcrest.gpjobs.JobFuture>}"""
+        if isinstance(job, GPJob):
+            job = job._jobstatus
+        future = JobFuture(job)
+        with self._condition:
+            if self._closed:
+                raise ValueError("This job monitor is closed")
+            self._start()
+            self._active.add(future)
+            self._schedule_poll(future, 0)
+        return future
+    def submit(self, task, *params, **kw):
+        """Submit a job of the GPTask task with the given parameters and
+           return its L{JobFuture<arcrest.gpjobs.JobFuture>}"""
+        return self.add(task.SubmitJob(*params, **kw))
+    def _schedule_poll(self, future, delay):
+        with self._condition:
+            heapq.heappush(self._schedule, (time.time() + delay,
+                                            next(self._sequence), future))
+            self._condition.notify()
+    def _scheduler(self):
+        "Hand the polls that are due to the workers, within the rate limit"
+        next_slot = 0
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.time()
+                    if self._schedule:
+                        due = max(self._schedule[0][0], next_slot)
+                        if due <= now:
+                            break
+                        self._condition.wait(due - now)
+                    else:
+                        self._condition.wait()
+                future = heapq.heappop(self._schedule)[2]
+            if self.polls_per_second:
+                next_slot = max(now, next_slot) + 1.0 / self.polls_per_second
+            self._tasks.put(future)
+    def _worker(self):
+        while True:
+            future = self._tasks.get()
+            if future is None:
+                return
+            try:
+                self._poll(future)
+            except Exception as e:
+                # Finish the job rather than lose it along with the thread
+                if not future.done():
+                    self._finish(future, exception=e)
+    def _poll(self, future):
+        "Poll a job once, and fetch its results if it is done"
+        job = future.job
+        try:
+            status, messages = job.poll()
+        except RETRY_EXCEPTIONS as e:
+            future._failures += 1
+            if future._failures > self.poll_retries:
+                self._finish(future, exception=e)
+            else:
+                self._schedule_poll(future, future._interval *
+                                            2 ** future._failures)
+            return
+        except Exception as e:
+            self._finish(future, exception=e)
+            return
+        with self._condition:
+            self.polls += 1
+        future._failures = 0
+        last_status, future.status = future.status, status
+        future.messages.extend(messages)
+        if self.progress is not None:
+            try:
+                self.progress(future, messages)
+            except Exception:
+                # A broken callback mustn't stop the job being polled
+                pass
+        if status in job._still_running:
+            if status == last_status and not messages:
+                future._interval = min(future._interval * job.poll_backoff,
+                                       job.max_poll_interval)
+            self._schedule_poll(future, future._interval)
+            return
+        fetch_results = utils.with_retries(lambda: job.results,
+                                           self.poll_retries,
+                                           RETRY_EXCEPTIONS,
+                                           job.poll_interval,
+                                           retry_if=is_transient)
+        try:
+            results = fetch_results()
+        except Exception as e:
+            # Failed, cancelled or timed out jobs end up here too
+            self._finish(future, exception=e)
+            return
+        self._finish(future, results)
+    def _finish(self, future, result=None, exception=None):
+        with self._condition:
+            self._active.discard(future)
+            self._condition.notify_all()
+        future._finish(result, exception)
+    def as_completed(self, futures=None):
+        """Yield futures (by default every job being tracked) as their jobs
+           finish"""
+        finished = compat.queue.Queue()
+        if futures is None:
+            with self._condition:
+                futures = list(self._active)
+        futures = list(futures)
+        for future in futures:
+            future.add_done_callback(finished.put)
+        for i in range(len(futures)):
+            yield finished.get()
+    def wait(self, timeout=None):
+        """Block until every job being tracked is done. Returns True once
+           they are, or False if timeout seconds pass first."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._active:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+                delay = deadline - time.time()
+                if delay <= 0:
+                    return False
+                self._condition.wait(delay)
+        return True
+    def close(self, wait=True):
+        """Stop the monitor's threads, after the jobs being tracked are done
+           if wait is set. Jobs still running are left to run on the server
+           but are no longer polled."""
+        if wait:
+            self.wait()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads[1:]:
+            self._tasks.put(None)
+        self._threads = []
+
+class JobPool(object):
+    """Runs a GPTask over many sets of parameters with at most max_in_flight
+       of its jobs on the server at once, submitting the next job as soon
+       as one finishes. A job that fails with one of retry_statuses, or
+       whose submission or polling fails, is submitted again up to retries
+       times. Jobs are tracked by monitor, a
+       L{JobMonitor<arcrest.gpjobs.JobMonitor>} shared with other pools if
+       given, or one of the pool's own."""
+    #: Job statuses that are worth submitting the job again for
+    retry_statuses = frozenset(['esriJobFailed', 'esriJobTimedOut'])
+    def __init__(self, task, max_in_flight=4, retries=2, monitor=None):
+        self.task = task
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.monitor = monitor
+    def _arguments(self, params):
+        """The positional and keyword arguments of a job: params may be a
+           dict of keywords, a tuple or list of positional parameters or a
+           single parameter"""
+        if isinstance(params, dict):
+            return (), params
+        if isinstance(params, (tuple, list)):
+            return tuple(params), {}
+        return (params,), {}
+    def _submit(self, monitor, index, params, attempt, finished):
+        args, kw = self._arguments(params)
+        try:
+            future = monitor.submit(self.task, *args, **kw)
+        except RETRY_EXCEPTIONS as e:
+            future = JobFuture(None)
+            future._finish(exception=e)
+        future.add_done_callback(
+            lambda future: finished.put((index, params, attempt, future)))
+    def _retry(self, future, attempt):
+        "Whether a failed job should be submitted again"
+        if attempt >= self.retries:
+            return False
+        if future.status in self.retry_statuses:
+            return True
+        # A job whose submission or polling kept failing, as opposed to one
+        # the server ended (by cancelling it, say)
+        return (isinstance(future.exception(), RETRY_EXCEPTIONS) and
+                (future.status is None or
+                 future.status in GPJobStatus._still_running))
+    def map(self, params, ordered=True):
+        """Run a job for every item of params and yield (params, results)
+           pairs in input order (ordered=True) or as the jobs finish
+           (ordered=False). params may be any iterable, and is only read as
+           jobs are submitted. The error of a job that fails for good is
+           raised in the consuming thread."""
+        monitor = self.monitor
+        if monitor is None:
+            monitor = JobMonitor(workers=min(self.max_in_flight, 8))
+        finished = compat.queue.Queue()
+        items = iter(enumerate(params))
+        in_flight, next_index, done, exhausted = 0, 0, {}, False
+        try:
+            while True:
+                # In input order, stop submitting while the results held
+                # back behind a slow job pile up
+                while (not exhausted and in_flight < self.max_in_flight and
+                       len(done) < self.max_in_flight * 2):
+                    try:
+                        index, item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    self._submit(monitor, index, item, 0, finished)
+                    in_flight += 1
+                if not in_flight:
+                    return
+                index, item, attempt, future = finished.get()
+                error = future.exception()
+                if error is not None:
+                    if self._retry(future, attempt):
+                        self._submit(monitor, index, item, attempt + 1,
+                                     finished)
+                        continue
+                    raise error
+                in_flight -= 1
+                if not ordered:
+                    yield item, future.result()
+                    continue
+                done[index] = (item, future.result())
+                while next_index in done:
+                    next_index += 1
+                    yield done.pop(next_index - 1)
+        finally:
+            if monitor is not self.monitor:
+                monitor.close(wait=False)
@@ -3,6 +3,7 @@
    Geoprocessing tasks on an ArcGIS REST server."""
 
 import datetime
+import functools
 import json
 
 from . import geometry
@@ -162,6 +163,10 @@ def rowtuple(colnames):
 class GPFeatureRecordSetLayer(GPBaseType):
     """Represents a geoprocessing feature recordset parameter"""
     _columns = None
+    #: If set, polyline and polygon features are generalized locally to this
+    #: tolerance (in map units) with generalize_method when serialized
+    generalize_tolerance = None
+    generalize_method = 'douglas-peucker'
     def __init__(self, Geometry, sr=None):
         if isinstance(Geometry, geometry.Geometry):
             Geometry = [Geometry]
@@ -174,7 +179,7 @@ class GPFeatureRecordSetLayer(GPBaseType):
         else:
             raise ValueError("Could not determine spatial reference")
         if self._columns is None and self._features:
-            _columns = sorted(reduce(lambda x, y: x | y, 
+            _columns = sorted(functools.reduce(lambda x, y: x | y, 
                                    (set(getattr(row, 'attributes', {}).keys())
                                    for row in self._features)))
             if 'shape' not in (col.lower() for col in _columns):
@@ -183,6 +188,16 @@ class GPFeatureRecordSetLayer(GPBaseType):
     @property
     def features(self):
         return list(self)
+    @property
+    def extent(self):
+        """The Envelope enclosing the geometries of every feature in this
+           recordset, or None if there are no non-empty geometries."""
+        bounds = geometry.unionofbounds(feature._bounds
+                                        for feature in self._features)
+        if bounds is None:
+            return None
+        return geometry.Envelope(bounds[0], bounds[1], bounds[2], bounds[3],
+                                 self.spatialReference)
     def __iter__(self):
         return ({'geometry': feature, 
                  'attributes': getattr(feature, 'attributes', {})} 
@@ -192,21 +207,34 @@ class GPFeatureRecordSetLayer(GPBaseType):
         geometry_types = set(geom.__geometry_type__ for geom in self._features)
         assert len(geometry_types) == 1, "Must have consistent geometries"
         geometry_type = list(geometry_types)[0]
+        features = self._features
+        if self.generalize_tolerance is not None:
+            features = geometry.generalize(features, self.generalize_tolerance,
+                                           self.generalize_method)
         return {
                     'geometryType': geometry_type,
                     'spatialReference': self.spatialReference._json_struct,
                     'features': [
-                        x._json_struct_for_featureset for x in self._features]
+                        x._json_struct_for_featureset for x in features]
                }
     @classmethod
     def fromJson(cls, value):
         spatialreference = geometry.fromJson(value['spatialReference']) \
             if 'spatialReference' in value else None
-        geometries = [geometry.Polyline.fromCompressedGeometry(
-                            geo['compressedGeometry'], geo['attributes'])
-                      if "compressedGeometry" in geo
-                      else geometry.fromJson(geo['geometry'], geo['attributes']) 
-                      for geo in value['features']]
+        features = value['features']
+        if value.get('geometryType') and \
+                not any("compressedGeometry" in geo for geo in features):
+            # Homogeneous features: decode with the type given in the header
+            geometries = geometry.fromJsonFeatures(features,
+                                                   value['geometryType'],
+                                                   spatialreference)
+        else:
+            geometries = [geometry.Polyline.fromCompressedGeometry(
+                                geo['compressedGeometry'], geo['attributes'])
+                          if "compressedGeometry" in geo
+                          else geometry.fromJson(geo['geometry'],
+                                                 geo['attributes'])
+                          for geo in features]
         return cls(geometries, spatialreference)
 
 @GPBaseType._register_type
@@ -217,7 +245,7 @@ class GPRecordSet(GPBaseType):
         self.features = arg
         self._exceededTransferLimit = exceededTransferLimit
         if self._columns is None:
-            _columns = sorted(reduce(lambda x, y: x | y, 
+            _columns = sorted(functools.reduce(lambda x, y: x | y, 
                                    (set(row['attributes'].keys()) 
                                    for row in self.features)))
             self._columns = tuple(_columns)
@@ -0,0 +1,234 @@
+# coding: utf-8
+"""Export of map and image service images bigger than the server allows
+   in one request. The requested extent and size are split into pieces no
+   bigger than the service's maxImageWidth and maxImageHeight, the pieces
+   are exported a few at a time, and they are stitched into a single PNG:
+
+      >>> import arcrest.mosaic
+      >>> mosaic = arcrest.mosaic.Mosaic(map_service, workers=6,
+      ...                                layers="show:0,2")
+      >>> mosaic.export(extent, (20000, 14000), "print.png", world_file=True)
+      {'width': 20000, 'height': 14000, 'pieces': 70, ...}
+
+   The pieces are exported as BMP images, which need no decoding, and are
+   spooled to temporary files as they arrive. The output is written one row
+   of pixels at a time, so memory use doesn't grow with the size of the
+   image, and only the band (row of pieces) being written and the few
+   pieces downloaded ahead of it are kept on disk.
+   """
+
+import math
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+from . import compat
+from . import geometry
+from . import utils
+
+__all__ = ['MosaicPiece', 'Mosaic']
+
+#: The image size limit of services that don't advertise one
+DEFAULT_MAX_IMAGE_SIZE = 2048
+
+class MosaicPiece(object):
+    """One server request of a mosaic: the image of extent, width x height
+       pixels, placed at pixel column x and row y of the mosaic, in band
+       (row of pieces) band"""
+    def __init__(self, band, x, y, width, height, extent):
+        self.band = band
+        self.x, self.y = x, y
+        self.width, self.height = width, height
+        self.extent = extent
+        self.file = None
+    def _open(self, image_file):
+        """Read the header of the BMP image in image_file, so rows can be
+           read from it"""
+        header = image_file.read(54)
+        if header[:2] != b'BM':
+            raise ValueError("Expected a BMP image for the piece at %i, %i" %
+                             (self.x, self.y))
+        offset, = struct.unpack('<I', header[10:14])
+        width, height = struct.unpack('<ii', header[18:26])
+        bits, = struct.unpack('<H', header[28:30])
+        compression, = struct.unpack('<I', header[30:34])
+        if bits not in (24, 32) or compression not in (0, 3):
+            raise ValueError("Unsupported %i bit BMP image for the piece at "
+                             "%i, %i" % (bits, self.x, self.y))
+        if (width, abs(height)) != (self.width, self.height):
+            raise ValueError("Expected a %ix%i image for the piece at %i, %i, "
+                             "got %ix%i" % (self.width, self.height,
+                                            self.x, self.y,
+                                            width, abs(height)))
+        self.file = image_file
+        self.channels = bits // 8
+        self._offset = offset
+        self._stride = (width * self.channels + 3) & ~3
+        self._bottom_up = height > 0
+    def row(self, y, channels):
+        """Row y of the piece's image as RGB (channels=3) or RGBA
+           (channels=4) bytes"""
+        if self._bottom_up:
+            y = self.height - 1 - y
+        self.file.seek(self._offset + y * self._stride)
+        bgr = bytearray(self.file.read(self.width * self.channels))
+        source = self.channels
+        rgb = bytearray(self.width * channels)
+        rgb[0::channels] = bgr[2::source]
+        rgb[1::channels] = bgr[1::source]
+        rgb[2::channels] = bgr[0::source]
+        if channels == 4:
+            rgb[3::4] = (bgr[3::4] if source == 4
+                                   else b'\xff' * self.width)
+        return rgb
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    def __repr__(self):
+        return "<MosaicPiece %ix%i at %i, %i>" % (self.width, self.height,
+                                                  self.x, self.y)
+
+class _PNGWriter(object):
+    "Writes a PNG image to a file a row of pixels at a time"
+    def __init__(self, outfile, width, height, channels):
+        self._outfile = outfile
+        self._compressor = zlib.compressobj(6)
+        self._pending = []
+        self._pending_size = 0
+        outfile.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8,
+                                         6 if channels == 4 else 2, 0, 0, 0))
+    def _chunk(self, kind, data):
+        self._outfile.write(struct.pack('>I', len(data)))
+        self._outfile.write(kind)
+        self._outfile.write(data)
+        self._outfile.write(struct.pack('>I', zlib.crc32(kind + data)
+                                                  & 0xffffffff))
+    def _flush(self, data):
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= 1 << 16:
+            self._chunk(b'IDAT', b''.join(self._pending))
+            self._pending, self._pending_size = [], 0
+    def write_row(self, row):
+        # Each row starts with its filter type, 0 (none)
+        self._flush(self._compressor.compress(b'\x00' + bytes(row)))
+    def close(self):
+        self._pending.append(self._compressor.flush())
+        self._chunk(b'IDAT', b''.join(self._pending))
+        self._chunk(b'IEND', b'')
+
+class Mosaic(object):
+    """Exports images of any size from a
+       L{MapService<arcrest.server.MapService>} or an
+       L{ImageService<arcrest.server.ImageService>} on up to workers
+       threads. options are passed on to each ExportMap or ExportImage call
+       (layers, layerDefs, transparent, renderingRule...). The piece size
+       defaults to the service's maxImageWidth and maxImageHeight."""
+    def __init__(self, service, workers=4, max_width=None, max_height=None,
+                 **options):
+        self.service = service
+        self.workers = workers
+        service_json = service._json_struct
+        self.max_width = (max_width or service_json.get('maxImageWidth')
+                                    or DEFAULT_MAX_IMAGE_SIZE)
+        self.max_height = (max_height or service_json.get('maxImageHeight')
+                                      or DEFAULT_MAX_IMAGE_SIZE)
+        self.options = options
+    def pieces(self, extent, size):
+        """The L{MosaicPiece<arcrest.mosaic.MosaicPiece>}s of an image of
+           extent (an Envelope) size (width, height) pixels, band by band
+           from the top. Piece edges fall on whole pixels of the mosaic, so
+           adjacent pieces line up exactly."""
+        width, height = size
+        x_resolution = (extent.xmax - extent.xmin) / float(width)
+        y_resolution = (extent.ymax - extent.ymin) / float(height)
+        columns = int(math.ceil(width / float(self.max_width)))
+        bands = int(math.ceil(height / float(self.max_height)))
+        xs = [width * index // columns for index in range(columns + 1)]
+        ys = [height * index // bands for index in range(bands + 1)]
+        pieces = []
+        for band in range(bands):
+            for column in range(columns):
+                x, y = xs[column], ys[band]
+                piece_width = xs[column + 1] - x
+                piece_height = ys[band + 1] - y
+                piece_extent = geometry.Envelope(
+                    extent.xmin + x * x_resolution,
+                    extent.ymax - (y + piece_height) * y_resolution,
+                    extent.xmin + (x + piece_width) * x_resolution,
+                    extent.ymax - y * y_resolution,
+                    extent.spatialReference)
+                pieces.append(MosaicPiece(band, x, y, piece_width,
+                                          piece_height, piece_extent))
+        return pieces
+    def _export(self, piece):
+        "Export a piece and spool its image to a temporary file"
+        export = getattr(self.service, 'ExportImage', None) or \
+                 self.service.ExportMap
+        options = dict(self.options)
+        if piece.extent.spatialReference.wkid is not None:
+            options.setdefault('bboxSR', piece.extent.spatialReference.wkid)
+        result = export(bbox=piece.extent,
+                        size=(piece.width, piece.height),
+                        format='bmp', **options)
+        image_file = tempfile.TemporaryFile()
+        try:
+            result.save(image_file)
+            image_file.seek(0)
+            piece._open(image_file)
+        except:
+            image_file.close()
+            raise
+        return piece
+    def export(self, extent, size, outfile, world_file=False):
+        """Export an image of extent (an Envelope) size (width, height)
+           pixels to outfile, a PNG file name or a file-like object. With
+           world_file, a PNG world file (.pgw) is written next to it too.
+           Returns a dict of the width, height, extent and number of pieces
+           of the image and the seconds it took."""
+        started = time.time()
+        width, height = size
+        pieces = self.pieces(extent, size)
+        if isinstance(outfile, compat.string_type):
+            if world_file:
+                self._write_world_file(outfile, extent, size)
+            with open(outfile, 'wb') as out:
+                return self.export(extent, size, out)
+        writer, channels, band = None, None, []
+        exported = utils.imap_parallel(self._export, pieces, self.workers)
+        try:
+            for piece in exported:
+                band.append(piece)
+                if piece.x + piece.width < width:
+                    continue
+                # A whole band of pieces is in; write out its rows
+                if writer is None:
+                    channels = band[0].channels
+                    writer = _PNGWriter(outfile, width, height, channels)
+                for y in range(piece.height):
+                    writer.write_row(b''.join(bytes(each.row(y, channels))
+                                              for each in band))
+                for each in band:
+                    each.close()
+                band = []
+            writer.close()
+        finally:
+            for each in band:
+                each.close()
+            exported.close()
+        return {'width': width, 'height': height, 'extent': extent,
+                'pieces': len(pieces), 'seconds': time.time() - started}
+    def _write_world_file(self, filename, extent, size):
+        "Write the world file of an image with extent and size"
+        width, height = size
+        x_resolution = (extent.xmax - extent.xmin) / float(width)
+        y_resolution = (extent.ymax - extent.ymin) / float(height)
+        with open(os.path.splitext(filename)[0] + '.pgw', 'w') as world:
+            world.write("\n".join(repr(value) for value in
+                                  (x_resolution, 0.0, 0.0, -y_resolution,
+                                   extent.xmin + x_resolution / 2,
+                                   extent.ymax - y_resolution / 2)) + "\n")
@@ -5,16 +5,22 @@
    a hierarchy of endpoints or Uniform Resource Locators (URLs) for each GIS 
    service published with ArcGIS Server."""
 
-import cgi
+import array
 import json
 import mimetypes
+import mmap
 import os
 import re
+import socket
+import tempfile
+import time
 import uuid
 
+from . import caching
 from . import compat
 from . import geometry
 from . import gptypes
+from . import transforms
 from . import utils
 
 #: User agent to report when making requests
@@ -23,6 +29,98 @@ USER_AGENT = "Mozilla/4.0 (arcrest)"
 #: Magic parameter name for propagating REFERER
 REQUEST_REFERER_MAGIC_NAME = "HTTPREFERERTOKEN"
 
+#: Requests with a longer query string than this are sent as POST requests
+MAX_GET_QUERY_LENGTH = 2000
+
+#: Streamed POST bodies larger than this many bytes are spooled to disk
+STREAMED_BODY_SPOOL_SIZE = 8 * 1024 * 1024
+
+class JsonArrayParameter(object):
+    """A request parameter holding a JSON array, the items of which (already
+       serialized to JSON text) come from an iterable. Passed as a parameter
+       value to RestURL._get_subfolder, it is written item by item straight
+       into a spooled POST body instead of being joined into the query
+       string, so a large list of features never has to be in memory all at
+       once and may come from a generator."""
+    def __init__(self, items):
+        self.items = items
+    def _write(self, name, stream):
+        "Write name=[items] to stream, form-encoded"
+        write = stream.write
+        write(compat.ensure_bytes("%s=%%5B" % compat.quote_plus(name)))
+        separator = b''
+        for item in self.items:
+            write(separator)
+            write(compat.ensure_bytes(
+                    compat.quote_plus(compat.ensure_bytes(item))))
+            separator = b'%2C'
+        write(b'%5D')
+
+class ResourceURL(tuple):
+    """An immutable URL, usable anywhere a compat.urlsplit result is: a
+       (scheme, netloc, path, query, fragment) tuple which also keeps the
+       query parameters as the dict params (and the referer to send with
+       it). The query string is encoded once, when the URL is made, and the
+       full URL is rendered on first use and kept. RestURL takes the
+       parameters straight from here rather than parsing and re-encoding
+       the query string, and join composes child paths without going
+       through urljoin for plain relative names."""
+    def __new__(cls, scheme, netloc, path, params=None, fragment='',
+                referer=None):
+        params = params or {}
+        self = tuple.__new__(cls, (scheme, netloc, path,
+                                   compat.urlencode(params), fragment))
+        self.params, self.referer, self._rendered = params, referer, None
+        return self
+    @classmethod
+    def fromString(cls, url, referer=None):
+        "Split a URL string, parsing its query string into params"
+        scheme, netloc, path, query, fragment = compat.urlsplit(url)
+        params = dict((key, value[0])
+                      for key, value in compat.parse_qs(query).items())
+        return cls(scheme, netloc, path, params, fragment, referer)
+    def __getnewargs__(self):
+        return (self[0], self[1], self[2], self.params, self[4], self.referer)
+    @property
+    def path(self):
+        return self[2]
+    @property
+    def query(self):
+        return self[3]
+    @property
+    def url(self):
+        "The URL as a string"
+        if self._rendered is None:
+            self._rendered = compat.urlunsplit(self)
+        return self._rendered
+    def joinPath(self, name):
+        """The path of name (which is quoted) relative to this URL, following
+           the same rules as urljoin"""
+        name = compat.quote(name)
+        relative = name[2:] if name.startswith('./') else name
+        segments = relative.split('/')
+        path = self[2]
+        if name and path and '' not in segments[:-1] and \
+                '.' not in segments and '..' not in segments:
+            # A plain relative path: replace the last segment of this path
+            return path[:path.rfind('/') + 1] + relative
+        return compat.urlsplit(compat.urljoin(compat.urlunsplit(
+                                                self[:3] + ('', '')),
+                                              name, False))[2]
+    def withTrailingSlash(self):
+        "This URL, with a / added to the end of its path if it has none"
+        if self[2].endswith('/'):
+            return self
+        return ResourceURL(self[0], self[1], self[2] + '/', self.params,
+                           self[4], self.referer)
+    def join(self, name, params=None, referer=None):
+        """A new ResourceURL for name relative to this one, with params as
+           its query parameters"""
+        return ResourceURL(self[0], self[1], self.joinPath(name), params, '',
+                           referer)
+    def __repr__(self):
+        return "ResourceURL(%r)" % self.url
+
 # Note that nearly every class below derives from this RestURL class.
 # The reasoning is that every object has an underlying URL resource on 
 # the REST server. Some are static or near-static, such as a folder or a
@@ -46,6 +144,9 @@ class RestURL(object):
     __lazy_fetch__ = True      # Fetch when constructed, or later on?
     __parent_type__ = None     # For automatically generated parent URLs
     __post__ = False           # Move query string to POST
+    __body__ = None            # Spooled POST body of streamed parameters
+    __rendered_url__ = None    # Cached (components, url string) for .url
+    __resource_url__ = None    # Cached ResourceURL of .url for children
     _parent = None
     _referer = None
 
@@ -68,6 +169,17 @@ class RestURL(object):
         # is returned from the server due to an error condition -- we
         # need to differentiate between 'NULL' and 'UNDEFINED'
         self.__urldata__ = Ellipsis
+        if isinstance(url, ResourceURL) and \
+                (self.__has_json__ is not True or
+                 url.params.get('f') == 'json'):
+            # Already split, parsed and encoded (see _get_subfolder)
+            self.__token__ = url.params.get('token', self.__token__)
+            self._referer = url.referer
+            self._url = list(url)
+            self._finish_init(file_data)
+            return
+        elif isinstance(url, ResourceURL):
+            self._referer = url.referer
         # Pull out query, whatever it may be
         urllist = list(url)
         query_dict = {}
@@ -76,7 +188,7 @@ class RestURL(object):
         # is probably useful somewhere, but not here). Pull out the first
         # element of every list so when we convert back to a query string
         # it doesn't enclose all values in []
-        for k, v in cgi.parse_qs(urllist[3]).items():
+        for k, v in compat.parse_qs(urllist[3]).items():
             query_dict[k] = v[0]
             if k.lower() == 'token':
                 self.__token__ = v[0]
@@ -91,6 +203,8 @@ class RestURL(object):
         # Hack our modified query string back into URL components
         urllist[3] = compat.urlencode(query_dict)
         self._url = urllist
+        self._finish_init(file_data)
+    def _finish_init(self, file_data):
         # Finally, set any file data parameters' data to local store.
         # file_data is expected to be a dictionary of name/filehandle
         # pairs if defined. And if there are any files, fetching will
@@ -114,21 +228,15 @@ class RestURL(object):
         """Return an object of the requested type with the path relative
            to the current object's URL. Optionally, query parameters
            may be set."""
-        newurl = compat.urljoin(self.url, compat.quote(foldername), False)
-
+        base = self._resource_url
         params = params or {}
         file_data = file_data or {}
 
         # Add the key-value pairs sent in params to query string if they
-        # are so defined.
-        query_dict = {}
-        url_tuple = compat.urlsplit(newurl)
-        urllist = list(url_tuple)
+        # are so defined. Only an empty foldername keeps this URL's query.
+        query_dict = dict(base.params) if not foldername else {}
 
         if params:
-            # As above, pull out first element from parse_qs' values
-            query_dict = dict((k, v[0]) for k, v in 
-                               cgi.parse_qs(urllist[3]).items())
             for key, val in params.items():
                 # Lowercase bool string
                 if isinstance(val, bool):
@@ -146,22 +254,27 @@ class RestURL(object):
                     query_dict[key] = val.wkid
                 # If it's a list, make it a comma-separated string
                 elif isinstance(val, (list, tuple, set)):
-                    val = ",".join([str(v.id) 
-                                    if isinstance(v, Layer)
-                                    else str(v) for v in val])
+                    query_dict[key] = ",".join([str(v.id)
+                                                if isinstance(v, Layer)
+                                                else str(v) for v in val])
                 # If it's a dictionary, dump as JSON
                 elif isinstance(val, dict):
-                    val = json.dumps(val)
+                    query_dict[key] = json.dumps(val)
+                # Streamed parameters are written into the POST body
+                elif isinstance(val, JsonArrayParameter):
+                    file_data = dict(file_data)
+                    file_data[key] = val
                 # Ignore null values, and coerce string values (hopefully
                 # everything sent in to a query has a sane __str__)
                 elif val is not None:
                     query_dict[key] = str(val)
         if self.__token__ is not None:
             query_dict['token'] = self.__token__
-        query_dict[REQUEST_REFERER_MAGIC_NAME] = self._referer or self.url
-        # Replace URL query component with newly altered component
-        urllist[3] = compat.urlencode(query_dict)
-        newurl = urllist
+        # Set f=json up front (as RestURL.__init__ would) so the query string
+        # is only encoded once
+        if getattr(returntype, '__has_json__', None) is True:
+            query_dict['f'] = 'json'
+        newurl = base.join(foldername, query_dict, self._referer or self.url)
         # Instantiate new RestURL or subclass
         rt = returntype(newurl, file_data)
         # Remind the resource where it came from
@@ -175,14 +288,39 @@ class RestURL(object):
         self.__urldata__ = Ellipsis
     @property
     def url(self):
-        """The URL as a string of the resource."""
+        """The URL as a string of the resource. It is rendered once and
+           reused until the URL components change."""
+        key = tuple(self._url) + (self._post,)
+        rendered = self.__rendered_url__
+        if rendered is not None and rendered[0] == key:
+            return rendered[1]
         urlparts = self._url
-        if self.__post__:
+        if self._post:
             urlparts = list(urlparts)
             urlparts[3] = '' # Clear out query string on POST
             if self.__token__ is not None: # But not the token
                 urlparts[3] = compat.urlencode({'token': self.__token__})
-        return compat.urlunsplit(urlparts)
+        url = compat.urlunsplit(urlparts)
+        self.__rendered_url__ = (key, url)
+        return url
+    @property
+    def _resource_url(self):
+        """This resource's URL as a ResourceURL, to build child URLs from.
+           Kept until the URL components change."""
+        url = self.url
+        resource = self.__resource_url__
+        if resource is None or resource.url != url:
+            resource = ResourceURL.fromString(url)
+            resource._rendered = url
+            self.__resource_url__ = resource
+        return resource
+    @property
+    def _post(self):
+        """Whether to send the query string as a POST body: always for types
+           that set __post__, and for any request whose query string is
+           longer than MAX_GET_QUERY_LENGTH, which servers and proxies may
+           reject or truncate."""
+        return self.__post__ or len(self._url[3]) > MAX_GET_QUERY_LENGTH
     @property
     def query(self):
         return compat.ensure_bytes(self._url[3])
@@ -193,69 +331,115 @@ class RestURL(object):
         if self.__headers__ is Ellipsis:
             self._contents
         return self.__headers__
+    def _request(self):
+        """Build the urllib2 Request for this resource: a GET, a form-encoded
+           POST, a POST with a streamed body or a multipart upload."""
+        if self._file_data and all(isinstance(value, JsonArrayParameter)
+                                   for value in self._file_data.values()):
+            # Stream the parameters into a form-encoded POST body
+            self.__post__ = True
+            body, length = self._streamed_body()
+            req_dict = {'User-Agent' : USER_AGENT,
+                        'Content-Type':
+                            'application/x-www-form-urlencoded',
+                        'Content-Length': str(length)
+                        }
+            if self._referer:
+                req_dict['Referer'] = self._referer
+            request = compat.urllib2.Request(self.url, body, req_dict)
+        elif self._file_data:
+            # Special-case: do a multipart upload if there's file data
+            self.__post__ = True
+            boundary = "-"*12+str(uuid.uuid4())+"$"
+            multipart_data = ''
+            for k, v in compat.parse_qs(self.query).items():
+                if not isinstance(v, list):
+                    v = [v]
+                for val in v:
+                    multipart_data += boundary + "\r\n"
+                    multipart_data += ('Content-Disposition: form-data; '
+                                       'name="%s"\r\n\r\n' % k)
+                    multipart_data += val + "\r\n"
+            for k, v in self._file_data.items():
+                fn = os.path.basename(getattr(v, 'name', 'file'))
+                ct = (mimetypes.guess_type(fn) 
+                        or ("application/octet-stream",))[0]
+                multipart_data += boundary + "\r\n"
+                multipart_data += ('Content-Disposition: form-data; '
+                                   'name="%s"; filename="%s"\r\n'
+                                   'Content-Type:%s\r\n\r\n' % 
+                                        (k, fn, ct))
+                multipart_data += v.read() + "\r\n"
+            multipart_data += boundary + "--\r\n\r\n"
+            req_dict = {'User-Agent' : USER_AGENT,
+                        'Content-Type': 
+                            'multipart/form-data; boundary='+boundary[2:],
+                        'Content-Length': str(len(multipart_data))
+                        }
+            if self._referer:
+                req_dict['Referer'] = self._referer
+            request = compat.urllib2.Request(self.url,
+                                      multipart_data,
+                                      req_dict)
+        else:
+            req_dict = {'User-Agent' : USER_AGENT}
+            if self._referer:
+                req_dict['Referer'] = self._referer
+            request = compat.urllib2.Request(self.url, self.query 
+                                                    if self._post
+                                                    else None,
+                                       req_dict)
+        return request
     @property
     def _contents(self):
         """The raw contents of the URL as fetched, this is done lazily.
            For non-lazy fetching this is accessed in the object constructor."""
         if self.__urldata__ is Ellipsis or self.__cache_request__ is False:
-            if self._file_data:
-                # Special-case: do a multipart upload if there's file data
-                self.__post__ = True
-                boundary = "-"*12+str(uuid.uuid4())+"$"
-                multipart_data = ''
-                for k, v in cgi.parse_qs(self.query).items():
-                    if not isinstance(v, list):
-                        v = [v]
-                    for val in v:
-                        multipart_data += boundary + "\r\n"
-                        multipart_data += ('Content-Disposition: form-data; '
-                                           'name="%s"\r\n\r\n' % k)
-                        multipart_data += val + "\r\n"
-                for k, v in self._file_data.items():
-                    fn = os.path.basename(getattr(v, 'name', 'file'))
-                    ct = (mimetypes.guess_type(fn) 
-                            or ("application/octet-stream",))[0]
-                    multipart_data += boundary + "\r\n"
-                    multipart_data += ('Content-Disposition: form-data; '
-                                       'name="%s"; filename="%s"\r\n'
-                                       'Content-Type:%s\r\n\r\n' % 
-                                            (k, fn, ct))
-                    multipart_data += v.read() + "\r\n"
-                multipart_data += boundary + "--\r\n\r\n"
-                req_dict = {'User-Agent' : USER_AGENT,
-                            'Content-Type': 
-                                'multipart/form-data; boundary='+boundary[2:],
-                            'Content-Length': str(len(multipart_data))
-                            }
-                if self._referer:
-                    req_dict['Referer'] = self._referer
-                request = compat.urllib2.Request(self.url,
-                                          multipart_data,
-                                          req_dict)
-            else:
-                req_dict = {'User-Agent' : USER_AGENT}
-                if self._referer:
-                    req_dict['Referer'] = self._referer
-                request = compat.urllib2.Request(self.url, self.query 
-                                                        if self.__post__
-                                                        else None,
-                                           req_dict)
-            handle = compat.urllib2.urlopen(request)
-            # Handle the special case of a redirect (only follow once) --
-            # Note that only the first 3 components (protocol, hostname, path)
-            # are altered as component 4 is the query string, which can get
-            # clobbered by the server.
-            fetched_url = list(compat.urlsplit(handle.url)[:3])
-            if fetched_url != list(self._url[:3]):
-                self._url[:3] = fetched_url
-                return self._contents
-            # No redirect, proceed as usual.
-            self.__headers__ = compat.get_headers(handle)
+            handle = self._open()
             self.__urldata__ = handle.read()
+            self._release_body()
         data = self.__urldata__
         if self.__cache_request__ is False:
             self.__urldata__ = Ellipsis
         return data
+    def _open(self):
+        """Make the request and return the response, keeping its headers"""
+        handle = compat.urllib2.urlopen(self._request())
+        # Handle the special case of a redirect (only follow once) --
+        # Note that only the first 3 components (protocol, hostname, path)
+        # are altered as component 4 is the query string, which can get
+        # clobbered by the server. The request is made again to the new
+        # URL, so a POST stays a POST with the same (spooled) body.
+        fetched_url = list(compat.urlsplit(handle.url)[:3])
+        if fetched_url != list(self._url[:3]):
+            handle.close()
+            self._url[:3] = fetched_url
+            handle = compat.urllib2.urlopen(self._request())
+        self.__headers__ = compat.get_headers(handle)
+        return handle
+    def _release_body(self):
+        "Let go of a spooled POST body once its response is in"
+        if self.__body__ is not None:
+            self.__body__.close()
+            self.__body__ = None
+    def _streamed_body(self):
+        """Spool the query string and the JsonArrayParameters in file_data
+           into a form-encoded POST body, held in memory up to
+           STREAMED_BODY_SPOOL_SIZE bytes and on disk past that. Returns the
+           rewound body file and its length."""
+        if self.__body__ is None:
+            body = tempfile.SpooledTemporaryFile(STREAMED_BODY_SPOOL_SIZE)
+            body.write(self.query)
+            separator = b'&' if self.query else b''
+            for key, value in self._file_data.items():
+                body.write(separator)
+                value._write(key, body)
+                separator = b'&'
+            self.__body__ = body
+        self.__body__.seek(0, 2)
+        length = self.__body__.tell()
+        self.__body__.seek(0)
+        return self.__body__, length
     @property
     def _json_struct(self):
         """The json data structure in the URL contents, it will cache this
@@ -335,7 +519,7 @@ class GenerateToken(RestURL):
                 url_tuple = compat.urlsplit(url)
                 urllist = list(url_tuple)
                 query_dict = dict((k, v[0]) for k, v in 
-                                  cgi.parse_qs(urllist[3]).items())
+                                  compat.parse_qs(urllist[3]).items())
                 query_dict['username'] = username
                 query_dict['password'] = password
                 self._username = username
@@ -591,7 +775,9 @@ class Service(RestURL):
     __parent_type__ = Folder
 
     def __init__(self, url, file_data=None):
-        if not isinstance(url, (tuple, list)):
+        if isinstance(url, ResourceURL):
+            url_ = url.withTrailingSlash()
+        elif not isinstance(url, (tuple, list)):
             url_ = list(compat.urlsplit(url))
         else:
             url_ = url
@@ -611,7 +797,31 @@ class Service(RestURL):
                                 self.url)
 
 class ServerError(Exception):
-    """Exception for server-side error responses"""
+    """Exception for server-side error responses. code is the error code the
+       server gave, if any."""
+    def __init__(self, message, code=None):
+        super(ServerError, self).__init__(message)
+        self.code = code
+
+#: Exceptions raised by a request that are worth trying again
+RETRY_EXCEPTIONS = (compat.HTTPError, compat.URLError, socket.timeout,
+                    ServerError)
+
+#: HTTP status codes below 500 that a request may get past by trying again
+TRANSIENT_HTTP_CODES = frozenset([408, 429])
+
+def is_transient(error):
+    """Whether a request that failed with error may succeed if made again:
+       it failed to get a response or timed out, or the server reported a
+       5xx error (or asked the client to slow down) rather than a problem
+       with the request itself"""
+    if isinstance(error, (ServerError, compat.HTTPError)):
+        try:
+            code = int(error.code)
+        except (TypeError, ValueError):
+            return False
+        return code >= 500 or code in TRANSIENT_HTTP_CODES
+    return isinstance(error, (compat.URLError, socket.timeout))
 
 class Result(RestURL):
     """Abstract class representing the result of an operation performed on a
@@ -619,22 +829,80 @@ class Result(RestURL):
     __cache_request__ = True # Only request the URL once
     __lazy_fetch__ = False   # Force-fetch immediately
 
+    @classmethod
+    def _from_json_struct(cls, json_struct, parent=None):
+        """Create a result holding an already-known json structure, such as
+           one computed on the client, without making any HTTP request."""
+        result = cls.__new__(cls)
+        result._url = ['', '', '', '', '']
+        result._file_data = None
+        result.__urldata__ = json.dumps(json_struct)
+        result.__json_struct__ = json_struct
+        result._parent = parent
+        return result
+
 class BinaryResult(Result):
     """Class representing the result of an operation perfomed on a service with
        some sort of opaque binary data, such as a PNG or KMZ. Contrast to a
-       JsonResult, which has an immediately accessible data structure."""
+       JsonResult, which has an immediately accessible data structure. The
+       data is only fetched when it is read, or streamed when it is saved."""
     __has_json__ = False
+    __lazy_fetch__ = True
+    #: Bytes read from the response at a time when streaming it
+    save_chunk_size = 65536
+    _content_length = None
 
     @property
     def data(self):
         """Return the raw data from this request"""
         return self._contents
-
-    def save(self, outfile):
-        """Save the image data to a file or file-like object"""
+    @property
+    def content_length(self):
+        """The size of the data in bytes, as the server reported it when the
+           data was fetched or streamed (None if it didn't, or before then)"""
+        if self._content_length is None and self.__urldata__ is not Ellipsis:
+            return len(self.__urldata__)
+        return self._content_length
+    def iter_content(self, chunk_size=None):
+        """Yield the data in chunks of up to chunk_size (save_chunk_size by
+           default) bytes as they are read from the server, without keeping
+           them. content_length is set once the response starts. Redirects
+           are followed as when the data is read whole."""
+        if self.__urldata__ is not Ellipsis:
+            data = self._contents
+            chunk_size = chunk_size or len(data) or 1
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+            return
+        handle = self._open()
+        try:
+            length = handle.info().get('Content-Length')
+            if length is not None:
+                self._content_length = int(length)
+            while True:
+                chunk = handle.read(chunk_size or self.save_chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            handle.close()
+            self._release_body()
+    def save(self, outfile, progress=None):
+        """Save the data to a file or file-like object and return the number
+           of bytes written. If the data hasn't been fetched yet it is
+           streamed to the file save_chunk_size bytes at a time rather than
+           read into memory first. If set, progress is called with the bytes
+           written so far and content_length after every chunk."""
         if isinstance(outfile, compat.string_type):
-            outfile = open(outfile, 'wb')
-        outfile.write(self._contents)
+            with open(outfile, 'wb') as out:
+                return self.save(out, progress)
+        written = 0
+        for chunk in self.iter_content():
+            outfile.write(chunk)
+            written += len(chunk)
+            if progress is not None:
+                progress(written, self.content_length)
+        return written
 
 class JsonResult(Result):
     """Class representing a specialization to results that expect
@@ -653,7 +921,8 @@ class JsonResult(Result):
                                 js['error']['message'] or 
                                     'Unspecified',
                                 detailstring,
-                                self.url))
+                                self.url),
+                              js['error'].get('code'))
         elif "status" in js:
             if js['status'] == "error":
                 raise ServerError(''.join(
@@ -689,11 +958,14 @@ class AttachmentInfos(JsonResult):
 
     @property
     def attachments(self):
+        attachments = []
         for attachment in self._json_struct['attachmentInfos']:
             attachment_dict = attachment.copy()
             attachment_dict['attachment'] = \
                     self._get_subfolder("%i/" % attachment_dict['id'],
                                         AttachmentData)
+            attachments.append(attachment_dict)
+        return attachments
 
 class MapLayer(Layer):
     """The layer resource represents a single layer or standalone table in a
@@ -720,13 +992,24 @@ class MapLayer(Layer):
              - esriSpatialRelIndexIntersects
              - esriSpatialRelOverlaps
              - esriSpatialRelTouches
-             - esriSpatialRelWithin"""
-        if not inSR:
-            if Geometry:
+             - esriSpatialRelWithin
+
+           For esriSpatialRelEnvelopeIntersects only the envelope of the
+           input Geometry is sent to the server."""
+        geometryType = None
+        if Geometry is not None:
+            if not inSR:
                 inSR = Geometry.spatialReference
+            if spatialRel == 'esriSpatialRelEnvelopeIntersects':
+                envelope = Geometry.envelope
+                # An empty geometry has no envelope; send it as it is
+                if envelope is not None:
+                    Geometry = envelope
+            geometryType = Geometry.__geometry_type__
         out = self._get_subfolder("./query", JsonResult, {
                                                'text': text,
-                                               'geometry': geometry,
+                                               'geometry': Geometry,
+                                               'geometryType': geometryType,
                                                'inSR': inSR,
                                                'spatialRel': spatialRel,
                                                'where': where,
@@ -810,12 +1093,42 @@ class MapLayer(Layer):
         if not self.hasAttachments:
             return []
         return self._get_subfolder("attachments/", AttachmentInfos).attachments
-
+    def QueryAttachments(self, objectIds=None, definitionExpression=None,
+                         attachmentTypes=None):
+        """The query attachments operation returns the attachment infos of
+           many features at once, grouped by feature: each group in the
+           result's attachmentGroups has the parentObjectId of the feature
+           and its attachmentInfos. Older servers don't support it and return
+           an error."""
+        out = self._get_subfolder("./queryAttachments", JsonResult, {
+                                                        'objectIds':
+                                                            objectIds,
+                                                        'definitionExpression':
+                                                          definitionExpression,
+                                                        'attachmentTypes':
+                                                            attachmentTypes
+                                                })
+        return out._json_struct
+    def Attachment(self, objectId, attachmentId):
+        """The data of an attachment of a feature in this layer, fetched when
+           it is first read or saved"""
+        return self._get_subfolder("%i/attachments/%i" % (objectId,
+                                                          attachmentId),
+                                   AttachmentData)
+    def attachment_exporter(self, directory, **options):
+        """Return an L{AttachmentExporter<arcrest.attachments.AttachmentExporter>}
+           that downloads this layer's attachments into directory."""
+        from . import attachments
+        return attachments.AttachmentExporter(self, directory, **options)
+
+
+class ImageData(BinaryResult):
+    """The image file an export operation wrote to the server's output
+       directory, as named by the href of its result."""
 
 class MapTile(BinaryResult):
     """Represents the map tile fetched from a map service."""
-
-    pass
+    __lazy_fetch__ = True
 
 class ExportMapResult(JsonResult):
     """Represents the result of an Export Map operation performed on a Map
@@ -837,17 +1150,19 @@ class ExportMapResult(JsonResult):
     def scale(self):
         return self._json_struct['scale']
     @property
+    def image(self):
+        """The exported image at href, as an L{ImageData} fetched when it is
+           read or streamed when it is saved"""
+        if not hasattr(self, '_image'):
+            self._image = ImageData(self.href)
+        return self._image
+    @property
     def data(self):
-        if not hasattr(self, '_data'):
-            self._data = compat.urllib2.urlopen(self.href).read()
-        return self._data
-    def save(self, outfile):
-        """Save the image data to a file or file-like object"""
-        if isinstance(outfile, compat.string_type):
-            outfile = open(outfile, 'wb')
-        assert hasattr(outfile, 'write') and callable(outfile.write), \
-            "Expect a file or file-like object with a .write() method"
-        outfile.write(self.data)
+        return self.image.data
+    def save(self, outfile, progress=None):
+        """Stream the image data to a file or file-like object; see
+           L{BinaryResult.save}"""
+        return self.image.save(outfile, progress)
 
 class IdentifyOrFindResult(JsonResult):
     """Represents the result of a Find or Identify operation performed on a
@@ -873,6 +1188,10 @@ class ExportKMLResult(BinaryResult):
     """Represents the result of an Export KML operation performed on a Map
        Service."""
 
+class GenerateKMLResult(BinaryResult):
+    """Represents the KMZ file generated by a Generate KML operation
+       performed on a Map Service."""
+
 @Folder._register_service_type
 class MapService(Service):
     """Map services offer access to map and layer content. Map services can
@@ -967,8 +1286,22 @@ class MapService(Service):
            the map. The image bytes for the tile at the specified level, row 
            and column are directly streamed to the client. If the tile is not
            found, an HTTP status code of 404 (Not found) is returned."""
-        return self._get_subfolder("tile/%s/%s/%s/" % (row, col, zoomlevel), 
+        return self._get_subfolder("tile/%s/%s/%s" % (zoomlevel, row, col),
                                    MapTile)
+    def mosaic(self, workers=4, **options):
+        """Return a L{Mosaic<arcrest.mosaic.Mosaic>} that exports images of
+           this map bigger than maxImageWidth x maxImageHeight; options are
+           passed on to ExportMap."""
+        from . import mosaic
+        return mosaic.Mosaic(self, workers, **options)
+    def tile_fetcher(self, store, **options):
+        """Return a L{TileFetcher<arcrest.tiles.TileFetcher>} that fetches
+           this map's tiles into store, a
+           L{TileStore<arcrest.tiles.TileStore>} or the path of one."""
+        from . import tiles
+        if isinstance(store, compat.string_type):
+            store = tiles.TileStore(store)
+        return tiles.TileFetcher(self, store, **options)
 
     @property
     def mapName(self):
@@ -1027,6 +1360,21 @@ class MapService(Service):
                                                     time_info['timeExtent'])
         return time_info
     @property
+    def tileInfo(self):
+        """The tiling scheme of this map's tile cache as a dict of origin,
+           lods (levels of detail), rows, cols, dpi and format, or None if
+           the map isn't cached"""
+        return self._json_struct.get('tileInfo')
+    @property
+    def tilingScheme(self):
+        """A L{TilingScheme<arcrest.tiles.TilingScheme>} for this map's tile
+           cache, or None if the map isn't cached"""
+        from . import tiles
+        tile_info = self.tileInfo
+        if not tile_info:
+            return None
+        return tiles.TilingScheme.fromJson(tile_info)
+    @property
     def supportedImageFormatTypes(self):
         """Return a list of supported image formats for this Map Service"""
         return [x.strip() 
@@ -1084,6 +1432,18 @@ class GeocodeService(Service):
        distinguishes a place."""
     __service_type__ = "GeocodeServer"
 
+    #: Optional cache of FindAddressCandidates and ReverseGeocode results,
+    #: keyed by normalized address or by location; see arcrest.caching
+    cache = None
+    #: Size of the grid cells that reverse geocoded locations are snapped to
+    #: for the cache, in the units of the location (about 10m in degrees):
+    #: every location in a cell shares the first one's address
+    reverse_geocode_cell_size = 0.0001
+
+    @property
+    def _cache_params(self):
+        "Cache key parameters that tell this locator from others"
+        return {'locator': '%s%s' % tuple(self._url[1:3])}
     def FindAddressCandidates(self, outFields=[], outSR=None, **fields):
         """The findAddressCandidates operation is performed on a geocode
            service resource. The result of this operation is a resource
@@ -1104,8 +1464,21 @@ class GeocodeService(Service):
             query['outSR'] = (outSR.wkid 
                                 if isinstance(outSR, geometry.SpatialReference)
                                 else outSR)
-        return self._get_subfolder('findAddressCandidates/', 
-                                   FindAddressCandidatesResult, query)
+        key = None
+        if self.cache is not None:
+            key = caching.make_address_key('findAddressCandidates', fields,
+                                           dict(self._cache_params,
+                                                outFields=outFields,
+                                                outSR=query.get('outSR')))
+            found = self.cache.get(key)
+            if found is not None:
+                return FindAddressCandidatesResult._from_json_struct(found,
+                                                                     self)
+        result = self._get_subfolder('findAddressCandidates/',
+                                     FindAddressCandidatesResult, query)
+        if key is not None:
+            self.cache.set(key, result._json_struct)
+        return result
 
     def ReverseGeocode(self, location, distance, outSR=None):
         """The reverseGeocode operation is performed on a geocode service 
@@ -1118,10 +1491,57 @@ class GeocodeService(Service):
                        if isinstance(outSR, geometry.SpatialReference)
                        else outSR)
 
-        return self._get_subfolder('reverseGeocode/', ReverseGeocodeResult, 
+        key = None
+        if self.cache is not None:
+            key = caching.make_location_key('reverseGeocode', location,
+                                            distance,
+                                            self.reverse_geocode_cell_size,
+                                            dict(self._cache_params,
+                                                 outSR=outSR))
+            found = self.cache.get(key)
+            if found is not None:
+                return ReverseGeocodeResult._from_json_struct(found, self)
+        result = self._get_subfolder('reverseGeocode/', ReverseGeocodeResult,
                                                       {'location': location, 
                                                        'distance': distance,
                                                        'outSR': outSR})
+        if key is not None:
+            self.cache.set(key, result._json_struct)
+        return result
+    def GeocodeAddresses(self, addresses, outSR=None):
+        """The geocodeAddresses operation geocodes a batch of addresses in a
+           single request (POST only). addresses is a list of dicts of
+           address fields, each with a unique OBJECTID; each location in the
+           result names the OBJECTID of its address in its ResultID
+           attribute. Locators advertise the batch sizes they accept as
+           SuggestedBatchSize and MaxBatchSize in locatorProperties."""
+        if outSR:
+            outSR = (outSR.wkid
+                       if isinstance(outSR, geometry.SpatialReference)
+                       else outSR)
+        records = [{'attributes': address} for address in addresses]
+        return self._get_subfolder('geocodeAddresses/', JsonPostResult,
+                                   {'addresses': {'records': records},
+                                    'outSR': outSR})._json_struct
+    def batch_geocoder(self, **options):
+        """Return a L{BatchGeocoder<arcrest.geocoding.BatchGeocoder>} that
+           geocodes any number of addresses with this locator."""
+        from . import geocoding
+        return geocoding.BatchGeocoder(self, **options)
+    @property
+    def addressFields(self):
+        """The address fields of this locator, as dicts of name, alias,
+           type and required"""
+        return self._json_struct.get('addressFields', [])
+    @property
+    def singleLineAddressField(self):
+        """The field that takes a whole address on one line, or None"""
+        return self._json_struct.get('singleLineAddressField')
+    @property
+    def locatorProperties(self):
+        """This locator's properties, such as SuggestedBatchSize and
+           MaxBatchSize"""
+        return self._json_struct.get('locatorProperties', {})
 
 class GPMessage(object):
     """Represents a message generated during the execution of a
@@ -1202,6 +1622,14 @@ class GPJobStatus(RestURL):
        GP Task. Please refer to the GPJob class for more information."""
     __cache_request__ = False
     _results = None
+    _messages_seen = 0
+
+    #: Seconds between the first status polls of wait()
+    poll_interval = 0.25
+    #: The longest wait() goes between status polls, in seconds
+    max_poll_interval = 30.0
+    #: How much the time between polls grows while the job is unchanged
+    poll_backoff = 1.5
 
     # All the job status codes we are aware of (from Java API)
     job_statuses = set([
@@ -1241,6 +1669,42 @@ class GPJobStatus(RestURL):
             self.__cache_request__ = True
             self.__json_struct__ = js
         return js
+    def poll(self):
+        """Fetch the job's status with a single request and return the
+           status and a list of the GPMessages that are new since the last
+           poll"""
+        js = self._json_struct
+        messages = js.get('messages', [])
+        new_messages = [GPMessage(message)
+                        for message in messages[self._messages_seen:]]
+        self._messages_seen = len(messages)
+        return js['jobStatus'], new_messages
+    def wait(self, timeout=None, progress=None):
+        """Block until the job is no longer running. The status is polled
+           with one request each time, poll_interval seconds apart at first;
+           the time between polls grows by poll_backoff (up to
+           max_poll_interval) for as long as the status stays the same and
+           no messages come in. If set, progress is called after every poll
+           with the job status and the list of new GPMessages. Returns True
+           once the job is done, or False if timeout seconds pass first."""
+        deadline = None if timeout is None else time.time() + timeout
+        interval, last_status = self.poll_interval, None
+        while True:
+            status, messages = self.poll()
+            if progress is not None:
+                progress(status, messages)
+            if status not in self._still_running:
+                return True
+            if status == last_status and not messages:
+                interval = min(interval * self.poll_backoff,
+                               self.max_poll_interval)
+            last_status = status
+            delay = interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.time())
+                if delay <= 0:
+                    return False
+            time.sleep(delay)
     @property
     def jobId(self):
         return self._json_struct['jobId']
@@ -1257,7 +1721,7 @@ class GPJobStatus(RestURL):
             raise ServerError("Error: job status %r" % self.jobStatus)
         if self._results is None:
             def item_iterator():
-                for resref in self._json_struct['results'].itervalues():
+                for resref in self._json_struct['results'].values():
                     rel = self._get_subfolder(resref['paramUrl'], RestURL)
                     result = rel._json_struct
                     #self.parent.parent.parameters
@@ -1280,7 +1744,8 @@ class GPJobStatus(RestURL):
     @property
     def messages(self):
         "Return a list of messages returned from the server."
-        return map(GPMessage, self._json_struct['messages'])
+        return [GPMessage(message)
+                for message in self._json_struct['messages']]
     def __getitem__(self, key):
         return self.__class__.results.__get__(self)[key]
     def __getattr__(self, attr):
@@ -1310,6 +1775,14 @@ class GPJob(JsonPostResult):
     def running(self):
         "A boolean (True: job completion pending; False: no longer executing)"
         return self._jobstatus.running
+    def poll(self):
+        """Fetch the job's status once; returns the status and the new
+           GPMessages since the last poll"""
+        return self._jobstatus.poll()
+    def wait(self, timeout=None, progress=None):
+        """Block until the job is done, polling its status with adaptive
+           backoff; see L{GPJobStatus.wait}"""
+        return self._jobstatus.wait(timeout, progress)
     @property
     def results(self):
         "Returns a dict of outputs from the GPTask execution."
@@ -1330,7 +1803,8 @@ class GPExecutionResult(JsonResult):
     @property
     def messages(self):
         "Return a list of messages returned from the server."
-        return map(GPMessage, self._json_struct['messages'])
+        return [GPMessage(message)
+                for message in self._json_struct['messages']]
     @property
     def results(self):
         "Returns a dict of outputs from the GPTask execution."
@@ -1356,6 +1830,9 @@ class GPExecutionResult(JsonResult):
     def running(self):
         "For method compatibility with GPJob, always return false"
         return False
+    def wait(self, timeout=None, progress=None):
+        "For method compatibility with GPJob, always return True"
+        return True
     def __getitem__(self, key):
         return self.__class__.results.__get__(self)[key]
     def __getattr__(self, attr):
@@ -1372,7 +1849,9 @@ class GPTask(RestURL):
 
     def __init__(self, url, file_data=None):
         # Need to force final slash
-        if isinstance(url, compat.string_type):
+        if isinstance(url, ResourceURL):
+            url = url.withTrailingSlash()
+        elif isinstance(url, compat.string_type):
             url = list(compat.urlsplit(url))
         if not url[2].endswith('/'):
             url[2] += '/'
@@ -1414,19 +1893,44 @@ class GPTask(RestURL):
            if it is synchronous. Note that the GPJob and GPExecutionResult
            objects both have the C{.running} property that will return True
            while the job is running in the case of a job, and always return
-           False with the case of the execution result. This can be used to
+           False with the case of the execution result, and a C{.wait()}
+           method that blocks until the job is done. This can be used to
            treat both types of execution as the same in your code; with the
            idiom
            
               >>> result = task(Param_1, Param_2, Param_3, ...)
-              >>> while result.running:
-              ...     time.sleep(0.125)
+              >>> result.wait()
               >>> print result.Output1
         """
         if self.synchronous:
             return self.Execute(*params, **kw)
         else:
             return self.SubmitJob(*params, **kw)
+    def map(self, params, max_in_flight=4, ordered=True, **options):
+        """Run the task for every item of params (a dict of keyword
+           parameters, a tuple of positional ones or a single parameter) and
+           yield (item, results dict) pairs in input order, or as the jobs
+           finish if ordered is False. At most max_in_flight jobs run on the
+           server at once; see L{JobPool<arcrest.gpjobs.JobPool>} for the
+           retries and monitor options. Synchronous tasks run
+           max_in_flight Execute requests at a time instead, retrying those
+           that fail on transient errors (see
+           L{is_transient<arcrest.server.is_transient>}), and take no
+           monitor."""
+        from . import gpjobs
+        if self.synchronous and options.get('monitor') is not None:
+            raise ValueError("Synchronous tasks run no jobs to monitor")
+        pool = gpjobs.JobPool(self, max_in_flight, **options)
+        if self.synchronous:
+            def execute(item):
+                args, kw = pool._arguments(item)
+                return item, self.Execute(*args, **kw).results
+            execute = utils.with_retries(execute, pool.retries,
+                                         RETRY_EXCEPTIONS,
+                                         retry_if=is_transient)
+            return utils.imap_parallel(execute, params, max_in_flight,
+                                       ordered)
+        return pool.map(params, ordered)
     @property
     def name(self):
         return self._json_struct.get('name', '')
@@ -1463,6 +1967,8 @@ class GPTask(RestURL):
 class GeometryResult(JsonResult):
     """Represents the output of a Project, Simplify or Buffer operation 
        performed by an ArcGIS REST API Geometry service."""
+    __post__ = True
+    _batch_keys = ('geometries',) # Per-input arrays joined across batches
 
     @property
     def geometries(self):
@@ -1472,22 +1978,27 @@ class GeometryResult(JsonResult):
 class LengthsResult(JsonResult):
     """Represents the output of a Lengths operation performed by an ArcGIS
        REST API Geometry service."""
+    __post__ = True
+    _batch_keys = ('lengths',)
 
     @property
     def lengths(self):
-        return map(float(length) for length in self._json_struct['lengths'])
+        return [float(length) for length in self._json_struct['lengths']]
 
 class AreasAndLengthsResult(LengthsResult):
     """Represents the output of a AreasAndLengths operation performed by an 
        ArcGIS REST API Geometry service."""
+    _batch_keys = ('areas', 'lengths')
 
     @property
     def areas(self):
-        return map(float(area) for area in self._json_struct['areas'])
+        return [float(area) for area in self._json_struct['areas']]
 
 class LabelPointsResult(JsonResult):
     """Represents the output of a Label Points operation
        performed by an ArcGIS REST API Geometry service."""
+    __post__ = True
+    _batch_keys = ('labelPoints',)
 
     @property
     def labelPoints(self):
@@ -1501,14 +2012,95 @@ class GeometryService(Service):
        sophisticated and frequently used geometric operations. An ArcGIS Server
        Web site can only expose one geometry service with the static name
        "Geometry." Note that geometry input and output, where required, are
-       always packaged as an array."""
+       always packaged as an array.
+
+       Project, Simplify, Buffer, AreasAndLengths, Lengths and LabelPoints
+       are sent as POST requests and split into batches of at most
+       batch_vertex_limit vertices, which are sent batch_workers at a time
+       (each retried up to batch_retries times) and joined back together in
+       the order of the input geometries.
+
+       Setting .cache to a L{ResultCache<arcrest.caching.ResultCache>} (or
+       anything with the same get/set methods) keeps the output of Project,
+       Simplify and Buffer per input geometry, keyed by a hash of the
+       geometry and the operation's parameters, so that only geometries not
+       seen before are sent to the server."""
     __service_type__ = "GeometryServer"
 
-    def Project(self, geometries, inSR=None, outSR=None):
+    #: Optional cache of per-geometry results, see arcrest.caching
+    cache = None
+
+    #: Largest number of vertices to send to the server in one request
+    batch_vertex_limit = 20000
+    #: Number of batches to have in flight at once
+    batch_workers = 4
+    #: Number of times to retry a batch that failed
+    batch_retries = 2
+
+    def _batches(self, geometries):
+        """Split a list of geometries into consecutive lists of at most
+           batch_vertex_limit vertices each. A geometry larger than the limit
+           is sent in a batch of its own."""
+        batches, batch, vertices = [], [], 0
+        for geo in geometries:
+            count = geo._vertex_count
+            if batch and vertices + count > self.batch_vertex_limit:
+                batches.append(batch)
+                batch, vertices = [], 0
+            batch.append(geo)
+            vertices += count
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _run_batched(self, geometries, run_batch, result_type, split=True):
+        """Call run_batch (which makes the request for a list of geometries)
+           on every batch of geometries and return a single result_type
+           instance holding the results in input order."""
+        batches = self._batches(geometries) if split else [geometries]
+        run_batch = utils.with_retries(run_batch, self.batch_retries,
+                                       RETRY_EXCEPTIONS,
+                                       retry_if=is_transient)
+        results = utils.map_parallel(run_batch, batches, self.batch_workers)
+        if len(results) == 1:
+            return results[0]
+        return result_type._from_json_struct(
+                    dict((key, [item for result in results
+                                     for item in result._json_struct[key]])
+                         for key in result_type._batch_keys), self)
+
+    def _run_cached(self, operation, geometries, params, run):
+        """Look up each geometry's output of operation (with params) in
+           self.cache, call run on the list of geometries not found and store
+           what it returns. Returns a GeometryResult for all geometries."""
+        if self.cache is None:
+            return run(geometries)
+        keys = [caching.make_key(operation, geo, params) for geo in geometries]
+        # Null output geometries are cached too, so tell them from misses
+        not_found = object()
+        found = [self.cache.get(key, not_found) for key in keys]
+        missing = [index for index, geo_json in enumerate(found)
+                   if geo_json is not_found]
+        if missing:
+            result = run([geometries[index] for index in missing])
+            for index, geo_json in zip(missing,
+                                       result._json_struct['geometries']):
+                self.cache.set(keys[index], geo_json)
+                found[index] = geo_json
+            if len(missing) == len(geometries):
+                return result
+        return GeometryResult._from_json_struct({'geometries': found}, self)
+
+    def Project(self, geometries, inSR=None, outSR=None, local=True):
         """The project operation is performed on a geometry service resource.
            The result of this operation is an array of projected geometries.
            This resource projects an array of input geometries from an input
-           spatial reference to an output spatial reference."""
+           spatial reference to an output spatial reference.
+
+           If local is True and both spatial references are supported by
+           L{transforms<arcrest.transforms>} (geographic WGS 1984, Web
+           Mercator, Plate Carree and WGS 1984 UTM zones) the projection is
+           done on the client and no request is made to the server."""
 
         if isinstance(geometries, geometry.Geometry):
             geometries = [geometries]
@@ -1518,18 +2110,30 @@ class GeometryService(Service):
 
         assert outSR, "Cannot project to an empty output projection."
 
+        if local and transforms.can_transform(inSR, outSR):
+            projected = transforms.project(geometries, outSR, inSR)
+            return GeometryResult._from_json_struct(
+                        {'geometries': [geo._json_struct
+                                            for geo in projected]}, self)
+
         geometry_types = set([x.__geometry_type__ for x in geometries])
         assert len(geometry_types) == 1, "Too many geometry types"
-        geo_json = json.dumps({'geometryType': list(geometry_types)[0],
-                    'geometries': [geo._json_struct_without_sr 
-                                        for geo in geometries]
-                    })
-
-        return self._get_subfolder('project', GeometryResult, 
-                                   {'geometries': geo_json,
-                                    'inSR': inSR,
-                                    'outSR': outSR
-                                   })
+        geometry_type = list(geometry_types)[0]
+
+        def project_batch(batch):
+            geo_json = json.dumps({'geometryType': geometry_type,
+                        'geometries': [geo._json_struct_without_sr 
+                                            for geo in batch]
+                        })
+            return self._get_subfolder('project', GeometryResult, 
+                                       {'geometries': geo_json,
+                                        'inSR': inSR,
+                                        'outSR': outSR
+                                       })
+        return self._run_cached('project', geometries,
+                                {'inSR': inSR, 'outSR': outSR},
+                                lambda geos: self._run_batched(
+                                    geos, project_batch, GeometryResult))
 
     def Simplify(self, geometries, sr=None):
         """The simplify operation is performed on a geometry service resource. 
@@ -1547,14 +2151,20 @@ class GeometryService(Service):
 
         geometry_types = set([x.__geometry_type__ for x in geometries])
         assert len(geometry_types) == 1, "Too many geometry types"
-        geo_json = json.dumps({'geometryType': list(geometry_types)[0],
-                    'geometries': [geo._json_struct_without_sr
-                                        for geo in geometries]
-                    })
-        return self._get_subfolder('simplify', GeometryResult, 
-                                   {'geometries': geo_json,
-                                    'sr': sr
-                                   })
+        geometry_type = list(geometry_types)[0]
+
+        def simplify_batch(batch):
+            geo_json = json.dumps({'geometryType': geometry_type,
+                        'geometries': [geo._json_struct_without_sr
+                                            for geo in batch]
+                        })
+            return self._get_subfolder('simplify', GeometryResult, 
+                                       {'geometries': geo_json,
+                                        'sr': sr
+                                       })
+        return self._run_cached('simplify', geometries, {'sr': sr},
+                                lambda geos: self._run_batched(
+                                    geos, simplify_batch, GeometryResult))
 
     def Buffer(self, geometries, distances, unit=None, unionResults=False,
                inSR=None, outSR=None, bufferSR=None):
@@ -1566,15 +2176,17 @@ class GeometryService(Service):
         if isinstance(geometries, geometry.Geometry):
             geometries = [geometries]
 
+        # Buffers are only independent per input geometry for a single
+        # distance without unioning, otherwise send everything at once
+        split = not unionResults
+
         if isinstance(distances, (list, tuple)):
+            split = split and len(distances) == 1
             distances=",".join(str(distance) for distance in distances)
 
         geometry_types = set([x.__geometry_type__ for x in geometries])
         assert len(geometry_types) == 1, "Too many geometry types"
-        geo_json = json.dumps({'geometryType': list(geometry_types)[0],
-                    'geometries': [geo._json_struct_without_sr
-                                        for geo in geometries]
-                    })
+        geometry_type = list(geometry_types)[0]
 
         if inSR is None:
             inSR = geometries[0].spatialReference.wkid
@@ -1585,15 +2197,32 @@ class GeometryService(Service):
         if bufferSR is None:
             bufferSR = geometries[0].spatialReference.wkid
 
-        return self._get_subfolder('buffer', GeometryResult, 
-                                   {'geometries': geo_json,
-                                    'distances': distances,
-                                    'unit': unit,
-                                    'unionResults': unionResults,
-                                    'inSR': inSR,
-                                    'outSR': outSR,
-                                    'bufferSR': bufferSR
-                                   })
+        def buffer_batch(batch):
+            geo_json = json.dumps({'geometryType': geometry_type,
+                        'geometries': [geo._json_struct_without_sr
+                                            for geo in batch]
+                        })
+            return self._get_subfolder('buffer', GeometryResult, 
+                                       {'geometries': geo_json,
+                                        'distances': distances,
+                                        'unit': unit,
+                                        'unionResults': unionResults,
+                                        'inSR': inSR,
+                                        'outSR': outSR,
+                                        'bufferSR': bufferSR
+                                       })
+        if not split:
+            # Outputs don't map one-to-one onto inputs, so can't be cached
+            return self._run_batched(geometries, buffer_batch,
+                                     GeometryResult, split)
+        return self._run_cached('buffer', geometries,
+                                {'distances': distances,
+                                 'unit': unit,
+                                 'inSR': inSR,
+                                 'outSR': outSR,
+                                 'bufferSR': bufferSR},
+                                lambda geos: self._run_batched(
+                                    geos, buffer_batch, GeometryResult))
 
     def AreasAndLengths(self, polygons, sr=None, lengthUnit=None, 
                         areaUnit=None):
@@ -1610,15 +2239,18 @@ class GeometryService(Service):
         if sr is None:
             sr = polygons[0].spatialReference.wkid
 
-        geo_json = json.dumps([polygon._json_struct_without_sr
-                                   for polygon in polygons])
-
-        return self._get_subfolder('areasAndLengths', AreasAndLengthsResult, 
-                                    {'polygons': geo_json,
-                                     'sr': sr,
-                                     'lengthUnit': lengthUnit,
-                                     'areaUnit': areaUnit
-                                    })
+        def areas_and_lengths_batch(batch):
+            geo_json = json.dumps([polygon._json_struct_without_sr
+                                       for polygon in batch])
+            return self._get_subfolder('areasAndLengths',
+                                        AreasAndLengthsResult, 
+                                        {'polygons': geo_json,
+                                         'sr': sr,
+                                         'lengthUnit': lengthUnit,
+                                         'areaUnit': areaUnit
+                                        })
+        return self._run_batched(polygons, areas_and_lengths_batch,
+                                 AreasAndLengthsResult)
         
     def Lengths(self, polylines, sr=None, lengthUnit=None, geodesic=None):
         """The lengths operation is performed on a geometry service resource.
@@ -1634,18 +2266,19 @@ class GeometryService(Service):
         if sr is None:
             sr = polylines[0].spatialReference.wkid
 
-        geo_json = json.dumps([polyline._json_struct_without_sr
-                                 for polyline in polylines])
-
         if geodesic is not None:
             geodesic = bool(geodesic)
 
-        return self._get_subfolder('lengths', LengthsResult, 
-                                    {'polylines': geo_json,
-                                     'sr': sr,
-                                     'lengthUnit': lengthUnit,
-                                     'geodesic': geodesic
-                                    })
+        def lengths_batch(batch):
+            geo_json = json.dumps([polyline._json_struct_without_sr
+                                     for polyline in batch])
+            return self._get_subfolder('lengths', LengthsResult, 
+                                        {'polylines': geo_json,
+                                         'sr': sr,
+                                         'lengthUnit': lengthUnit,
+                                         'geodesic': geodesic
+                                        })
+        return self._run_batched(polylines, lengths_batch, LengthsResult)
 
     def LabelPoints(self, polygons, sr):
         """The labelPoints operation is performed on a geometry service
@@ -1661,13 +2294,15 @@ class GeometryService(Service):
         if sr is None:
             sr = polygons[0].spatialReference.wkid
 
-        geo_json = json.dumps([polygon._json_struct_without_sr
-                                 for polygon in polygons])
-
-        return self._get_subfolder('labelPoints', LabelPointsResult, 
-                                    {'polygons': geo_json,
-                                     'sr': sr
-                                    })
+        def label_points_batch(batch):
+            geo_json = json.dumps([polygon._json_struct_without_sr
+                                     for polygon in batch])
+            return self._get_subfolder('labelPoints', LabelPointsResult, 
+                                        {'polygons': geo_json,
+                                         'sr': sr
+                                        })
+        return self._run_batched(polygons, label_points_batch,
+                                 LabelPointsResult)
     def ConvexHull(self, geometries=None, sr=None):
         """The convexHull operation is performed on a geometry service
            resource. It returns the convex hull of the input geometry. The
@@ -1880,11 +2515,102 @@ class ExportImageResult(JsonResult):
     @property
     def extent(self):
         return geometry.fromJson(self._json_struct['extent'])
-    def save(self, outfile):
-        """Save the image data to a file or file-like object"""
-        if isinstance(outfile, compat.string_type):
-            outfile = open(outfile, 'wb')
-        outfile.write(compat.urllib2.urlopen(self.href).read())
+    @property
+    def image(self):
+        """The exported image at href, as an L{ImageData} fetched when it is
+           read or streamed when it is saved"""
+        if not hasattr(self, '_image'):
+            self._image = ImageData(self.href)
+        return self._image
+    @property
+    def data(self):
+        return self.image.data
+    def save(self, outfile, progress=None):
+        """Stream the image data to a file or file-like object; see
+           L{BinaryResult.save}"""
+        return self.image.save(outfile, progress)
+
+#: The array module type codes and NumPy dtypes of the image service pixel
+#: types that can be read in place
+PIXEL_TYPES = {'U8': ('B', 'u1'), 'S8': ('b', 'i1'),
+               'U16': ('H', '<u2'), 'S16': ('h', '<i2'),
+               'U32': ('I', '<u4'), 'S32': ('i', '<i4'),
+               'F32': ('f', '<f4'), 'F64': ('d', '<f8')}
+
+class ExportPixelsResult(BinaryResult):
+    """The raw pixel block of an Image Service exportImage call, band
+       sequential (interleave 'bsq') or band interleaved by pixel ('bip').
+       The data are spooled to a temporary file and memory-mapped when first
+       read rather than held in memory, and are exposed in place as a NumPy
+       array (if NumPy is installed) or a memoryview."""
+    __lazy_fetch__ = True
+    width = height = bandCount = pixelType = None
+    interleave = 'bsq'
+    extent = noData = None
+    _spool = _mapped = None
+
+    @property
+    def itemsize(self):
+        "The size of a pixel value in bytes"
+        return array.array(self._type_code).itemsize
+    @property
+    def _type_code(self):
+        if self.pixelType not in PIXEL_TYPES:
+            raise ValueError("Pixel type %r can't be read in place" %
+                             self.pixelType)
+        return PIXEL_TYPES[self.pixelType][0]
+    @property
+    def shape(self):
+        "(bands, rows, columns) for bsq data, (rows, columns, bands) for bip"
+        if self.interleave == 'bip':
+            return (self.height, self.width, self.bandCount)
+        return (self.bandCount, self.height, self.width)
+    def _map(self):
+        "Fetch the pixel block into a temporary file and memory-map it"
+        if self._mapped is None:
+            expected = (self.width * self.height * self.bandCount *
+                        self.itemsize)
+            spool = tempfile.TemporaryFile()
+            size = self.save(spool)
+            if size != expected:
+                spool.seek(0)
+                message = spool.read(1024)
+                spool.close()
+                raise ServerError("Expected %i bytes of %s pixels, got %i: "
+                                  "%r <%s>" % (expected, self.pixelType,
+                                               size, message, self.url))
+            spool.flush()
+            self._spool = spool
+            self._mapped = mmap.mmap(spool.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        return self._mapped
+    @property
+    def memoryview(self):
+        """The pixels as a memoryview of shape with the pixel type's format,
+           backed by the memory-mapped file (Python 2 memoryviews can't be
+           cast, so there it is a flat view of the bytes)"""
+        view = memoryview(self._map())
+        if hasattr(view, 'cast'):
+            view = view.cast(self._type_code, self.shape)
+        return view
+    @property
+    def pixels(self):
+        """The pixels as a NumPy array of shape, backed by the memory-mapped
+           file, or the same as memoryview if NumPy isn't installed"""
+        try:
+            import numpy
+        except ImportError:
+            return self.memoryview
+        return numpy.frombuffer(self._map(),
+                                PIXEL_TYPES[self.pixelType][1]
+                                ).reshape(self.shape)
+    def close(self):
+        """Unmap and delete the temporary file; views and arrays of the
+           pixels must be released first"""
+        if self._mapped is not None:
+            self._mapped.close()
+            self._spool.close()
+            self._mapped = self._spool = None
 
 @Folder._register_service_type
 class ImageService(Service):
@@ -1918,6 +2644,59 @@ class ImageService(Service):
                                      'mosaicRule': mosaicRule,
                                      'renderingRule': renderingRule
                                     })
+    def ExportPixels(self, bbox, size, interleave='bsq', imageSR=None,
+                     bboxSR=None, pixelType=None, noData=None,
+                     interpolation=None, bandIds=None, mosaicRule=None,
+                     renderingRule=None):
+        """Export the raw pixel values of bbox at size (columns, rows) as an
+           L{ExportPixelsResult<arcrest.server.ExportPixelsResult>}, band
+           sequential (interleave='bsq') or band interleaved by pixel
+           ('bip'). The band count and pixel type are taken from the service
+           definition unless bandIds or pixelType say otherwise; pass
+           pixelType too if a renderingRule changes it."""
+        if bboxSR is None and isinstance(bbox, geometry.Envelope):
+            bboxSR = bbox.spatialReference.wkid
+        if isinstance(bandIds, compat.string_type):
+            # The REST API's comma separated form, e.g. "0,2"
+            bandIds = [int(band) for band in bandIds.split(',')
+                       if band.strip()]
+        elif bandIds is not None:
+            bandIds = list(bandIds)
+        result = self._get_subfolder('exportImage/', ExportPixelsResult,
+                                    {'bbox': bbox,
+                                     'size': size,
+                                     'imageSR': imageSR,
+                                     'bboxSR': bboxSR,
+                                     'format': interleave,
+                                     'pixelType': pixelType,
+                                     'noData': noData,
+                                     'interpolation': interpolation,
+                                     'bandIds': bandIds,
+                                     'mosaicRule': mosaicRule,
+                                     'renderingRule': renderingRule,
+                                     'f': 'image'
+                                    })
+        result.width, result.height = size
+        result.bandCount = len(bandIds) if bandIds else self.bandCount
+        result.pixelType = pixelType or self.pixelType
+        result.interleave = interleave
+        result.extent = bbox
+        result.noData = noData
+        return result
+    @property
+    def bandCount(self):
+        """The number of bands of this service's images"""
+        return self._json_struct.get('bandCount')
+    @property
+    def pixelType(self):
+        """The pixel type of this service's images, such as U8 or F32"""
+        return self._json_struct.get('pixelType')
+    def mosaic(self, workers=4, **options):
+        """Return a L{Mosaic<arcrest.mosaic.Mosaic>} that exports images of
+           this service bigger than maxImageWidth x maxImageHeight; options
+           are passed on to ExportImage."""
+        from . import mosaic
+        return mosaic.Mosaic(self, workers, **options)
 
 @Folder._register_service_type
 class NetworkService(Service):
@@ -2441,10 +3220,33 @@ class FeatureLayerFeature(object):
 class FeatureLayer(MapLayer):
     """The layer resource represents a single editable feature layer or non
        spatial table in a feature service."""
+    #: If set, polyline and polygon features are generalized locally to this
+    #: tolerance (in map units) with generalize_method before AddFeatures,
+    #: UpdateFeatures and ApplyEdits send them, to cut the request size
+    generalize_tolerance = None
+    generalize_method = 'douglas-peucker'
 
     def __getitem__(self, index):
         """Get a feature by featureId"""
         return self._get_subfolder(str(index), FeatureLayerFeature)
+    def edit_buffer(self, max_edits=1000, max_age=None, **options):
+        """Return an L{EditBuffer<arcrest.edits.EditBuffer>} that collects
+           edits to this layer and applies them in bulk, merging repeated
+           updates to the same feature."""
+        from . import edits
+        return edits.EditBuffer(self, max_edits, max_age, **options)
+    def _serialized_features(self, features):
+        """Yield the JSON text of each feature for an edit operation,
+           generalizing it first if enabled"""
+        for feature in features:
+            if self.generalize_tolerance is not None:
+                feature = feature.generalize(self.generalize_tolerance,
+                                             self.generalize_method)
+            yield json.dumps(feature._json_struct_for_featureset)
+    def _features_parameter(self, features):
+        """The features for an edit operation as a JSON array parameter,
+           serialized as it is streamed into the request body"""
+        return JsonArrayParameter(self._serialized_features(features))
     def Feature(self, featureId):
         """Return a feature from this FeatureService by its ID"""
         return self[featureId]
@@ -2480,9 +3282,7 @@ class FeatureLayer(MapLayer):
            array of edit results. Each edit result identifies a single feature
            and indicates if the edit were successful or not. If not, it also
            includes an error code and an error description."""
-        fd = {'features': ",".join(json.dumps(
-                                        feature._json_struct_for_featureset) 
-                                    for feature in features)}
+        fd = {'features': self._features_parameter(features)}
         return self._get_subfolder("./addFeatures", JsonPostResult, fd)
     def UpdateFeatures(self, features):
         """This operation updates features to the associated feature layer or
@@ -2491,9 +3291,7 @@ class FeatureLayer(MapLayer):
            array of edit results. Each edit result identifies a single feature
            and indicates if the edit were successful or not. If not, it also
            includes an error code and an error description."""
-        fd = {'features': ",".join(json.dumps(
-                                        feature._json_struct_for_featureset) 
-                                    for feature in features)}
+        fd = {'features': self._features_parameter(features)}
         return self._get_subfolder("./updateFeatures", JsonPostResult, fd)
     def DeleteFeatures(self, objectIds=None, where=None, geometry=None,
                        inSR=None, spatialRel=None):
@@ -2516,31 +3314,31 @@ class FeatureLayer(MapLayer):
                                                     'inSR': inSR,
                                                     'spatialRel': spatialRel
                                     })
-    def ApplyEdits(self, adds=None, updates=None, deletes=None):
+    def ApplyEdits(self, adds=None, updates=None, deletes=None,
+                   useGlobalIds=None, rollbackOnFailure=None):
         """This operation adds, updates and deletes features to the associated
            feature layer or table in a single call (POST only). The apply edits
            operation is performed on a feature service layer resource. The
            result of this operation are 3 arrays of edit results (for adds,
            updates and deletes respectively). Each edit result identifies a
            single feature and indicates if the edit were successful or not. If
-           not, it also includes an error code and an error description."""
+           not, it also includes an error code and an error description.
+
+           Everything is sent in a single request; to load a large number of
+           edits in chunks, see L{EditLoader<arcrest.edits.EditLoader>}."""
         add_str, update_str = None, None
         if adds:
-            add_str = ",".join(json.dumps(
-                                        feature._json_struct_for_featureset) 
-                                    for feature in adds)
+            add_str = self._features_parameter(adds)
         if updates:
-            update_str = ",".join(json.dumps(
-                                        feature._json_struct_for_featureset) 
-                                    for feature in updates)
+            update_str = self._features_parameter(updates)
+        if deletes and not isinstance(deletes, compat.string_type):
+            deletes = ",".join(str(objectid) for objectid in deletes)
         return self._get_subfolder("./applyEdits", JsonPostResult,
-                                                                 {'adds':
-                                                                       add_str,
-                                                                  'updates':
-                                                                    update_str,
-                                                                   'deletes':
-                                                                        deletes
-                                                                   })
+                                   {'adds': add_str,
+                                    'updates': update_str,
+                                    'deletes': deletes,
+                                    'useGlobalIds': useGlobalIds,
+                                    'rollbackOnFailure': rollbackOnFailure})
         
 
 @Folder._register_service_type
@@ -0,0 +1,354 @@
+# coding: utf-8
+"""Bulk fetching of the tiles of a cached map service into a local tile
+   store. Tiles are downloaded a few at a time and written to an
+   MBTiles-style SQLite database, which later reads are served from:
+
+      >>> import arcrest.tiles
+      >>> store = arcrest.tiles.TileStore("basemap.mbtiles")
+      >>> fetcher = arcrest.tiles.TileFetcher(map_service, store, workers=16)
+      >>> fetcher.fetch(arcrest.tiles.tile_range(12, range(1580, 1640),
+      ...                                            range(700, 760)))
+      <TileFetch 3600 fetched, 0 cached, 212 empty, 0 failed, 46.3 tiles/s>
+      >>> png = fetcher.tile(12, 1601, 733)
+
+   A tile the server answers with a 404 (Not Found) is stored as an empty
+   tile, so it isn't asked for again.
+
+   A L{TilingScheme<arcrest.tiles.TilingScheme>}, built from a map
+   service's tileInfo, finds the tiles covering an extent:
+
+      >>> scheme = map_service.tilingScheme
+      >>> scheme.count(extent, range(10, 17))
+      1893420
+      >>> fetcher.fetch(scheme.tiles(extent, range(10, 17)))
+   """
+
+import math
+import sqlite3
+import threading
+import time
+
+from . import compat
+from . import geometry
+from . import utils
+from .server import RETRY_EXCEPTIONS, is_transient
+
+__all__ = ['TilingScheme', 'TileStore', 'TileFetch', 'TileFetcher',
+           'tile_range']
+
+def tile_range(level, rows, cols):
+    """Yield the (level, row, column) of every tile at level in the rows and
+       cols ranges, row by row"""
+    for row in rows:
+        for col in cols:
+            yield (level, row, col)
+
+class TilingScheme(object):
+    """The tile pyramid of a cached map service: tiles of cols x rows pixels
+       laid out right and down from origin, a Point in spatialReference, at
+       each level of detail in lods (a list of dicts of level, resolution in
+       map units per pixel and scale). Extents passed in are taken to be in
+       the scheme's spatial reference."""
+    def __init__(self, origin, lods, rows=256, cols=256, dpi=96,
+                 format=None, spatialReference=None):
+        self.origin = origin
+        self.lods = sorted(lods, key=lambda lod: lod['level'])
+        self.rows, self.cols = rows, cols
+        self.dpi = dpi
+        self.format = format
+        self.spatialReference = spatialReference
+        self._resolutions = dict((lod['level'], lod['resolution'])
+                                 for lod in self.lods)
+    @classmethod
+    def fromJson(cls, tile_info):
+        "Build a tiling scheme from the tileInfo of a service"
+        spatialReference = None
+        if tile_info.get('spatialReference'):
+            spatialReference = geometry.fromJson(
+                                                tile_info['spatialReference'])
+        origin = tile_info['origin']
+        return cls(geometry.Point(origin['x'], origin['y'], spatialReference),
+                   tile_info['lods'], tile_info.get('rows', 256),
+                   tile_info.get('cols', 256), tile_info.get('dpi', 96),
+                   tile_info.get('format'), spatialReference)
+    @property
+    def levels(self):
+        "The level numbers of the scheme, from coarsest to finest"
+        return [lod['level'] for lod in self.lods]
+    def resolution(self, level):
+        "The size of a pixel at level, in map units"
+        return self._resolutions[level]
+    def level_for_resolution(self, resolution):
+        """The coarsest level whose pixels are no bigger than resolution, or
+           the finest level if they all are"""
+        for lod in self.lods:
+            if lod['resolution'] <= resolution * (1 + 1e-9):
+                return lod['level']
+        return self.lods[-1]['level']
+    def _tile_size(self, level):
+        "The width and height of a tile at level, in map units"
+        resolution = self._resolutions[level]
+        return self.cols * resolution, self.rows * resolution
+    def tile_at(self, point, level):
+        """The (level, row, column) of the tile at level containing point, a
+           Point or an (x, y) pair"""
+        if isinstance(point, geometry.Point):
+            x, y = point.x, point.y
+        else:
+            x, y = point[:2]
+        width, height = self._tile_size(level)
+        return (level,
+                int(math.floor((self.origin.y - y) / height)),
+                int(math.floor((x - self.origin.x) / width)))
+    def tile_extent(self, level, row, col):
+        "The Envelope a tile covers, in map units"
+        width, height = self._tile_size(level)
+        xmin = self.origin.x + col * width
+        ymax = self.origin.y - row * height
+        return geometry.Envelope(xmin, ymax - height, xmin + width, ymax,
+                                 self.spatialReference)
+    def tile_bounds(self, extent, level):
+        """The (first row, last row, first column, last column) of the tiles
+           at level covering extent, an Envelope. Tiles that only touch the
+           edge of the extent are left out, and so are rows and columns
+           before the origin; the last row or column is before the first if
+           no tiles are left."""
+        width, height = self._tile_size(level)
+        # Scaled by the tile size, so a small epsilon absorbs float error
+        # at tile edges
+        left = (extent.xmin - self.origin.x) / width
+        right = (extent.xmax - self.origin.x) / width
+        top = (self.origin.y - extent.ymax) / height
+        bottom = (self.origin.y - extent.ymin) / height
+        first_col = int(math.floor(left + 1e-9))
+        last_col = max(int(math.ceil(right - 1e-9)) - 1, first_col)
+        first_row = int(math.floor(top + 1e-9))
+        last_row = max(int(math.ceil(bottom - 1e-9)) - 1, first_row)
+        # Nothing lies before the origin: the range is then empty if the
+        # whole extent does
+        return (max(first_row, 0), last_row, max(first_col, 0), last_col)
+    def _levels(self, levels):
+        if levels is None:
+            return self.levels
+        if isinstance(levels, int):
+            return [levels]
+        return levels
+    def tiles(self, extent, levels=None):
+        """Yield the (level, row, column) of every tile covering extent at
+           levels (a level, an iterable of levels or every level), one level
+           at a time and row by row. Tiles are generated as they are asked
+           for, so an extent may cover any number of them."""
+        for level in self._levels(levels):
+            first_row, last_row, first_col, last_col = \
+                self.tile_bounds(extent, level)
+            for tile in tile_range(level,
+                                   compat.xrange(first_row, last_row + 1),
+                                   compat.xrange(first_col, last_col + 1)):
+                yield tile
+    def count(self, extent, levels=None):
+        "The number of tiles covering extent at levels, as tiles would yield"
+        total = 0
+        for level in self._levels(levels):
+            first_row, last_row, first_col, last_col = \
+                self.tile_bounds(extent, level)
+            total += (max(last_row - first_row + 1, 0) *
+                      max(last_col - first_col + 1, 0))
+        return total
+    def __repr__(self):
+        return "<TilingScheme %ix%i, levels %s-%s>" % (
+                    self.cols, self.rows, self.lods[0]['level'],
+                    self.lods[-1]['level'])
+
+class TileStore(object):
+    """Tiles kept in a SQLite database at path, laid out as an MBTiles file:
+       a tiles table of (zoom_level, tile_column, tile_row, tile_data) and a
+       metadata table of (name, value) pairs. Rows are the service's own
+       tile rows, counted down from the tiling scheme's origin rather than
+       flipped to the TMS scheme, and are recorded as such in the 'scheme'
+       metadata entry. Empty tiles are stored with zero-length tile data.
+
+       The database is opened in WAL mode so other connections, or other
+       processes, can read tiles while they are being written."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS metadata "
+                                     "(name TEXT PRIMARY KEY, value TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS tiles "
+                                     "(zoom_level INTEGER NOT NULL, "
+                                     " tile_column INTEGER NOT NULL, "
+                                     " tile_row INTEGER NOT NULL, "
+                                     " tile_data BLOB NOT NULL)")
+            self._connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS "
+                                     "tile_index ON tiles "
+                                     "(zoom_level, tile_column, tile_row)")
+            self._connection.execute("INSERT OR IGNORE INTO metadata "
+                                     "(name, value) VALUES ('scheme', 'xyz')")
+            self._connection.commit()
+    def get(self, level, row, col):
+        """The data of a tile: a zero-length string for an empty tile, or
+           None if the tile isn't in the store"""
+        with self._lock:
+            found = self._connection.execute("SELECT tile_data FROM tiles "
+                                             "WHERE zoom_level = ? AND "
+                                             "tile_column = ? AND "
+                                             "tile_row = ?",
+                                             (level, col, row)).fetchone()
+        if found is None:
+            return None
+        return bytes(found[0])
+    def __contains__(self, tile):
+        level, row, col = tile
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM tiles "
+                                            "WHERE zoom_level = ? AND "
+                                            "tile_column = ? AND "
+                                            "tile_row = ?",
+                                            (level, col, row)).fetchone() \
+                        is not None
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) "
+                                            "FROM tiles").fetchone()[0]
+    def put_many(self, tiles):
+        """Store an iterable of (level, row, column, data) tiles in one
+           transaction; data of None or '' is an empty tile"""
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO tiles "
+                                         "(zoom_level, tile_column, tile_row,"
+                                         " tile_data) VALUES (?, ?, ?, ?)",
+                                         ((level, col, row,
+                                           sqlite3.Binary(data or b''))
+                                          for (level, row, col, data)
+                                              in tiles))
+            self._connection.commit()
+    def put(self, level, row, col, data):
+        "Store a single tile"
+        self.put_many([(level, row, col, data)])
+    @property
+    def metadata(self):
+        "The metadata entries of the store as a dict"
+        with self._lock:
+            return dict(self._connection.execute("SELECT name, value "
+                                                 "FROM metadata").fetchall())
+    def set_metadata(self, **values):
+        "Set metadata entries, such as name, format, bounds or attribution"
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO metadata "
+                                         "(name, value) VALUES (?, ?)",
+                                         [(name, str(value))
+                                          for name, value in values.items()])
+            self._connection.commit()
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class TileFetch(object):
+    """The outcome of a L{TileFetcher<arcrest.tiles.TileFetcher>} run: the
+       number of tiles fetched from the service, already in the store
+       (cached) and found to be empty, the (tile, exception) pairs of the
+       tiles that couldn't be fetched, and the bytes downloaded."""
+    def __init__(self):
+        self.fetched, self.cached, self.empty = 0, 0, 0
+        self.failed = []
+        self.bytes = 0
+        self.started = time.time()
+        self.finished = None
+    @property
+    def seconds(self):
+        "Wall clock time of the fetch so far"
+        return (self.finished or time.time()) - self.started
+    @property
+    def tiles_per_second(self):
+        "Tiles fetched from the service per second"
+        return self.fetched / max(self.seconds, 1e-6)
+    def __repr__(self):
+        return ("<TileFetch %i fetched, %i cached, %i empty, %i failed, "
+                "%.1f tiles/s>" % (self.fetched, self.cached, self.empty,
+                                   len(self.failed), self.tiles_per_second))
+
+def _not_missing(error):
+    "Whether a failed tile request was for a tile the server does have"
+    return not (isinstance(error, compat.HTTPError) and error.code == 404)
+
+def _worth_retrying(error):
+    "Whether a failed tile request may succeed if made again"
+    return _not_missing(error) and is_transient(error)
+
+class TileFetcher(object):
+    """Fetches the tiles of a cached L{MapService<arcrest.server.MapService>}
+       on up to workers threads into a
+       L{TileStore<arcrest.tiles.TileStore>}. Tiles are written to the
+       store from the calling thread, commit_every tiles per transaction. A
+       request that fails on a transient error is tried again up to retries
+       times, retry_delay seconds later (doubling each time)."""
+    def __init__(self, service, store, workers=8, retries=2,
+                 commit_every=256, retry_delay=0.5):
+        self.service = service
+        self.store = store
+        self.workers = workers
+        self.retries = retries
+        self.commit_every = commit_every
+        self.retry_delay = retry_delay
+    def _get(self, tile):
+        level, row, col = tile
+        return self.service.tile(row, col, level).data
+    def download(self, tile):
+        """Fetch one (level, row, column) tile from the service. Returns
+           (tile, data, None), with empty data if the server has no such
+           tile, or (tile, None, exception) if it couldn't be fetched."""
+        get = utils.with_retries(self._get, self.retries, RETRY_EXCEPTIONS,
+                                 self.retry_delay, retry_if=_worth_retrying)
+        try:
+            return tile, get(tile), None
+        except RETRY_EXCEPTIONS as e:
+            if not _not_missing(e):
+                return tile, b'', None
+            return tile, None, e
+    def fetch(self, tiles, refresh=False):
+        """Fetch every (level, row, column) tile in tiles that isn't in the
+           store yet (or every one, with refresh) and return a
+           L{TileFetch<arcrest.tiles.TileFetch>} report. tiles may be a
+           generator over any number of tiles."""
+        report = TileFetch()
+        def missing():
+            for tile in tiles:
+                if not refresh and tile in self.store:
+                    report.cached += 1
+                else:
+                    yield tuple(tile)
+        pending = []
+        for tile, data, error in utils.imap_parallel(self.download,
+                                                     missing(),
+                                                     self.workers,
+                                                     ordered=False):
+            if error is not None:
+                report.failed.append((tile, error))
+                continue
+            if data:
+                report.fetched += 1
+                report.bytes += len(data)
+            else:
+                report.empty += 1
+            pending.append(tile + (data,))
+            if len(pending) >= self.commit_every:
+                self.store.put_many(pending)
+                pending = []
+        if pending:
+            self.store.put_many(pending)
+        report.finished = time.time()
+        return report
+    def tile(self, level, row, col):
+        """The data of a tile, read from the store or fetched into it if it
+           isn't there yet; zero-length for an empty tile"""
+        data = self.store.get(level, row, col)
+        if data is None:
+            tile, data, error = self.download((level, row, col))
+            if error is not None:
+                raise error
+            self.store.put(level, row, col, data)
+        return data
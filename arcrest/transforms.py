@@ -0,0 +1,291 @@
+# coding: utf-8
+"""Local implementations of the analytic coordinate transformations that make
+   up the bulk of GeometryService.Project traffic: WGS 1984 geographic
+   coordinates (4326), Web Mercator (3857/102100/102113/900913), Plate Carrée
+   (32662/54001) and the WGS 1984 UTM zones listed in
+   L{projections<arcrest.projections>}. Coordinates are handled as flat
+   arrays of x and y values so a whole list of geometries is transformed in
+   one pass.
+
+      >>> import arcrest
+      >>> arcrest.transforms.can_transform(4326, 102100)
+      True
+      >>> arcrest.transforms.project([arcrest.Point(-117.2, 34.05, 4326)],
+      ...                            102100)
+      [POINT(-13046644.32097 4035517.78208)]
+   """
+
+import array
+import math
+import re
+
+from . import compat
+from . import geometry
+from .projections import projected, geographic
+
+__all__ = ['UnsupportedSpatialReference', 'supported', 'can_transform',
+           'transform', 'project']
+
+#: WGS 1984 ellipsoid semimajor axis (meters) and flattening
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+#: Latitude beyond which Web Mercator y values are clamped
+MERCATOR_MAX_LATITUDE = 85.0511287798066
+
+GEOGRAPHIC_WKIDS = frozenset([geographic.GCS_WGS_1984])
+WEB_MERCATOR_WKIDS = frozenset([3857, 900913,
+                                projected.WGS_1984_Web_Mercator,
+                                projected.
+                                    WGS_1984_Web_Mercator_Auxiliary_Sphere])
+PLATE_CARREE_WKIDS = frozenset([projected.WGS_1984_Plate_Carree,
+                                projected.World_Plate_Carree])
+
+# WKID -> (zone, northern hemisphere?) for every WGS 1984 UTM zone in the
+# projections table
+UTM_ZONES = {}
+for _name, _wkid in projected._projections.items():
+    _match = re.match(r"^WGS_1984_UTM_Zone_(\d+)([NS])$", _name)
+    if _match:
+        UTM_ZONES[_wkid] = (int(_match.group(1)), _match.group(2) == 'N')
+del _name, _wkid, _match
+
+class UnsupportedSpatialReference(ValueError):
+    """A spatial reference that can't be transformed locally: one given as
+       WKT or by an unknown name, or a WKID with no local transformation"""
+
+def _wkid(sr):
+    """Pull the integer WKID out of a SpatialReference, JSON dict, number or
+       projection name (as in L{projections<arcrest.projections>})"""
+    if isinstance(sr, geometry.SpatialReference):
+        return sr.wkid
+    elif isinstance(sr, dict):
+        wkid = sr.get('wkid', sr.get('latestWkid'))
+        if wkid is None and sr:
+            raise UnsupportedSpatialReference("Spatial reference %r has no "
+                                              "WKID; only WKIDs can be "
+                                              "transformed locally" % (sr,))
+        return wkid
+    elif sr is None or isinstance(sr, bool):
+        return None
+    elif isinstance(sr, (int, float)):
+        return int(sr)
+    elif isinstance(sr, compat.string_type):
+        name = sr.strip()
+        if name.isdigit():
+            return int(name)
+        for table in (projected, geographic):
+            if hasattr(table, name):
+                return getattr(table, name)
+        raise UnsupportedSpatialReference("Spatial reference %r is not a "
+                                          "WKID or a known projection name"
+                                          % (sr if len(sr) <= 60
+                                                else sr[:57] + "...",))
+    raise UnsupportedSpatialReference("Cannot take a WKID from a %r" %
+                                      sr.__class__.__name__)
+
+def supported(sr):
+    """Returns True if the spatial reference can be transformed locally; a
+       spatial reference given as WKT or by an unknown name can't be"""
+    try:
+        wkid = _wkid(sr)
+    except UnsupportedSpatialReference:
+        return False
+    return (wkid in GEOGRAPHIC_WKIDS or wkid in WEB_MERCATOR_WKIDS or
+            wkid in PLATE_CARREE_WKIDS or wkid in UTM_ZONES)
+
+def can_transform(inSR, outSR):
+    """Returns True if coordinates can be transformed from inSR to outSR
+       without a round trip to a geometry service."""
+    return supported(inSR) and supported(outSR)
+
+def _identity(xs, ys):
+    return array.array('d', xs), array.array('d', ys)
+
+def _mercator_forward(xs, ys):
+    radius, to_rad = WGS84_A, math.pi / 180.0
+    log, tan, quarter_pi = math.log, math.tan, math.pi / 4.0
+    max_lat, min_lat = MERCATOR_MAX_LATITUDE, -MERCATOR_MAX_LATITUDE
+    outx = array.array('d', [x * to_rad * radius for x in xs])
+    outy = array.array('d',
+                [radius * log(tan(quarter_pi +
+                                  (max(min(y, max_lat), min_lat) * to_rad)
+                                  / 2.0))
+                 for y in ys])
+    return outx, outy
+
+def _mercator_inverse(xs, ys):
+    radius, to_deg = WGS84_A, 180.0 / math.pi
+    atan, exp, half_pi = math.atan, math.exp, math.pi / 2.0
+    outx = array.array('d', [x / radius * to_deg for x in xs])
+    outy = array.array('d', [(2.0 * atan(exp(y / radius)) - half_pi) * to_deg
+                             for y in ys])
+    return outx, outy
+
+def _plate_carree_forward(xs, ys):
+    scale = WGS84_A * math.pi / 180.0
+    return (array.array('d', [x * scale for x in xs]),
+            array.array('d', [y * scale for y in ys]))
+
+def _plate_carree_inverse(xs, ys):
+    scale = WGS84_A * math.pi / 180.0
+    return (array.array('d', [x / scale for x in xs]),
+            array.array('d', [y / scale for y in ys]))
+
+# Krüger series coefficients for the transverse Mercator projection on the
+# WGS 1984 ellipsoid, to third order in the third flattening n.
+_n = WGS84_F / (2.0 - WGS84_F)
+_UTM_A = WGS84_A / (1.0 + _n) * (1.0 + _n ** 2 / 4.0 + _n ** 4 / 64.0)
+_UTM_ALPHA = (_n / 2.0 - 2.0 * _n ** 2 / 3.0 + 5.0 * _n ** 3 / 16.0,
+              13.0 * _n ** 2 / 48.0 - 3.0 * _n ** 3 / 5.0,
+              61.0 * _n ** 3 / 240.0)
+_UTM_BETA = (_n / 2.0 - 2.0 * _n ** 2 / 3.0 + 37.0 * _n ** 3 / 96.0,
+             _n ** 2 / 48.0 + _n ** 3 / 15.0,
+             17.0 * _n ** 3 / 480.0)
+_UTM_DELTA = (2.0 * _n - 2.0 * _n ** 2 / 3.0 - 2.0 * _n ** 3,
+              7.0 * _n ** 2 / 3.0 - 8.0 * _n ** 3 / 5.0,
+              56.0 * _n ** 3 / 15.0)
+_UTM_E = 2.0 * math.sqrt(_n) / (1.0 + _n)
+_UTM_K0 = 0.9996
+_UTM_FALSE_EASTING = 500000.0
+_UTM_FALSE_NORTHING_SOUTH = 10000000.0
+del _n
+
+def _utm_functions(zone, north):
+    "Build the (forward, inverse) transform pair for a single UTM zone"
+    to_rad, to_deg = math.pi / 180.0, 180.0 / math.pi
+    lon0 = (zone * 6.0 - 183.0) * to_rad
+    false_northing = 0.0 if north else _UTM_FALSE_NORTHING_SOUTH
+    scale = _UTM_K0 * _UTM_A
+    alpha, beta, delta = _UTM_ALPHA, _UTM_BETA, _UTM_DELTA
+    sin, cos, sinh, cosh = math.sin, math.cos, math.sinh, math.cosh
+    atan, atanh, asin, sqrt = math.atan, math.atanh, math.asin, math.sqrt
+    atan2, eccentricity = math.atan2, _UTM_E
+    def forward(xs, ys):
+        outx, outy = array.array('d'), array.array('d')
+        for lon, lat in zip(xs, ys):
+            sinlat = sin(lat * to_rad)
+            dlon = lon * to_rad - lon0
+            t = sinh(atanh(sinlat) - eccentricity * atanh(eccentricity *
+                                                          sinlat))
+            xi = atan2(t, cos(dlon))
+            eta = atanh(sin(dlon) / sqrt(1.0 + t * t))
+            easting, northing = eta, xi
+            for j, a in enumerate(alpha):
+                j2 = 2.0 * (j + 1)
+                easting += a * cos(j2 * xi) * sinh(j2 * eta)
+                northing += a * sin(j2 * xi) * cosh(j2 * eta)
+            outx.append(_UTM_FALSE_EASTING + scale * easting)
+            outy.append(false_northing + scale * northing)
+        return outx, outy
+    def inverse(xs, ys):
+        outx, outy = array.array('d'), array.array('d')
+        for x, y in zip(xs, ys):
+            xi = (y - false_northing) / scale
+            eta = (x - _UTM_FALSE_EASTING) / scale
+            xiprime, etaprime = xi, eta
+            for j, b in enumerate(beta):
+                j2 = 2.0 * (j + 1)
+                xiprime -= b * sin(j2 * xi) * cosh(j2 * eta)
+                etaprime -= b * cos(j2 * xi) * sinh(j2 * eta)
+            chi = asin(sin(xiprime) / cosh(etaprime))
+            lat = chi
+            for j, d in enumerate(delta):
+                lat += d * sin(2.0 * (j + 1) * chi)
+            outx.append((lon0 + atan2(sinh(etaprime), cos(xiprime))) * to_deg)
+            outy.append(lat * to_deg)
+        return outx, outy
+    return forward, inverse
+
+def _functions_for(wkid):
+    "Return the (from geographic, to geographic) transform pair for a WKID"
+    if wkid in GEOGRAPHIC_WKIDS:
+        return _identity, _identity
+    elif wkid in WEB_MERCATOR_WKIDS:
+        return _mercator_forward, _mercator_inverse
+    elif wkid in PLATE_CARREE_WKIDS:
+        return _plate_carree_forward, _plate_carree_inverse
+    elif wkid in UTM_ZONES:
+        return _utm_functions(*UTM_ZONES[wkid])
+    raise UnsupportedSpatialReference("No local transformation for WKID %r"
+                                      % wkid)
+
+def transform(xs, ys, inSR, outSR):
+    """Transform the coordinates in the parallel sequences xs and ys from
+       inSR to outSR. Returns a new pair of array('d') instances."""
+    inwkid, outwkid = _wkid(inSR), _wkid(outSR)
+    to_out, _ = _functions_for(outwkid)
+    _, from_in = _functions_for(inwkid)
+    if inwkid == outwkid:
+        return _identity(xs, ys)
+    lons, lats = from_in(xs, ys)
+    return to_out(lons, lats)
+
+def _envelope_boundary(envelope, steps=8):
+    """Sample the edges of an envelope as a flat coordinate buffer so that
+       the bounds of a curved projected outline can be recovered."""
+    xmin, ymin, xmax, ymax = envelope._bounds
+    dx, dy = (xmax - xmin) / steps, (ymax - ymin) / steps
+    boundary = array.array('d')
+    for i in range(steps):
+        boundary.extend((xmin + dx * i, ymin))
+    for i in range(steps):
+        boundary.extend((xmax, ymin + dy * i))
+    for i in range(steps):
+        boundary.extend((xmax - dx * i, ymax))
+    for i in range(steps):
+        boundary.extend((xmin, ymax - dy * i))
+    return boundary
+
+def _coordinate_parts(geom):
+    "The flat x, y coordinate buffers making up a geometry, in a fixed order"
+    if isinstance(geom, geometry.Point):
+        return [array.array('d', (geom.x, geom.y))]
+    elif isinstance(geom, (geometry.Multipoint, geometry.Polyline,
+                           geometry.Polygon)):
+        return geom._coordinate_parts
+    elif isinstance(geom, geometry.Envelope):
+        return [_envelope_boundary(geom)]
+    raise TypeError("Cannot transform geometry of type %r" %
+                    geom.__class__.__name__)
+
+def _rebuild(geom, parts, sr):
+    "Build a geometry like geom from a list of transformed coordinate buffers"
+    if isinstance(geom, geometry.Point):
+        new_geom = geometry.Point(parts[0][0], parts[0][1], sr)
+    elif isinstance(geom, geometry.Envelope):
+        new_geom = geometry.Envelope(*(geometry.boundsofparts(parts) + (sr,)))
+    else:
+        new_geom = geom.__class__._from_parts(parts, sr)
+    if hasattr(geom, 'attributes'):
+        new_geom.attributes = geom.attributes
+    return new_geom
+
+def project(geometries, outSR, inSR=None):
+    """Project a geometry or list of geometries to outSR locally, returning a
+       list of new geometries. If inSR is not specified, the spatial reference
+       of the first geometry is used. All of the coordinates are gathered
+       into a single pair of arrays and transformed together."""
+    if isinstance(geometries, geometry.Geometry):
+        geometries = [geometries]
+    if inSR is None:
+        inSR = geometries[0].spatialReference
+    outSR = geometry.SpatialReference(_wkid(outSR))
+    geometry_parts = [_coordinate_parts(geom) for geom in geometries]
+    xs, ys = array.array('d'), array.array('d')
+    for parts in geometry_parts:
+        for part in parts:
+            xs.extend(part[0::2])
+            ys.extend(part[1::2])
+    xs, ys = transform(xs, ys, inSR, outSR)
+    output, index = [], 0
+    for geom, parts in zip(geometries, geometry_parts):
+        new_parts = []
+        for part in parts:
+            end = index + len(part) // 2
+            new_part = array.array('d', part)
+            new_part[0::2], new_part[1::2] = xs[index:end], ys[index:end]
+            new_parts.append(new_part)
+            index = end
+        output.append(_rebuild(geom, new_parts, outSR))
+    return output
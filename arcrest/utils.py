@@ -3,9 +3,13 @@
 
 import calendar
 import datetime
+import threading
 import time
 
-__all__ = ['timetopythonvalue', 'pythonvaluetotime']
+from . import compat
+
+__all__ = ['timetopythonvalue', 'pythonvaluetotime', 'with_retries',
+           'imap_parallel', 'map_parallel']
 
 try:
     long, unicode, basestring
@@ -56,3 +60,81 @@ def pythonvaluetotime(time_val):
             return ",".join(pythonvaluetotime(x) 
                             for x in time_val)
     raise ValueError(repr(time_val))
+
+def with_retries(function, retries=2, exceptions=(Exception,), delay=0.5,
+                 retry_if=None):
+    """Wrap function so that a call raising one of exceptions is repeated up
+       to retries more times, waiting delay seconds (doubling each time)
+       between attempts. If given, retry_if is called with each exception
+       and only those it returns True for are retried. The last exception
+       is re-raised."""
+    def retrying_function(*args, **kw):
+        wait = delay
+        for attempt in range(retries + 1):
+            try:
+                return function(*args, **kw)
+            except exceptions as e:
+                if attempt == retries or (retry_if is not None and
+                                          not retry_if(e)):
+                    raise
+            time.sleep(wait)
+            wait *= 2
+    return retrying_function
+
+def imap_parallel(function, iterable, workers=4, ordered=True):
+    """Apply function to every item of iterable on up to workers threads,
+       yielding the results in input order (ordered=True) or as soon as they
+       are done (ordered=False). Only a couple of items per worker are taken
+       from iterable ahead of the consumer, so it may be a generator over a
+       very large input. The first exception raised by function is re-raised
+       in the consuming thread."""
+    if workers <= 1:
+        for item in iterable:
+            yield function(item)
+        return
+    tasks, done = compat.queue.Queue(), compat.queue.Queue()
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, item = task
+            try:
+                done.put((index, True, function(item)))
+            except Exception as e:
+                done.put((index, False, e))
+    threads = [threading.Thread(target=worker) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    items = iter(enumerate(iterable))
+    submitted, next_index, finished, exhausted = 0, 0, {}, False
+    try:
+        while True:
+            while not exhausted and submitted - next_index < workers * 2:
+                try:
+                    tasks.put(next(items))
+                    submitted += 1
+                except StopIteration:
+                    exhausted = True
+            if next_index == submitted:
+                return
+            index, succeeded, value = done.get()
+            if not succeeded:
+                raise value
+            if not ordered:
+                next_index += 1
+                yield value
+                continue
+            finished[index] = value
+            while next_index in finished:
+                next_index += 1
+                yield finished.pop(next_index - 1)
+    finally:
+        for thread in threads:
+            tasks.put(None)
+
+def map_parallel(function, iterable, workers=4):
+    """Like map(), but run function on up to workers threads at once. Returns
+       a list of results in input order."""
+    return list(imap_parallel(function, iterable, workers))
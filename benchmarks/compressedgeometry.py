@@ -0,0 +1,88 @@
+# coding: utf-8
+"""Compare the compressedGeometry codec in arcrest.geometry against the
+   original regex/slicing implementation it replaced.
+
+      python benchmarks/compressedgeometry.py [vertex count]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from arcrest import geometry
+
+def reference_decode(compressedstring):
+    "The original Polyline.fromCompressedGeometry"
+    result = []
+    ints = [(-1 if number[0] == '-' else 1) * int(number[1:], 32)
+               for number in re.findall("([+-][a-v0-9]*)",
+                                        compressedstring)]
+    multiplier = float(ints.pop(0))
+    oldx, oldy = 0, 0
+    while ints:
+        x, y = ints[:2]
+        ints = ints[2:]
+        x += oldx
+        y += oldy
+        result.append(geometry.Point(x/multiplier, y/multiplier))
+        oldx, oldy = x, y
+    return geometry.Polyline([result])
+
+def reference_encode(polyline, multiplier=55000):
+    "The original Polyline.asCompressedGeometry"
+    def base32(num):
+        sign = "+" if num >= 0 else "-"
+        if num < 0:
+            num = -num
+        digits = "0123456789abcdefghijklmnopqrstuv"
+        nums = []
+        while num:
+            nums.append(num & 0x1F)
+            num = num >> 5
+        return sign + ''.join(digits[x] for x in reversed(nums))
+    def compressedstring():
+        yield base32(multiplier)
+        oldx, oldy = 0, 0
+        for ints in polyline._json_paths:
+            for (x, y) in ints:
+                yield base32(int((x - oldx)*multiplier))
+                yield base32(int((y - oldy)*multiplier))
+                oldx, oldy = x, y
+    return ''.join(compressedstring())
+
+def best_of(function, repeat=5):
+    "Best wall clock time in seconds of a single call to function"
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def main(vertices=20000):
+    random.seed(0)
+    x, y, path = -117.0, 34.0, []
+    for i in range(vertices):
+        # A random walk, like a route, so deltas stay small
+        x += random.uniform(-0.001, 0.001)
+        y += random.uniform(-0.001, 0.001)
+        path.append([x, y])
+    polyline = geometry.Polyline([path])
+    compressed = polyline.asCompressedGeometry()
+    # The original encoder writes "+" for zero deltas, which its own decoder
+    # can't read, so both decoders are given the new encoder's output.
+    print("%i vertices, %i characters" % (vertices, len(compressed)))
+    for name, old, new in (
+            ("decode", lambda: reference_decode(compressed),
+                       lambda: geometry.Polyline.fromCompressedGeometry(
+                                                                compressed)),
+            ("encode", lambda: reference_encode(polyline),
+                       lambda: polyline.asCompressedGeometry())):
+        old_time, new_time = best_of(old), best_of(new)
+        print("%s: original %8.2f ms, current %8.2f ms (%.1fx)" %
+              (name, old_time * 1000, new_time * 1000, old_time / new_time))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+# coding: utf-8
+"""Compare per-feature decoding of a query-style feature array through
+   geometry.fromJson against the geometryType fast path in
+   geometry.fromJsonFeatures.
+
+      python benchmarks/featurejson.py [feature count] [vertices per feature]
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from arcrest import geometry
+
+def best_of(function, repeat=5):
+    "Best wall clock time in seconds of a single call to function"
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def make_features(geometry_type, count, vertices):
+    "A featureSet-style list of random features of the given type"
+    features = []
+    for index in range(count):
+        x, y = random.uniform(-120, -70), random.uniform(25, 50)
+        if geometry_type == "esriGeometryPoint":
+            struct = {'x': x, 'y': y}
+        else:
+            path = [[x + random.uniform(-0.1, 0.1),
+                     y + random.uniform(-0.1, 0.1)] for i in range(vertices)]
+            if geometry_type == "esriGeometryPolygon":
+                struct = {'rings': [path + [path[0]]]}
+            else:
+                struct = {'paths': [path]}
+        features.append({'geometry': struct,
+                         'attributes': {'OBJECTID': index,
+                                        'NAME': 'Feature %i' % index}})
+    return features
+
+def main(count=5000, vertices=20):
+    random.seed(0)
+    for geometry_type in ("esriGeometryPoint", "esriGeometryPolyline",
+                          "esriGeometryPolygon"):
+        features = make_features(geometry_type, count, vertices)
+        old = best_of(lambda: [geometry.fromJson(feature['geometry'],
+                                                 feature['attributes'])
+                               for feature in features])
+        new = best_of(lambda: geometry.fromJsonFeatures(features,
+                                                        geometry_type, 4326))
+        print("%-21s %6.2f us/feature -> %6.2f us/feature (%.1fx)" %
+              (geometry_type, old / count * 1e6, new / count * 1e6, old / new))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,65 @@
+# coding: utf-8
+"""Time building child resource objects (as FeatureLayer[oid] or tile
+   lookups do) and reading their .url, against the string pipeline the
+   ResourceURL type replaced: urljoin, quote, urlsplit, parse_qs and
+   urlencode in _get_subfolder, parse_qs and urlencode again in
+   RestURL.__init__, and urlunsplit on every .url access.
+
+      python benchmarks/resourceurl.py [child count]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from arcrest import compat, server
+
+def reference_child(parent_url, foldername, token, referer):
+    "The URL list the original _get_subfolder and RestURL.__init__ built"
+    newurl = compat.urljoin(parent_url, compat.quote(foldername), False)
+    urllist = list(compat.urlsplit(newurl))
+    query_dict = dict((k, v[0]) for k, v in
+                      compat.parse_qs(urllist[3]).items())
+    query_dict['token'] = token
+    query_dict[server.REQUEST_REFERER_MAGIC_NAME] = referer
+    urllist[3] = compat.urlencode(query_dict)
+    query_dict = {}
+    for k, v in compat.parse_qs(urllist[3]).items():
+        if k != server.REQUEST_REFERER_MAGIC_NAME:
+            query_dict[k] = v[0]
+    query_dict['f'] = 'json'
+    urllist[3] = compat.urlencode(query_dict)
+    return urllist
+
+def best_of(function, repeat=5):
+    "Best wall clock time in seconds of a single call to function"
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+def main(count=10000, url_reads=3):
+    parent = server.RestURL("http://example.com/arcgis/rest/services/"
+                            "Parcels/FeatureServer/0/?token=abc")
+    parent_url = parent.url
+    def original():
+        for index in range(count):
+            urllist = reference_child(parent_url, str(index), "abc",
+                                      parent_url)
+            for read in range(url_reads):
+                compat.urlunsplit(urllist)
+    def current():
+        for index in range(count):
+            child = parent._get_subfolder(str(index), server.RestURL)
+            for read in range(url_reads):
+                child.url
+    old_time, new_time = best_of(original), best_of(current)
+    print("%i children, %i .url reads each" % (count, url_reads))
+    print("original %6.2f us/child, current %6.2f us/child (%.1fx)" %
+          (old_time / count * 1e6, new_time / count * 1e6,
+           old_time / new_time))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
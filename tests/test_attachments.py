@@ -0,0 +1,76 @@
+# coding: utf-8
+"""Tests of arcrest.attachments.AttachmentExporter with a stub layer"""
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from arcrest import attachments
+from arcrest import compat
+
+class StubAttachment(object):
+    def __init__(self, layer, objectId, attachmentId):
+        self.layer, self.key = layer, (objectId, attachmentId)
+    def save(self, outfile):
+        errors = self.layer.errors.get(self.key)
+        with open(outfile, 'wb') as out:
+            out.write(b'x' * 3)
+            if errors:
+                # Fail part way through the download
+                raise errors.pop(0)
+            out.write(b'x' * 7)
+        return 10
+
+class StubLayer(object):
+    "A layer whose attachments are 10 bytes; errors fail their downloads"
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+    def QueryAttachments(self, objectIds=None, definitionExpression=None):
+        return {'attachmentGroups': [
+                    {'parentObjectId': objectId,
+                     'attachmentInfos': [{'id': objectId * 10,
+                                          'name': 'photo.jpg',
+                                          'size': 10}]}
+                    for objectId in objectIds]}
+    def Attachment(self, objectId, attachmentId):
+        return StubAttachment(self, objectId, attachmentId)
+
+class AttachmentExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def export(self, layer, objectIds=(1, 2, 3)):
+        exporter = attachments.AttachmentExporter(layer, self.directory,
+                                                  workers=2, retries=1,
+                                                  retry_delay=0)
+        return exporter, exporter.export(objectIds)
+    def test_export_and_resume(self):
+        exporter, report = self.export(StubLayer())
+        self.assertEqual(len(report.downloaded), 3)
+        self.assertEqual(report.bytes, 30)
+        path = os.path.join(self.directory, '2', '20-photo.jpg')
+        self.assertEqual(os.path.getsize(path), 10)
+        exporter, report = self.export(StubLayer())
+        self.assertEqual((len(report.downloaded), len(report.skipped)),
+                         (0, 3))
+    def test_errors_retried(self):
+        layer = StubLayer({(2, 20): [socket.error("reset")],
+                           (3, 30): [compat.IncompleteRead(b'xxx', 7)]})
+        exporter, report = self.export(layer)
+        self.assertEqual(len(report.downloaded), 3)
+        self.assertEqual(report.failed, [])
+    def test_failed_download(self):
+        layer = StubLayer({(2, 20): [socket.error("reset"),
+                                     IOError("disk full")]})
+        exporter, report = self.export(layer)
+        self.assertEqual(len(report.downloaded), 2)
+        [(info, error)] = report.failed
+        self.assertEqual(info['parentObjectId'], 2)
+        self.assertTrue(isinstance(error, IOError))
+        self.assertFalse(os.path.exists(info['path'] + '.part'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# coding: utf-8
+"""Tests of arcrest.caching"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from arcrest import caching
+from arcrest import geometry
+from arcrest.server import GeometryResult, GeometryService
+
+class StubGeometryService(object):
+    "Just enough of a GeometryService to run _run_cached"
+    _run_cached = GeometryService.__dict__['_run_cached']
+    def __init__(self, cache):
+        self.cache = cache
+        self.requested = []
+    def run(self, geometries):
+        self.requested.append(len(geometries))
+        # Simplifying a degenerate line yields a null geometry
+        return GeometryResult._from_json_struct(
+                    {'geometries': [None if geo.x < 0 else
+                                    {'x': geo.x * 2, 'y': geo.y}
+                                    for geo in geometries]}, self)
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def caches(self):
+        path = os.path.join(self.directory, 'cache.sqlite')
+        return [caching.MemoryCache(), caching.SqliteCache(path),
+                caching.ResultCache(path=path + '2')]
+    def test_none_is_a_value(self):
+        for cache in self.caches():
+            cache.set('null', None)
+            self.assertEqual(cache.get('null', 'missing'), None)
+            self.assertEqual(cache.get('other', 'missing'), 'missing')
+            self.assertEqual(cache.get('other'), None)
+            self.assertEqual(cache.stats['hits'], 1)
+            self.assertEqual(cache.stats['misses'], 2)
+    def test_values_copied(self):
+        for cache in self.caches():
+            value = {'x': 1, 'list': [1, 2]}
+            cache.set('key', value)
+            value['list'].append(3)
+            cache.get('key')['list'].append(4)
+            self.assertEqual(cache.get('key'), {'x': 1, 'list': [1, 2]})
+    def test_memory_lru(self):
+        cache = caching.MemoryCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')),
+                         (1, None, 3))
+    def test_run_cached_nulls(self):
+        service = StubGeometryService(caching.ResultCache())
+        points = [geometry.Point(1, 1), geometry.Point(-1, 1)]
+        for attempt in range(2):
+            result = service._run_cached('simplify', points, {},
+                                         service.run)
+            self.assertEqual(result._json_struct['geometries'],
+                             [{'x': 2, 'y': 1}, None])
+        self.assertEqual(service.requested, [2])
+
+class KeyTest(unittest.TestCase):
+    def test_address_key(self):
+        self.assertEqual(
+            caching.make_address_key('find', {'Address': '380 New York Street',
+                                              'City': 'Redlands'}),
+            caching.make_address_key('find', {'address': '380  NEW YORK ST.',
+                                              'city': 'REDLANDS',
+                                              'Zip': None}))
+    def test_location_key(self):
+        key = caching.make_location_key('reverse', geometry.Point(1.00001,
+                                                                  2.00001),
+                                        100, 0.001)
+        self.assertEqual(caching.make_location_key('reverse', "1.0004,2.0002",
+                                                   100, 0.001), key)
+        self.assertNotEqual(caching.make_location_key('reverse', (1.0014, 2),
+                                                      100, 0.001), key)
+
+class SqliteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def test_lookups_dont_write(self):
+        cache = caching.SqliteCache(self.path)
+        cache.set('a', 1)
+        changes = cache._connection.total_changes
+        for i in range(10):
+            cache.get('a')
+            cache.get('b')
+        self.assertEqual(cache._connection.total_changes, changes)
+        self.assertEqual(cache.stats['hits'], 10)
+        cache.close()
+    def test_stats_persist(self):
+        cache = caching.SqliteCache(self.path)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        cache.close()
+        cache = caching.SqliteCache(self.path)
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']),
+                         (1, 1))
+        cache.close()
+    def test_ttl(self):
+        cache = caching.SqliteCache(self.path, ttl=-1)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 1)
+        cache.expire()
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+# coding: utf-8
+"""Tests of arcrest.edits.EditLoader and EditBuffer with stubs in place of
+   the feature layer"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from arcrest import compat
+from arcrest import edits
+from arcrest import geometry
+from arcrest.server import FeatureLayer, ServerError
+
+class StubLayer(object):
+    _json_struct = {'objectIdField': 'OBJECTID'}
+    generalize_tolerance = None
+    _serialized_features = FeatureLayer.__dict__['_serialized_features']
+
+class KeyedLayer(StubLayer):
+    """A layer already holding features with the KEY values in existing,
+       answering queries for them"""
+    _json_struct = {'objectIdField': 'OBJECTID', 'globalIdField': 'KEY'}
+    def __init__(self, existing):
+        self.existing = existing
+        self.queries = []
+    def _get_subfolder(self, path, result_class, params):
+        self.queries.append(params['where'])
+        class Result(object):
+            _json_struct = {'features': [
+                {'attributes': {'OBJECTID': objectid, 'KEY': key}}
+                for key, objectid in sorted(self.existing.items())
+                if "'%s'" % key in params['where']]}
+        return Result()
+
+class StubEditLoader(edits.EditLoader):
+    """Applies edits to nothing, giving added features object IDs from 100.
+       failures maps a chunk number to the number of times its request
+       fails with error."""
+    def __init__(self, layer, failures=None, error=None, **options):
+        edits.EditLoader.__init__(self, layer, **options)
+        self.failures = dict(failures or {})
+        self.error = error or compat.URLError("unreachable")
+        self.submitted = []
+        self.lock = threading.Lock()
+    def submit(self, chunk):
+        with self.lock:
+            self.submitted.append(chunk.index)
+            if self.failures.get(chunk.index):
+                self.failures[chunk.index] -= 1
+                raise self.error
+        success = lambda objectid: {'objectId': objectid, 'success': True}
+        return {'addResults': [success(100 + json.loads(add)['attributes']
+                                                           ['OBJECTID'])
+                               for add in chunk.adds],
+                'updateResults': [success(json.loads(update)['attributes']
+                                                            ['OBJECTID'])
+                                  for update in chunk.updates],
+                'deleteResults': [success(int(objectid))
+                                  for objectid in chunk.deletes]}
+
+class BlockingLoader(object):
+    "A loader whose loads wait until release is set"
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+    def load(self, adds, updates, deletes):
+        self.started.set()
+        self.release.wait(5)
+        return edits.EditSummary()
+
+class StubLoader(object):
+    "Records the edits of every load, failing the first failures of them"
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.loads = []
+    def load(self, adds, updates, deletes):
+        self.loads.append((list(adds), list(updates), list(deletes)))
+        if self.failures:
+            self.failures -= 1
+            raise compat.URLError("unreachable")
+        return edits.EditSummary()
+
+def feature(objectid, **attributes):
+    point = geometry.Point(objectid, objectid)
+    point.attributes = dict(attributes, OBJECTID=objectid)
+    return point
+
+class EditLoaderTest(unittest.TestCase):
+    def loader(self, **options):
+        options.setdefault('workers', 3)
+        return StubEditLoader(StubLayer(), **options)
+    def test_chunks(self):
+        loader = self.loader(max_features=4)
+        chunks = list(loader.chunks(adds=[feature(i) for i in range(5)],
+                                    updates=[feature(i) for i in range(2)],
+                                    deletes=[7, 8]))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 1])
+        self.assertEqual([chunk.index for chunk in chunks], [0, 1, 2])
+        self.assertEqual((len(chunks[1].adds), len(chunks[1].updates),
+                          chunks[1].deletes), (1, 2, ['7']))
+        self.assertEqual(chunks[2].params['deletes'], '8')
+    def test_chunk_bytes(self):
+        size = len(json.dumps(feature(1)._json_struct_for_featureset)) + 1
+        loader = self.loader(max_bytes=size * 2)
+        chunks = list(loader.chunks(adds=[feature(i) for i in range(1, 6)]))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        # A feature bigger than max_bytes still goes, on its own
+        loader.max_bytes = 1
+        self.assertEqual(len(list(loader.chunks(adds=[feature(1),
+                                                      feature(2)]))), 2)
+    def test_load_in_order(self):
+        loader = self.loader(max_features=2)
+        summary = loader.load(adds=(feature(i) for i in range(7)),
+                              deletes=range(20, 25))
+        self.assertEqual([result['objectId']
+                          for result in summary.addResults],
+                         list(range(100, 107)))
+        self.assertEqual([result['objectId']
+                          for result in summary.deleteResults],
+                         list(range(20, 25)))
+        self.assertEqual((summary.chunks, summary.succeeded,
+                          summary.failed), (6, 12, 0))
+    def test_retry_failed_chunks(self):
+        loader = self.loader(max_features=2, retries=2, failures={1: 2})
+        summary = loader.load(adds=[feature(i) for i in range(6)])
+        self.assertEqual(summary.failed, 0)
+        self.assertEqual(sorted(loader.submitted), [0, 1, 1, 1, 2])
+    def test_retries_exhausted(self):
+        loader = self.loader(max_features=2, retries=1, failures={1: 5})
+        summary = loader.load(adds=[feature(i) for i in range(6)])
+        self.assertEqual((summary.succeeded, summary.failed), (4, 2))
+        self.assertEqual([chunk.index for chunk, error
+                          in summary.failedChunks], [1])
+        self.assertEqual([result['success']
+                          for result in summary.addResults],
+                         [True, True, False, False, True, True])
+    def test_permanent_error_not_retried(self):
+        error = ServerError("Invalid field value", code=400)
+        loader = self.loader(max_features=2, retries=2, failures={1: 1},
+                             error=error)
+        summary = loader.load(adds=[feature(i) for i in range(6)])
+        self.assertEqual(sorted(loader.submitted), [0, 1, 2])
+        self.assertEqual(summary.failedChunks[0][1], error)
+        self.assertEqual(summary.failed, 2)
+
+class EditJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "load.sqlite")
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    def load(self, journal, failures=None, adds=None, layer=None,
+             **options):
+        loader = StubEditLoader(layer or StubLayer(), max_features=2,
+                                retries=0, workers=1, failures=failures,
+                                journal=journal, **options)
+        adds = adds or [feature(i) for i in range(6)]
+        return loader, loader.load(adds=adds)
+    def test_resume(self):
+        journal = edits.EditJournal(self.path)
+        loader, summary = self.load(journal, failures={2: 1})
+        self.assertEqual(summary.failed, 2)
+        self.assertEqual(journal.status, {'committed': 2, 'failed': 1})
+        journal.close()
+        # Only the chunk that failed is sent again
+        journal = edits.EditJournal(self.path)
+        loader, summary = self.load(journal)
+        self.assertEqual(loader.submitted, [2])
+        self.assertEqual([result['objectId']
+                          for result in summary.addResults],
+                         list(range(100, 106)))
+        self.assertEqual([index for index, results in journal.results()],
+                         [0, 1, 2])
+        journal.close()
+    def submitted_before(self, journal, adds):
+        "Journal the first chunk of adds as sent, as if the load had died"
+        loader = StubEditLoader(StubLayer(), max_features=2)
+        journal.record_submitted(next(loader.chunks(adds=adds)))
+    def keyed(self, count):
+        return [feature(i, KEY='k%i' % i) for i in range(count)]
+    def test_resume_submitted(self):
+        journal = edits.EditJournal(self.path)
+        self.submitted_before(journal, self.keyed(4))
+        # The first add of the chunk made it to the layer before the crash
+        layer = KeyedLayer({'k0': 500})
+        loader, summary = self.load(journal, adds=self.keyed(4),
+                                    layer=layer, useGlobalIds=True)
+        self.assertEqual(layer.queries, ["KEY IN ('k0', 'k1')"])
+        self.assertEqual(loader.submitted, [0, 1])
+        self.assertEqual([result['objectId']
+                          for result in summary.addResults],
+                         [500, 101, 102, 103])
+        self.assertEqual(summary.addResults[0]['globalId'], 'k0')
+        self.assertEqual(journal.status, {'committed': 2})
+        journal.close()
+    def test_resume_fully_applied(self):
+        journal = edits.EditJournal(self.path)
+        self.submitted_before(journal, self.keyed(2))
+        layer = KeyedLayer({'k0': 500, 'k1': 501})
+        loader, summary = self.load(journal, adds=self.keyed(2),
+                                    layer=layer, key_field='KEY')
+        self.assertEqual(loader.submitted, [])
+        self.assertEqual([result['objectId']
+                          for result in summary.addResults], [500, 501])
+        journal.close()
+    def test_resume_submitted_without_key(self):
+        journal = edits.EditJournal(self.path)
+        self.submitted_before(journal, self.keyed(2))
+        self.assertRaises(ValueError, self.load, journal,
+                          adds=self.keyed(2))
+        journal.close()
+    def test_different_input(self):
+        journal = edits.EditJournal(self.path)
+        self.load(journal)
+        self.assertRaises(ValueError, self.load, journal,
+                          adds=[feature(i) for i in range(10, 16)])
+        journal.clear()
+        self.assertEqual(journal.status, {})
+        journal.close()
+
+class EditBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = edits.EditBuffer(StubLayer(), max_edits=100)
+        self.loader = self.buffer.loader = StubLoader()
+    def test_merged_updates(self):
+        self.buffer.update(feature(1, a=1))
+        self.buffer.update(feature(1, b=2))
+        self.buffer.flush()
+        updates = self.loader.loads[0][1]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0].attributes,
+                         {'OBJECTID': 1, 'a': 1, 'b': 2})
+    def test_failed_flush_keeps_edits(self):
+        self.loader.failures = 1
+        self.buffer.add(feature(10))
+        self.buffer.update(feature(1, a=1))
+        self.buffer.update(feature(2, a=1))
+        self.buffer.delete(3)
+        self.assertRaises(compat.URLError, self.buffer.flush)
+        self.assertEqual(len(self.buffer), 4)
+        # Edits queued after the failure go after, or merge into, the others
+        self.buffer.add(feature(11))
+        self.buffer.update(feature(1, b=2))
+        self.buffer.delete(2)
+        self.buffer.flush()
+        adds, updates, deletes = self.loader.loads[-1]
+        self.assertEqual([add.attributes['OBJECTID'] for add in adds],
+                         [10, 11])
+        self.assertEqual([update.attributes for update in updates],
+                         [{'OBJECTID': 1, 'a': 1, 'b': 2}])
+        self.assertEqual(deletes, [3, 2])
+        self.assertEqual(len(self.buffer), 0)
+    def test_failed_chunks_put_back(self):
+        loader = self.buffer.loader = StubEditLoader(StubLayer(),
+                                                     failures={1: 1},
+                                                     max_features=2,
+                                                     retries=0)
+        for i in range(4):
+            self.buffer.add(feature(i))
+        self.buffer.update(feature(7, a=1))
+        summary = self.buffer.flush()
+        self.assertEqual([chunk.index for chunk, error
+                          in summary.failedChunks], [1])
+        # Chunk 1 held adds 2 and 3; they go with the next flush
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.metrics['requeued'], 2)
+        self.buffer.update(feature(8))
+        summary = self.buffer.flush()
+        self.assertEqual([result['objectId']
+                          for result in summary.addResults], [102, 103])
+        self.assertEqual([result['objectId']
+                          for result in summary.updateResults], [8])
+        self.assertEqual(len(self.buffer), 0)
+    def test_permanent_failure_raises(self):
+        error = ServerError("Invalid geometry", code=400)
+        self.buffer.loader = StubEditLoader(StubLayer(), failures={0: 3},
+                                            error=error, max_features=2)
+        for i in range(3):
+            self.buffer.add(feature(i))
+        try:
+            self.buffer.flush()
+        except ServerError as e:
+            self.assertTrue(e is error)
+        else:
+            self.fail("flush did not raise")
+        self.assertEqual(self.buffer.last_summary.failed, 2)
+        self.assertEqual(len(self.buffer), 0)
+    def test_blocked_on_running_flush(self):
+        loader = self.buffer.loader = BlockingLoader()
+        self.buffer.max_edits = 2
+        self.buffer.add(feature(1))
+        flusher = threading.Thread(target=self.buffer.flush)
+        flusher.start()
+        self.assertTrue(loader.started.wait(5))
+        timer = threading.Timer(0.1, loader.release.set)
+        timer.start()
+        # Filling the buffer waits for the running flush to end
+        self.buffer.add(feature(2))
+        self.buffer.add(feature(3))
+        flusher.join()
+        self.assertTrue(self.buffer.metrics['blocked_seconds'] >= 0.05)
+        self.assertEqual(len(self.buffer), 0)
+
+if __name__ == '__main__':
+    unittest.main()
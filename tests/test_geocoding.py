@@ -0,0 +1,79 @@
+# coding: utf-8
+"""Tests of arcrest.geocoding.BatchGeocoder with a stub locator"""
+
+import unittest
+
+from arcrest import compat
+from arcrest import geocoding
+from arcrest import geometry
+from arcrest.server import ServerError
+
+class StubCandidates(object):
+    def __init__(self, candidates):
+        self.candidates = candidates
+
+class StubLocator(object):
+    """Matches every address but 'nowhere'. batch_errors are raised by
+       geocodeAddresses requests in turn."""
+    locatorProperties = {'MaxBatchSize': 1000, 'SuggestedBatchSize': 3}
+    singleLineAddressField = {'name': 'SingleLine'}
+    def __init__(self, *batch_errors):
+        self.batch_errors = list(batch_errors)
+        self.batches = self.singles = 0
+    def location(self, address):
+        return {'x': len(address), 'y': 0}
+    def GeocodeAddresses(self, records, outSR=None):
+        self.batches += 1
+        if self.batch_errors:
+            raise self.batch_errors.pop(0)
+        return {'locations': [
+                    {'score': 0 if record['SingleLine'] == 'nowhere' else 90,
+                     'location': self.location(record['SingleLine']),
+                     'attributes': {'ResultID': record['OBJECTID']}}
+                    for record in records]}
+    def FindAddressCandidates(self, outFields=None, outSR=None, **fields):
+        self.singles += 1
+        address = fields['SingleLine']
+        if address == 'nowhere':
+            return StubCandidates([])
+        return StubCandidates([{'score': 80, 'address': address,
+                                'location': geometry.fromJson(
+                                                self.location(address))}])
+
+class BatchGeocoderTest(unittest.TestCase):
+    addresses = ['1 a st', 'nowhere', '22 b st', '333 c st']
+    def geocode(self, locator):
+        geocoder = geocoding.BatchGeocoder(locator, workers=2)
+        results = list(geocoder.geocode(self.addresses))
+        self.assertEqual([address for address, match in results],
+                         self.addresses)
+        return geocoder, [match and match['location'].x
+                          for address, match in results]
+    def test_batches(self):
+        locator = StubLocator()
+        geocoder, xs = self.geocode(locator)
+        self.assertEqual(xs, [6, None, 7, 8])
+        # Batches of three; the single address left over is asked alone
+        self.assertEqual((locator.batches, locator.singles), (1, 1))
+    def test_transient_error_retried(self):
+        locator = StubLocator(compat.URLError("down"))
+        geocoder, xs = self.geocode(locator)
+        self.assertEqual(xs, [6, None, 7, 8])
+        self.assertEqual((locator.batches, locator.singles), (2, 1))
+        self.assertTrue(geocoder.batch)
+    def test_chunk_error_falls_back(self):
+        locator = StubLocator(ServerError("Bad addresses", 400))
+        geocoder, xs = self.geocode(locator)
+        self.assertEqual(xs, [6, None, 7, 8])
+        self.assertEqual((locator.batches, locator.singles), (1, 4))
+        self.assertTrue(geocoder.batch)
+    def test_no_batch_support(self):
+        error = compat.HTTPError("http://locator", 403, "Forbidden", {},
+                                 None)
+        locator = StubLocator(error)
+        geocoder, xs = self.geocode(locator)
+        self.assertEqual(xs, [6, None, 7, 8])
+        self.assertFalse(geocoder.batch)
+
+if __name__ == '__main__':
+    unittest.main()
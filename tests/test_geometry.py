@@ -0,0 +1,192 @@
+# coding: utf-8
+"""Tests of arcrest.geometry"""
+
+import binascii
+import struct
+import unittest
+
+from arcrest import geometry
+
+class FromJsonFeaturesTest(unittest.TestCase):
+    def test_polyline(self):
+        features = [{'geometry': {'paths': [[[0, 0], [1, 1]], [[2, 2],
+                                                               [3, 4]]]},
+                     'attributes': {'NAME': 'a'}},
+                    {'geometry': None, 'attributes': {'NAME': 'b'}}]
+        line, empty = geometry.fromJsonFeatures(features,
+                                                'esriGeometryPolyline', 4326)
+        self.assertEqual(line._json_struct['paths'],
+                         [[[0, 0], [1, 1]], [[2, 2], [3, 4]]])
+        self.assertEqual(line.attributes, {'name': 'a'})
+        self.assertTrue(isinstance(empty, geometry.NullGeometry))
+    def test_z_and_m_dropped(self):
+        features = [{'geometry': {'hasZ': True, 'hasM': True,
+                                  'rings': [[[0, 0, 1, 5], [0, 1, 1, None],
+                                             [1, 1, 2, 7], [0, 0, 1, 5]]]}},
+                    {'geometry': {'hasM': True,
+                                  'rings': [[[0, 0, None], [0, 1, None],
+                                             [1, 1, None], [0, 0, None]]]}}]
+        for polygon in geometry.fromJsonFeatures(features,
+                                                 'esriGeometryPolygon'):
+            self.assertEqual(polygon._json_struct['rings'],
+                             [[[0, 0], [0, 1], [1, 1], [0, 0]]])
+
+class CompressedGeometryTest(unittest.TestCase):
+    def test_round_trip(self):
+        line = geometry.Polyline([[[-117.19568, 34.05752],
+                                   [-117.19, 34.06], [-117.2, 34.0511]]])
+        encoded = line.asCompressedGeometry()
+        decoded = geometry.Polyline.fromCompressedGeometry(encoded)
+        for a, b in zip(decoded._coordinate_parts[0],
+                        line._coordinate_parts[0]):
+            self.assertAlmostEqual(a, b, 4)
+        self.assertEqual(decoded.asCompressedGeometry(), encoded)
+    def test_known_string(self):
+        decoded = geometry.Polyline.fromCompressedGeometry(
+                    "+1m91-6fkfr+202tp+k+f+7+3+34+2d")
+        self.assertEqual(len(decoded._coordinate_parts[0]), 8)
+        self.assertAlmostEqual(decoded._coordinate_parts[0][0], -122.40646,
+                               places=5)
+        self.assertAlmostEqual(decoded._coordinate_parts[0][1], 37.78273,
+                               places=5)
+        # Re-encoded with its own multiplier, the string comes back intact
+        self.assertEqual(decoded.asCompressedGeometry(int('1m91', 32)),
+                         "+1m91-6fkfr+202tp+k+f+7+3+34+2d")
+
+class WellKnownTest(unittest.TestCase):
+    texts = ["POINT (1.5 2.0)",
+             "MULTIPOINT ((1.0 2.0), (3.0 4.0))",
+             "MULTILINESTRING ((0.0 0.0, 1.0 1.0), (2.0 2.0, 3.0 3.0))",
+             "POLYGON ((0.0 0.0, 0.0 4.0, 4.0 4.0, 4.0 0.0, 0.0 0.0), "
+                      "(1.0 1.0, 2.0 1.0, 2.0 2.0, 1.0 1.0))",
+             "MULTIPOLYGON (((0.0 0.0, 0.0 1.0, 1.0 1.0, 0.0 0.0)), "
+                           "((5.0 5.0, 5.0 6.0, 6.0 6.0, 5.0 5.0)))",
+             "MULTILINESTRING EMPTY",
+             "POLYGON EMPTY"]
+    def test_wkt_round_trip(self):
+        for text in self.texts:
+            self.assertEqual(geometry.toWKT(geometry.fromWKT(text)), text)
+    def test_wkb_round_trip(self):
+        for text in self.texts:
+            data = geometry.toWKB(geometry.fromWKT(text))
+            self.assertEqual(geometry.toWKT(geometry.fromWKB(data)), text)
+    def test_linestring(self):
+        line = geometry.fromWKT("LINESTRING (0 0, 1 1, 2 0)")
+        self.assertTrue(isinstance(line, geometry.Polyline))
+        self.assertEqual(geometry.toWKT(line),
+                         "MULTILINESTRING ((0.0 0.0, 1.0 1.0, 2.0 0.0))")
+    def test_empty_point(self):
+        self.assertTrue(isinstance(geometry.fromWKT("POINT EMPTY"),
+                                   geometry.NullGeometry))
+    def test_ewkt(self):
+        point = geometry.fromWKT("SRID=4326;POINT (1 2)", 3857)
+        self.assertEqual((point.x, point.y), (1.0, 2.0))
+        self.assertEqual(point.spatialReference.wkid, 4326)
+        self.assertEqual(geometry.fromWKT("POINT (1 2)", 3857)
+                                 .spatialReference.wkid, 3857)
+    def test_wkb_hex(self):
+        point = geometry.fromWKT("POINT (1 2)")
+        self.assertEqual(binascii.hexlify(geometry.toWKB(point)),
+                         b"0101000000000000000000f03f0000000000000040")
+        ewkb = binascii.hexlify(geometry.toWKB(point, 4326)).decode('ascii')
+        decoded = geometry.fromWKB(ewkb)
+        self.assertEqual((decoded.x, decoded.y), (1.0, 2.0))
+        self.assertEqual(decoded.spatialReference.wkid, 4326)
+    def test_wkb_big_endian(self):
+        data = struct.pack('>BII4d', 0, 2, 2, 0, 1, 2, 3)
+        self.assertEqual(geometry.toWKT(geometry.fromWKB(data)),
+                         "MULTILINESTRING ((0.0 1.0, 2.0 3.0))")
+    def test_z_and_m_rejected(self):
+        for text in ("POINT Z (1 2 3)",
+                     "SRID=4326;LINESTRING M (0 0 1, 1 1 2)",
+                     "POLYGON ZM ((0 0 1 2, 0 1 1 2, 1 1 1 2, 0 0 1 2))",
+                     "LINESTRING (0 0 1, 1 1 2)"):
+            self.assertRaises(ValueError, geometry.fromWKT, text)
+        # ISO LINESTRING Z, ISO POINT ZM and a PostGIS EWKB POINT Z
+        for data in (struct.pack('>BII6d', 0, 1002, 2, 0, 1, 9, 2, 3, 9),
+                     struct.pack('<BI4d', 1, 3001, 1, 2, 3, 4),
+                     struct.pack('<BI3d', 1, 0x80000001, 1, 2, 3)):
+            self.assertRaises(ValueError, geometry.fromWKB, data)
+    def test_envelope(self):
+        envelope = geometry.Envelope(0, 0, 2, 1, 4326)
+        self.assertTrue(envelope)
+        polygon = "POLYGON ((0.0 0.0, 0.0 1.0, 2.0 1.0, 2.0 0.0, 0.0 0.0))"
+        self.assertEqual(envelope.asWKT(), polygon)
+        self.assertEqual(geometry.toWKT(geometry.fromWKB(envelope.asWKB())),
+                         polygon)
+        decoded = geometry.fromWKB(envelope.asEWKB())
+        self.assertEqual(decoded.spatialReference.wkid, 4326)
+        self.assertEqual(decoded.envelope._bounds, (0.0, 0.0, 2.0, 1.0))
+    def test_malformed_wkt(self):
+        self.assertRaises(ValueError, geometry.fromWKT, "POINT (1 2")
+        self.assertRaises(ValueError, geometry.fromWKT, "CIRCLE (1 2)")
+
+class GeneralizeTest(unittest.TestCase):
+    def setUp(self):
+        self.line = geometry.Polyline([[[0, 0], [1, 0.01], [2, -0.01],
+                                        [3, 0], [3, 5]]])
+        self.line.attributes = {'NAME': 'a'}
+    def test_douglas_peucker(self):
+        generalized = self.line.generalize(0.1)
+        self.assertEqual(generalized._json_struct['paths'],
+                         [[[0, 0], [3, 0], [3, 5]]])
+        self.assertEqual(generalized.attributes, {'NAME': 'a'})
+        # The original is left as it was
+        self.assertEqual(len(self.line._coordinate_parts[0]), 10)
+        self.assertEqual(len(self.line.generalize(0.001)
+                                      ._coordinate_parts[0]), 10)
+    def test_visvalingam(self):
+        generalized = self.line.generalize(0.2, 'visvalingam')
+        self.assertEqual(generalized._json_struct['paths'],
+                         [[[0, 0], [3, 0], [3, 5]]])
+        self.assertEqual(len(self.line.generalize(0.1, 'visvalingam')
+                                      ._coordinate_parts[0]), 10)
+    def test_polygon(self):
+        polygon = geometry.Polygon([[[0, 0], [0, 2], [1, 2.01], [2, 2],
+                                     [2, 0], [0, 0]]])
+        self.assertEqual(polygon.generalize(0.1)._json_struct['rings'],
+                         [[[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]]])
+        # Rings are never collapsed below a triangle
+        self.assertEqual(polygon.generalize(100)._json_struct['rings'],
+                         polygon._json_struct['rings'])
+    def test_module_function(self):
+        point = geometry.Point(1, 2)
+        generalized = geometry.generalize([point, self.line], 0.1)
+        self.assertTrue(generalized[0] is point)
+        self.assertEqual(len(generalized[1]._coordinate_parts[0]), 6)
+        self.assertRaises(ValueError, geometry.generalize, self.line, 0.1,
+                          'bogus')
+
+class EnvelopeCacheTest(unittest.TestCase):
+    def test_held_rings(self):
+        polygon = geometry.Polygon([[[0, 0], [0, 2], [2, 2], [0, 0]]])
+        rings = polygon.rings
+        self.assertEqual(polygon.envelope._bounds, (0, 0, 2, 2))
+        rings[0][1].x = 9
+        self.assertEqual(polygon.envelope._bounds, (0, 0, 9, 2))
+        rings[0].append(geometry.Point(-1, -1))
+        self.assertEqual(polygon.extent._bounds, (-1, -1, 9, 2))
+    def test_shared_points(self):
+        point = geometry.Point(1, 1)
+        line = geometry.Polyline([[[0, 0], point]])
+        multipoint = geometry.Multipoint([[0, 0], point])
+        line.envelope, multipoint.envelope
+        point.y = 5
+        self.assertEqual(line.envelope._bounds, (0, 0, 1, 5))
+        self.assertEqual(multipoint.envelope._bounds, (0, 0, 1, 5))
+    def test_cached_from_parts(self):
+        line = geometry.fromWKT("LINESTRING (0 0, 3 4)")
+        self.assertTrue(line._parts is not None)
+        self.assertEqual(line._bounds, (0, 0, 3, 4))
+        self.assertTrue(line._cached_bounds is line._bounds)
+        # Handing out the paths switches to the Points, and their bounds
+        line.paths[0][0].x = -2
+        self.assertEqual(line._bounds, (-2, 0, 3, 4))
+        line.paths = [[[5, 5], [6, 6]]]
+        self.assertEqual(line.envelope._bounds, (5, 5, 6, 6))
+    def test_empty(self):
+        self.assertEqual(geometry.Polygon([]).envelope, None)
+        self.assertEqual(geometry.Multipoint([]).extent, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+# coding: utf-8
+"""Tests of arcrest.gpjobs against stub jobs and tasks that need no
+   server"""
+
+import socket
+import threading
+import time
+import unittest
+
+from arcrest import compat
+from arcrest import gpjobs
+from arcrest.server import GPJobStatus, GPTask, ServerError
+
+class StubJob(object):
+    """Stands in for a GPJobStatus: runs for polls polls, then ends with
+       status. poll_error, if set, is raised by every poll after the
+       first; results_errors are raised in turn by the first fetches of its
+       results."""
+    _still_running = GPJobStatus._still_running
+    poll_interval = 0.001
+    poll_backoff = 1.5
+    max_poll_interval = 0.01
+    def __init__(self, value, polls=2, status='esriJobSucceeded',
+                 poll_error=None, results_errors=()):
+        self.value = value
+        self.remaining = polls
+        self.final_status = status
+        self.poll_error = poll_error
+        self.results_errors = list(results_errors)
+        self.results_fetched = []
+        self.polled = 0
+        self.jobId = 'job-%s' % (value,)
+    def poll(self):
+        self.polled += 1
+        if self.poll_error is not None and self.polled > 1:
+            raise self.poll_error
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 'esriJobExecuting', []
+        return self.final_status, []
+    @property
+    def results(self):
+        self.results_fetched.append(time.time())
+        if self.results_errors:
+            raise self.results_errors.pop(0)
+        if self.final_status != 'esriJobSucceeded':
+            raise ServerError("Error: job status %r" % self.final_status)
+        return {'Out': self.value}
+
+class StubTask(object):
+    """Stands in for a GPTask, making a StubJob of every submission.
+       outcomes maps an input to the list of StubJob keyword arguments of
+       its successive submissions."""
+    def __init__(self, outcomes=None):
+        self.outcomes = outcomes or {}
+        self.submitted = []
+        self.lock = threading.Lock()
+    def SubmitJob(self, value):
+        with self.lock:
+            self.submitted.append(value)
+            attempts = self.outcomes.get(value) or [{}]
+            options = attempts.pop(0) if len(attempts) > 1 else attempts[0]
+        if isinstance(options, Exception):
+            raise options
+        return StubJob(value, **options)
+
+class JobMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.monitor = gpjobs.JobMonitor(workers=2, polls_per_second=None)
+    def tearDown(self):
+        self.monitor.close(wait=False)
+    def test_results(self):
+        futures = [self.monitor.add(StubJob(i)) for i in range(10)]
+        self.assertTrue(self.monitor.wait(timeout=5))
+        self.assertEqual([future.result()['Out'] for future in futures],
+                         list(range(10)))
+        self.assertEqual(len(self.monitor), 0)
+    def test_as_completed(self):
+        futures = [self.monitor.add(StubJob(i, polls=i % 3))
+                   for i in range(6)]
+        finished = list(self.monitor.as_completed(futures))
+        self.assertEqual(sorted(finished, key=futures.index), futures)
+    def test_failed_job(self):
+        future = self.monitor.add(StubJob(1, status='esriJobFailed'))
+        self.assertTrue(isinstance(future.exception(timeout=5),
+                                   ServerError))
+        self.assertEqual(future.status, 'esriJobFailed')
+    def test_poll_errors_give_up(self):
+        error = compat.URLError("unreachable")
+        future = self.monitor.add(StubJob(1, poll_error=error))
+        self.assertTrue(future.exception(timeout=5) is error)
+        self.assertEqual(future.job.polled, self.monitor.poll_retries + 2)
+    def test_broken_progress(self):
+        def progress(future, messages):
+            raise RuntimeError("broken progress callback")
+        self.monitor.progress = progress
+        future = self.monitor.add(StubJob(1))
+        self.assertEqual(future.result(timeout=5), {'Out': 1})
+    def test_unexpected_error(self):
+        job = StubJob(1)
+        job.poll = lambda: None
+        future = self.monitor.add(job)
+        self.assertTrue(isinstance(future.exception(timeout=5), TypeError))
+        # The worker survived to poll other jobs
+        self.assertEqual(self.monitor.add(StubJob(2)).result(timeout=5),
+                         {'Out': 2})
+    def test_results_retried_with_backoff(self):
+        job = StubJob(1, results_errors=[compat.URLError("reset"),
+                                         socket.timeout("timed out")])
+        job.poll_interval = 0.02
+        self.assertEqual(self.monitor.add(job).result(timeout=5), {'Out': 1})
+        fetched = job.results_fetched
+        self.assertEqual(len(fetched), 3)
+        self.assertTrue(fetched[1] - fetched[0] >= 0.02)
+        self.assertTrue(fetched[2] - fetched[1] >= 0.04)
+    def test_results_permanent_error(self):
+        error = ServerError("Invalid output", code=400)
+        job = StubJob(1, results_errors=[error])
+        self.assertTrue(self.monitor.add(job).exception(timeout=5) is error)
+        self.assertEqual(len(job.results_fetched), 1)
+    def test_timeout(self):
+        future = gpjobs.JobFuture(StubJob(1))
+        self.assertRaises(gpjobs.JobTimeout, future.result, 0.01)
+
+class JobPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.monitor = gpjobs.JobMonitor(workers=4, polls_per_second=None)
+    def tearDown(self):
+        self.monitor.close(wait=False)
+    def pool(self, task, **options):
+        return gpjobs.JobPool(task, monitor=self.monitor, **options)
+    def test_input_order(self):
+        task = StubTask(dict((i, [{'polls': 5 - i % 5}]) for i in range(12)))
+        results = list(self.pool(task, max_in_flight=3).map(range(12)))
+        self.assertEqual(results, [(i, {'Out': i}) for i in range(12)])
+    def test_completion_order(self):
+        results = self.pool(StubTask(), max_in_flight=3).map(range(8),
+                                                             ordered=False)
+        self.assertEqual(sorted(results), [(i, {'Out': i}) for i in range(8)])
+    def test_max_in_flight(self):
+        task = StubTask()
+        pool = self.pool(task, max_in_flight=2)
+        for item, results in pool.map(range(10)):
+            # Jobs submitted so far: those finished plus those in flight
+            self.assertTrue(len(task.submitted) <= item + 1 + 2 * 2)
+        self.assertEqual(sorted(task.submitted), list(range(10)))
+    def test_retry_failed_job(self):
+        task = StubTask({1: [{'status': 'esriJobFailed'}, {}]})
+        results = list(self.pool(task, retries=2).map([0, 1]))
+        self.assertEqual(results, [(0, {'Out': 0}), (1, {'Out': 1})])
+        self.assertEqual(task.submitted.count(1), 2)
+    def test_retry_submission_error(self):
+        task = StubTask({1: [compat.URLError("unreachable"), {}]})
+        self.assertEqual(list(self.pool(task).map([1])), [(1, {'Out': 1})])
+    def test_retry_polling_errors(self):
+        error = compat.URLError("unreachable")
+        task = StubTask({1: [{'poll_error': error}, {}]})
+        self.assertEqual(list(self.pool(task, retries=2).map([1])),
+                         [(1, {'Out': 1})])
+        self.assertEqual(task.submitted, [1, 1])
+    def test_no_retry_cancelled(self):
+        task = StubTask({1: [{'status': 'esriJobCancelled'}]})
+        self.assertRaises(ServerError, list, self.pool(task).map([1]))
+        self.assertEqual(task.submitted, [1])
+    def test_retries_exhausted(self):
+        task = StubTask({1: [{'status': 'esriJobFailed'}]})
+        self.assertRaises(ServerError, list,
+                          self.pool(task, retries=2).map([1]))
+        self.assertEqual(task.submitted, [1, 1, 1])
+
+class SyncTaskMapTest(unittest.TestCase):
+    class SyncTask(object):
+        synchronous = True
+        map = GPTask.__dict__['map']
+        def __init__(self, failures, error=None):
+            self.failures = failures
+            self.error = error or compat.URLError("unreachable")
+            self.executed = []
+        def Execute(self, value):
+            self.executed.append(value)
+            if self.failures:
+                self.failures -= 1
+                raise self.error
+            class Result(object):
+                results = {'Out': value}
+            return Result()
+    def test_retries(self):
+        task = self.SyncTask(failures=1)
+        self.assertEqual(list(task.map([1], retries=1)), [(1, {'Out': 1})])
+        self.assertEqual(task.executed, [1, 1])
+    def test_timeout_retried(self):
+        task = self.SyncTask(failures=1, error=socket.timeout("timed out"))
+        self.assertEqual(list(task.map([1], retries=1)), [(1, {'Out': 1})])
+    def test_permanent_error_not_retried(self):
+        error = compat.HTTPError("http://server", 404, "Not Found", {}, None)
+        task = self.SyncTask(failures=1, error=error)
+        self.assertRaises(compat.HTTPError, list, task.map([1], retries=2))
+        self.assertEqual(task.executed, [1])
+    def test_no_monitor(self):
+        self.assertRaises(ValueError, self.SyncTask(0).map, [1],
+                          monitor=gpjobs.JobMonitor())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# coding: utf-8
+"""Tests of arcrest.mosaic.Mosaic with a stub service drawing BMP pieces"""
+
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import zlib
+
+from arcrest import geometry
+from arcrest import mosaic
+
+def pixel(x, y):
+    "The RGB color the stub service draws at pixel x, y of the mosaic"
+    return (x, y, 7)
+
+def bmp(pixels, width, height, bits=24, top_down=False):
+    "A BMP image of the rows of (r, g, b) pixels"
+    channels = bits // 8
+    stride = (width * channels + 3) & ~3
+    rows = []
+    for row in pixels:
+        data = bytearray()
+        for r, g, b in row:
+            data.extend((b, g, r) + ((255,) if channels == 4 else ()))
+        rows.append(bytes(data + b'\x00' * (stride - len(data))))
+    if not top_down:
+        rows.reverse()
+    image = b''.join(rows)
+    return (b'BM' + struct.pack('<IHHI', 54 + len(image), 0, 0, 54) +
+            struct.pack('<IiiHHIIiiII', 40, width,
+                        -height if top_down else height, 1, bits, 0,
+                        len(image), 2835, 2835, 0, 0) + image)
+
+class StubExport(object):
+    def __init__(self, data):
+        self.data = data
+    def save(self, outfile):
+        outfile.write(self.data)
+
+class StubMapService(object):
+    """Draws pixel() over an extent of 0, 0 to width, height, one unit to a
+       pixel"""
+    def __init__(self, width, height, bits=24, top_down=False):
+        self._json_struct = {'maxImageWidth': width,
+                             'maxImageHeight': height}
+        self.bits, self.top_down = bits, top_down
+        self.requests = []
+        self.lock = threading.Lock()
+    def ExportMap(self, bbox, size, format, **options):
+        with self.lock:
+            self.requests.append((bbox, size, format, options))
+        width, height = size
+        assert (bbox.xmax - bbox.xmin, bbox.ymax - bbox.ymin) == size
+        left, top = int(bbox.xmin), int(-bbox.ymax)
+        pixels = [[pixel(left + x, top + y) for x in range(width)]
+                  for y in range(height)]
+        return StubExport(bmp(pixels, width, height, self.bits,
+                              self.top_down))
+
+def read_png(data):
+    "The width, height, color type and rows of a PNG image"
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    offset, idat = 8, b''
+    while offset < len(data):
+        length, = struct.unpack('>I', data[offset:offset + 4])
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        crc, = struct.unpack('>I', data[offset + 8 + length:
+                                        offset + 12 + length])
+        assert crc == zlib.crc32(kind + body) & 0xffffffff
+        if kind == b'IHDR':
+            width, height, depth, color = struct.unpack('>IIBB', body[:10])
+        elif kind == b'IDAT':
+            idat += body
+        offset += 12 + length
+    channels = 4 if color == 6 else 3
+    raw = bytearray(zlib.decompress(idat))
+    stride = width * channels + 1
+    rows = [raw[y * stride:(y + 1) * stride] for y in range(height)]
+    assert all(row[0] == 0 for row in rows)
+    return width, height, color, [row[1:] for row in rows]
+
+class MosaicTest(unittest.TestCase):
+    extent = geometry.Envelope(0, -10, 11, 0)
+    size = (11, 10)
+    def export(self, service, **options):
+        out = io.BytesIO()
+        result = mosaic.Mosaic(service, workers=3, **options).export(
+                                                  self.extent, self.size, out)
+        return result, read_png(out.getvalue())
+    def check_pixels(self, rows, channels):
+        for y, row in enumerate(rows):
+            for x in range(self.size[0]):
+                self.assertEqual(tuple(row[x * channels:x * channels + 3]),
+                                 pixel(x, y))
+                if channels == 4:
+                    self.assertEqual(row[x * channels + 3], 255)
+    def test_pieces(self):
+        pieces = mosaic.Mosaic(StubMapService(4, 3)).pieces(self.extent,
+                                                            self.size)
+        # 3 columns by 4 bands, covering every pixel once
+        self.assertEqual(len(pieces), 12)
+        self.assertEqual(sorted(set(piece.band for piece in pieces)),
+                         [0, 1, 2, 3])
+        self.assertEqual(sum(piece.width * piece.height for piece in pieces),
+                         110)
+        for piece in pieces:
+            self.assertTrue(piece.width <= 4 and piece.height <= 3)
+            self.assertEqual(piece.extent.xmin, piece.x)
+            self.assertEqual(piece.extent.ymax, -piece.y)
+    def test_export(self):
+        service = StubMapService(4, 3)
+        result, (width, height, color, rows) = self.export(service,
+                                                           layers="show:0")
+        self.assertEqual((width, height, color), (11, 10, 2))
+        self.assertEqual(result['pieces'], 12)
+        self.assertEqual(len(service.requests), 12)
+        for bbox, size, format, options in service.requests:
+            self.assertEqual(format, 'bmp')
+            self.assertEqual(options, {'layers': "show:0"})
+        self.check_pixels(rows, 3)
+    def test_top_down_rgba(self):
+        service = StubMapService(5, 4, bits=32, top_down=True)
+        result, (width, height, color, rows) = self.export(service)
+        self.assertEqual(color, 6)
+        self.check_pixels(rows, 4)
+    def test_single_piece(self):
+        result, (width, height, color, rows) = self.export(
+                                                 StubMapService(100, 100))
+        self.assertEqual(result['pieces'], 1)
+        self.check_pixels(rows, 3)
+    def test_wrong_piece_size(self):
+        class WrongSize(StubMapService):
+            def ExportMap(self, bbox, size, format, **options):
+                return StubExport(bmp([[(0, 0, 0)]], 1, 1))
+        self.assertRaises(ValueError, self.export, WrongSize(4, 3))
+    def test_world_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "print.png")
+            mosaic.Mosaic(StubMapService(4, 3)).export(
+                         self.extent, self.size, filename, world_file=True)
+            with open(filename, 'rb') as png:
+                self.check_pixels(read_png(png.read())[3], 3)
+            with open(os.path.join(directory, "print.pgw")) as world:
+                values = [float(line) for line in world]
+            self.assertEqual(values, [1.0, 0.0, 0.0, -1.0, 0.5, -0.5])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
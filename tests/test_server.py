@@ -0,0 +1,394 @@
+# coding: utf-8
+"""Tests of arcrest.server resources with their requests stubbed out"""
+
+import io
+import json
+import tempfile
+import time
+import unittest
+
+from arcrest import compat
+from arcrest import geometry
+from arcrest import server
+
+class StubResponse(object):
+    def __init__(self, json_struct):
+        self._json_struct = json_struct
+
+def stub_resource(cls, json_struct, response=None):
+    """An instance of the RestURL subclass cls described by json_struct,
+       whose requests are recorded in its requests list and answered with
+       response"""
+    resource = cls.__new__(cls)
+    resource.__json_struct__ = json_struct
+    resource.requests = []
+    def get_subfolder(path, returntype, params=None, file_data=None):
+        resource.requests.append((path, params))
+        return StubResponse(response or {})
+    resource._get_subfolder = get_subfolder
+    return resource
+
+class StubHandle(object):
+    "A urlopen response"
+    def __init__(self, url, data, headers=None):
+        self.url = url
+        self.headers = headers or {}
+        self.closed = False
+        self._data = io.BytesIO(data)
+    def info(self):
+        return self.headers
+    def read(self, size=-1):
+        return self._data.read(size)
+    def close(self):
+        self.closed = True
+
+class StubOpener(object):
+    """Stands in for urlopen, recording the URL, method, body and headers
+       of each request. Each request gets the next of responses, a (URL to
+       report, data, headers) tuple, where a URL of None is the request's
+       own; once they run out, it gets an empty JSON object."""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.handles = []
+    def __call__(self, request):
+        body = request.data
+        if hasattr(body, 'read'):
+            body = body.read()
+        self.requests.append({'url': request.get_full_url(),
+                              'method': request.get_method(),
+                              'body': body,
+                              'length': request.get_header('Content-length'),
+                              'stream': request.data})
+        url, data, headers = (self.responses.pop(0) if self.responses
+                              else (None, b'{}', None))
+        handle = StubHandle(url or request.get_full_url(), data, headers)
+        self.handles.append(handle)
+        return handle
+
+class StubbedRequestTest(unittest.TestCase):
+    "A test whose requests are answered by self.opener, a StubOpener"
+    base_url = "http://server/arcgis/rest/services/Parcels/FeatureServer/0/"
+    def setUp(self):
+        self.urlopen = compat.urllib2.urlopen
+        self.opener = compat.urllib2.urlopen = StubOpener()
+    def tearDown(self):
+        compat.urllib2.urlopen = self.urlopen
+    def child(self, foldername, returntype, params=None, base_url=None):
+        base = server.RestURL(base_url or self.base_url)
+        return base._get_subfolder(foldername, returntype, params)
+
+class StreamedBodyTest(StubbedRequestTest):
+    features = [{'attributes': {'NAME': 'a & b'}}, {'attributes': {'ID': 2}}]
+    def apply_edits(self):
+        items = (json.dumps(feature) for feature in self.features)
+        return self.child("./applyEdits", server.JsonPostResult,
+                          {'adds': server.JsonArrayParameter(items),
+                           'rollbackOnFailure': True})
+    def test_body(self):
+        self.apply_edits()
+        request, = self.opener.requests
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(request['url'], self.base_url + "applyEdits")
+        self.assertEqual(int(request['length']), len(request['body']))
+        params = compat.parse_qs(compat.ensure_string(request['body']))
+        self.assertEqual(params['f'], ['json'])
+        self.assertEqual(params['rollbackOnFailure'], ['true'])
+        self.assertEqual(params['adds'],
+                         ['[%s]' % ",".join(json.dumps(feature)
+                                            for feature in self.features)])
+        self.assertEqual(json.loads(params['adds'][0]), self.features)
+    def test_spooled_to_disk(self):
+        spool_size = server.STREAMED_BODY_SPOOL_SIZE
+        server.STREAMED_BODY_SPOOL_SIZE = 16
+        try:
+            self.apply_edits()
+        finally:
+            server.STREAMED_BODY_SPOOL_SIZE = spool_size
+        stream = self.opener.requests[0]['stream']
+        self.assertTrue(isinstance(stream, tempfile.SpooledTemporaryFile))
+        self.assertTrue(stream._rolled)
+        # The body is let go once the response is read
+        self.assertTrue(stream.closed)
+    def test_redirect_resends_body(self):
+        moved = "http://moved/arcgis/rest/services/Parcels/FeatureServer/0/"
+        self.opener.responses.append((moved + "applyEdits", b'', None))
+        result = self.apply_edits()
+        first, second = self.opener.requests
+        self.assertEqual(second['url'], moved + "applyEdits")
+        self.assertEqual(second['body'], first['body'])
+        self.assertEqual(second['length'], first['length'])
+        self.assertEqual(result._json_struct, {})
+
+class LongQueryTest(StubbedRequestTest):
+    token_url = StubbedRequestTest.base_url + "?token=abc"
+    def query(self, **params):
+        self.child("./query", server.JsonResult, params, self.token_url)
+        return self.opener.requests[-1]
+    def padded_where(self, length):
+        "A where clause making a query string of length characters"
+        self.query(where="x")
+        return "x" * (1 + length - len(self.opener.requests[-1]['url']
+                                            .split('?', 1)[1]))
+    def test_short_query(self):
+        request = self.query(where="1=1", outFields="*")
+        self.assertEqual(request['method'], 'GET')
+        self.assertEqual(request['body'], None)
+        params = compat.parse_qs(request['url'].split('?', 1)[1])
+        self.assertEqual(params['where'], ['1=1'])
+        self.assertEqual(params['token'], ['abc'])
+    def test_long_query(self):
+        objectIds = list(range(100000, 100500))
+        request = self.query(objectIds=objectIds)
+        self.assertEqual(request['method'], 'POST')
+        # Only the token stays in the URL
+        self.assertEqual(request['url'], self.base_url + "query?token=abc")
+        params = compat.parse_qs(compat.ensure_string(request['body']))
+        self.assertEqual(params['objectIds'],
+                         [",".join(str(oid) for oid in objectIds)])
+        self.assertEqual(params['token'], ['abc'])
+        self.assertEqual(params['f'], ['json'])
+    def test_boundary(self):
+        limit = server.MAX_GET_QUERY_LENGTH
+        self.assertEqual(limit, 2000)
+        request = self.query(where=self.padded_where(limit))
+        self.assertEqual(request['method'], 'GET')
+        self.assertEqual(len(request['url'].split('?', 1)[1]), limit)
+        request = self.query(where=self.padded_where(limit + 1))
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(len(request['body']), limit + 1)
+
+class ResourceURLTest(unittest.TestCase):
+    parents = ["http://server/arcgis/rest/services",
+               "http://server/arcgis/rest/services/",
+               "http://server/arcgis/rest/services/Roads/MapServer/",
+               "http://server/arcgis/rest/services/Roads/MapServer/0",
+               "http://server/arcgis/rest/services/Roads/MapServer?token=abc"]
+    names = ["Folder", "Roads/MapServer", "0", "./query", "./", "../",
+             "..", "../Other/MapServer", "", "a name", "100%", "x?y",
+             "/arcgis/rest/info"]
+    def reference(self, parent, foldername):
+        """The (scheme, netloc, path) and query parameters of the URL the
+           string-built _get_subfolder made: urljoin the quoted name, keep
+           the query string of an empty name, then add f=json and the
+           token"""
+        newurl = compat.urljoin(parent.url, compat.quote(foldername), False)
+        parts = compat.urlsplit(newurl)
+        params = dict((key, value[0]) for key, value
+                      in compat.parse_qs(parts[3]).items())
+        params['f'] = 'json'
+        if parent.__token__ is not None:
+            params['token'] = parent.__token__
+        return list(parts[:3]), params
+    def test_against_urljoin(self):
+        for url in self.parents:
+            parent = server.RestURL(url)
+            for foldername in self.names:
+                child = parent._get_subfolder(foldername, server.RestURL)
+                parts = compat.urlsplit(child.url)
+                params = dict((key, value[0]) for key, value
+                              in compat.parse_qs(parts[3]).items())
+                self.assertEqual((list(parts[:3]), params),
+                                 self.reference(parent, foldername),
+                                 "%r joined to %r" % (foldername, url))
+    def test_immutable_url(self):
+        url = server.ResourceURL("http", "server", "/arcgis/rest/services/",
+                                 {'f': 'json', 'where': "NAME = 'a b'"})
+        self.assertEqual(compat.parse_qs(url.query)['where'],
+                         ["NAME = 'a b'"])
+        self.assertTrue(url.url is url.url)
+        self.assertEqual(server.ResourceURL.fromString(url.url).params,
+                         url.params)
+        child = url.join("Roads/MapServer", {'f': 'json'})
+        self.assertEqual(child.url, "http://server/arcgis/rest/services/"
+                                    "Roads/MapServer?f=json")
+        self.assertEqual(url.path, "/arcgis/rest/services/")
+        self.assertEqual(url.withTrailingSlash(), url)
+    def test_url_cache_follows_post(self):
+        resource = server.RestURL("http://server/arcgis/rest/services/"
+                                  "Roads/MapServer/0/query?where=1%3D1"
+                                  "&token=abc")
+        get_url = resource.url
+        self.assertTrue("where=1%3D1" in get_url)
+        self.assertTrue(resource.url is get_url)
+        resource.__post__ = True
+        self.assertEqual(resource.url, "http://server/arcgis/rest/services/"
+                                       "Roads/MapServer/0/query?token=abc")
+        resource.__post__ = False
+        self.assertEqual(resource.url, get_url)
+        # Changing the URL (as a redirect does) renders it again
+        resource._url[1] = "moved"
+        self.assertEqual(resource.url, get_url.replace("server", "moved"))
+        child = resource._get_subfolder("./1", server.RestURL)
+        self.assertEqual(compat.urlsplit(child.url)[1], "moved")
+
+class BinaryResultTest(StubbedRequestTest):
+    data = bytes(bytearray(range(256))) * 10
+    def export(self, *responses):
+        self.opener.responses.extend(responses)
+        return self.child("./export", server.BinaryResult,
+                          {'bbox': "0,0,1,1", 'format': 'png'})
+    def test_iter_content(self):
+        result = self.export((None, self.data,
+                              {'Content-Length': str(len(self.data))}))
+        self.assertEqual(self.opener.requests, [])
+        chunks = list(result.iter_content(1000))
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 560])
+        self.assertEqual(b''.join(chunks), self.data)
+        self.assertEqual(result.content_length, len(self.data))
+        self.assertTrue(self.opener.handles[0].closed)
+        # Nothing is kept, so streaming again makes a new request
+        self.assertEqual(b''.join(result.iter_content()), b'{}')
+        self.assertEqual(len(self.opener.requests), 2)
+    def test_save_progress(self):
+        result = self.export((None, self.data,
+                              {'Content-Length': str(len(self.data))}))
+        result.save_chunk_size = 1024
+        progress, out = [], io.BytesIO()
+        self.assertEqual(result.save(out, lambda *args: progress.append(args)),
+                         len(self.data))
+        self.assertEqual(out.getvalue(), self.data)
+        self.assertEqual(progress, [(1024, 2560), (2048, 2560),
+                                    (2560, 2560)])
+    def test_no_content_length(self):
+        result = self.export((None, self.data, None))
+        progress = []
+        result.save(io.BytesIO(), lambda *args: progress.append(args))
+        self.assertEqual(progress, [(2560, None)])
+    def test_fetched_data(self):
+        result = self.export((None, self.data, None))
+        self.assertEqual(result.data, self.data)
+        self.assertEqual(result.content_length, len(self.data))
+        self.assertEqual([len(chunk) for chunk in result.iter_content(2000)],
+                         [2000, 560])
+        self.assertEqual(len(self.opener.requests), 1)
+    def test_redirect(self):
+        moved = "http://moved/arcgis/rest/services/Parcels/FeatureServer/0/"
+        for read in (lambda result: result.data,
+                     lambda result: b''.join(result.iter_content())):
+            self.opener.requests = []
+            result = self.export((moved + "export", b'', None),
+                                 (None, self.data, None))
+            self.assertEqual(read(result), self.data)
+            self.assertEqual([compat.urlsplit(request['url'])[1]
+                              for request in self.opener.requests],
+                             ['server', 'moved'])
+
+class FakeClock(object):
+    "Stands in for the time module, sleeping by moving its clock on"
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    def time(self):
+        return self.now
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class ScriptedJobStatus(server.GPJobStatus):
+    """A job going through statuses, a list of (status, message
+       descriptions so far) pairs, one per poll; the last is repeated"""
+    poll_interval = 1.0
+    poll_backoff = 2.0
+    max_poll_interval = 5.0
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.polls = 0
+    @property
+    def _json_struct(self):
+        self.polls += 1
+        status, descriptions = (self.statuses.pop(0)
+                                if len(self.statuses) > 1
+                                else self.statuses[0])
+        return {'jobId': 'j1', 'jobStatus': status,
+                'messages': [{'type': 'esriJobMessageTypeInformative',
+                              'description': description}
+                             for description in descriptions]}
+
+class GPJobStatusWaitTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = server.time = FakeClock()
+    def tearDown(self):
+        server.time = time
+    def test_poll_new_messages(self):
+        job = ScriptedJobStatus([('esriJobExecuting', ['a']),
+                                 ('esriJobExecuting', ['a', 'b', 'c'])])
+        status, messages = job.poll()
+        self.assertEqual((status, [str(m) for m in messages]),
+                         ('esriJobExecuting', ['a']))
+        self.assertEqual([str(m) for m in job.poll()[1]], ['b', 'c'])
+        self.assertEqual(job.poll()[1], [])
+    def test_backoff_and_cap(self):
+        job = ScriptedJobStatus([('esriJobSubmitted', [])] +
+                                [('esriJobExecuting', [])] * 6 +
+                                [('esriJobSucceeded', [])])
+        self.assertTrue(job.wait())
+        self.assertEqual(job.polls, 8)
+        # The interval grows only while the status stays the same
+        self.assertEqual(self.clock.sleeps, [1.0, 1.0, 2.0, 4.0, 5.0, 5.0,
+                                             5.0])
+    def test_messages_reset_growth(self):
+        job = ScriptedJobStatus([('esriJobExecuting', []),
+                                 ('esriJobExecuting', []),
+                                 ('esriJobExecuting', ['half way']),
+                                 ('esriJobExecuting', ['half way']),
+                                 ('esriJobSucceeded', ['half way'])])
+        progress = []
+        def record(status, messages):
+            progress.append((status, [str(message) for message in messages]))
+        self.assertTrue(job.wait(progress=record))
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0, 2.0, 4.0])
+        self.assertEqual(progress, [('esriJobExecuting', []),
+                                    ('esriJobExecuting', []),
+                                    ('esriJobExecuting', ['half way']),
+                                    ('esriJobExecuting', []),
+                                    ('esriJobSucceeded', [])])
+    def test_timeout(self):
+        job = ScriptedJobStatus([('esriJobExecuting', [])])
+        self.assertFalse(job.wait(timeout=10))
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0, 4.0, 3.0])
+        self.assertEqual(self.clock.now, 1010.0)
+    def test_terminal_states(self):
+        for status in ('esriJobSucceeded', 'esriJobFailed',
+                       'esriJobCancelled', 'esriJobTimedOut',
+                       'esriJobDeleted'):
+            job = ScriptedJobStatus([('esriJobExecuting', []), (status, [])])
+            self.assertTrue(job.wait(timeout=60))
+            self.assertEqual(job.polls, 2)
+        self.assertEqual(self.clock.sleeps, [1.0] * 5)
+        self.assertRaises(server.ServerError, lambda: job.results)
+
+class QueryLayerTest(unittest.TestCase):
+    def query(self, Geometry):
+        layer = stub_resource(server.MapLayer, {},
+                              {'features': [],
+                               'spatialReference': {'wkid': 4326}})
+        layer.QueryLayer(Geometry=Geometry,
+                         spatialRel='esriSpatialRelEnvelopeIntersects')
+        return layer.requests[0][1]
+    def test_envelope_sent(self):
+        params = self.query(geometry.Polyline([[[0, 0], [2, 3]]]))
+        self.assertEqual(params['geometryType'], 'esriGeometryEnvelope')
+        self.assertEqual(params['geometry']._bounds, (0, 0, 2, 3))
+    def test_empty_geometry(self):
+        params = self.query(geometry.Polygon([]))
+        self.assertEqual(params['geometryType'], 'esriGeometryPolygon')
+
+class ExportPixelsTest(unittest.TestCase):
+    def export(self, bandIds):
+        service = stub_resource(server.ImageService,
+                                {'bandCount': 4, 'pixelType': 'U16'})
+        result = service.ExportPixels(geometry.Envelope(0, 0, 10, 10),
+                                      (5, 5), bandIds=bandIds)
+        return service.requests[0][1], result
+    def test_band_ids(self):
+        for bandIds in ("0,2", [0, 2], (0, 2), " 0, 2 "):
+            params, result = self.export(bandIds)
+            self.assertEqual(result.bandCount, 2)
+            self.assertEqual(params['bandIds'], [0, 2])
+    def test_all_bands(self):
+        params, result = self.export(None)
+        self.assertEqual(result.bandCount, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# coding: utf-8
+"""Tests of arcrest.tiles with a stub map service"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from arcrest import compat
+from arcrest import geometry
+from arcrest import tiles
+from arcrest.server import ServerError
+
+class StubTile(object):
+    def __init__(self, data):
+        self.data = data
+
+class StubService(object):
+    """Serves tiles whose data is their address, except for missing ones
+       (404) and those with failures left"""
+    def __init__(self, missing=(), failures=None, error=None):
+        self.missing = set(missing)
+        self.failures = failures or {}
+        self.error = error or compat.URLError("reset")
+        self.requests = []
+    def tile(self, row, col, level):
+        self.requests.append(((level, row, col), time.time()))
+        if (level, row, col) in self.missing:
+            raise compat.HTTPError("http://tile", 404, "Not Found", {}, None)
+        if self.failures.get((level, row, col)):
+            self.failures[(level, row, col)] -= 1
+            raise self.error
+        return StubTile(("%i/%i/%i" % (level, row, col)).encode('ascii'))
+
+class TileFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = tiles.TileStore(os.path.join(self.directory,
+                                                  'tiles.mbtiles'))
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+    def test_fetch_and_cache(self):
+        service = StubService(missing=[(1, 0, 1)])
+        fetcher = tiles.TileFetcher(service, self.store, workers=2)
+        report = fetcher.fetch(tiles.tile_range(1, range(2), range(2)))
+        self.assertEqual((report.fetched, report.empty, report.failed),
+                         (3, 1, []))
+        self.assertEqual(self.store.get(1, 1, 0), b'1/1/0')
+        self.assertEqual(self.store.get(1, 0, 1), b'')
+        report = fetcher.fetch(tiles.tile_range(1, range(2), range(2)))
+        self.assertEqual((report.fetched, report.cached), (0, 4))
+        self.assertEqual(len(service.requests), 4)
+    def test_retry_backoff(self):
+        service = StubService(failures={(2, 0, 0): 2})
+        fetcher = tiles.TileFetcher(service, self.store, retry_delay=0.02)
+        self.assertEqual(fetcher.tile(2, 0, 0), b'2/0/0')
+        times = [when for tile, when in service.requests]
+        self.assertEqual(len(times), 3)
+        self.assertTrue(times[1] - times[0] >= 0.02)
+        self.assertTrue(times[2] - times[1] >= 0.04)
+    def test_failed(self):
+        service = StubService(failures={(0, 0, 0): 3})
+        fetcher = tiles.TileFetcher(service, self.store, retries=1,
+                                    retry_delay=0)
+        report = fetcher.fetch([(0, 0, 0)])
+        self.assertEqual(len(report.failed), 1)
+        self.assertTrue((0, 0, 0) not in self.store)
+    def test_permanent_error_not_retried(self):
+        error = ServerError("Invalid level", code=400)
+        service = StubService(failures={(9, 0, 0): 3}, error=error)
+        fetcher = tiles.TileFetcher(service, self.store, retry_delay=0)
+        self.assertEqual(fetcher.fetch([(9, 0, 0)]).failed,
+                         [((9, 0, 0), error)])
+        self.assertEqual(len(service.requests), 1)
+
+class TilingSchemeTest(unittest.TestCase):
+    def setUp(self):
+        lods = [{'level': level, 'resolution': 156543.03392800014 / 2 ** level,
+                 'scale': 591657527.591555 / 2 ** level}
+                for level in range(4)]
+        self.scheme = tiles.TilingScheme(
+                        geometry.Point(-20037508.342787, 20037508.342787),
+                        lods)
+    def test_tiles(self):
+        world = geometry.Envelope(-20037508.342787, -20037508.342787,
+                                  20037508.342787, 20037508.342787)
+        for level in self.scheme.levels:
+            self.assertEqual(self.scheme.count(world, level), 4 ** level)
+            self.assertEqual(len(list(self.scheme.tiles(world, level))),
+                             4 ** level)
+    def test_tile_extent_round_trip(self):
+        for tile in [(2, 1, 3), (3, 7, 0)]:
+            extent = self.scheme.tile_extent(*tile)
+            self.assertEqual(list(self.scheme.tiles(extent, tile[0])),
+                             [tile])
+            center = ((extent.xmin + extent.xmax) / 2,
+                      (extent.ymin + extent.ymax) / 2)
+            self.assertEqual(self.scheme.tile_at(center, tile[0]), tile)
+
+if __name__ == '__main__':
+    unittest.main()
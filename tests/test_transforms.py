@@ -0,0 +1,67 @@
+# coding: utf-8
+"""Round trip tests of the local projection engine in arcrest.transforms"""
+
+import unittest
+
+from arcrest import geometry
+from arcrest import transforms
+
+class TransformsTest(unittest.TestCase):
+    def assertClose(self, a, b, places=6):
+        for x, y in zip(a, b):
+            self.assertAlmostEqual(x, y, places)
+    def test_known_point(self):
+        point, = transforms.project([geometry.Point(-117.2, 34.05, 4326)],
+                                    102100)
+        self.assertAlmostEqual(point.x, -13046644.32097, 4)
+        self.assertAlmostEqual(point.y, 4035517.78208, 4)
+        self.assertEqual(point.spatialReference.wkid, 102100)
+    def test_round_trips(self):
+        lons = [-179.5, -117.2, 0.0, 12.345678, 151.2]
+        lats = [-60.0, 34.05, 0.0, 45.5, -33.87]
+        for wkid in (3857, 102100, 32662, 32611, 32756):
+            self.assertTrue(transforms.can_transform(4326, wkid))
+            if wkid in (32611, 32756):
+                # Within a few zones of the zone's central meridian
+                central = -117 if wkid == 32611 else 153
+                test_lons = [central - 2.5, central, central + 2.9]
+                test_lats = [-10.0, 34.05, 50.0]
+            else:
+                test_lons, test_lats = lons, lats
+            xs, ys = transforms.transform(test_lons, test_lats, 4326, wkid)
+            back_lons, back_lats = transforms.transform(xs, ys, wkid, 4326)
+            self.assertClose(back_lons, test_lons, 7)
+            self.assertClose(back_lats, test_lats, 7)
+    def test_geometries(self):
+        line = geometry.Polyline([[[-117.2, 34.05], [-117.1, 34.1]]], 4326)
+        line.attributes = {'name': 'a'}
+        envelope = geometry.Envelope(-1, -1, 1, 1, 4326)
+        projected_line, projected_envelope = transforms.project(
+                                                [line, envelope], 3857)
+        self.assertEqual(projected_line.attributes, {'name': 'a'})
+        back, = transforms.project(projected_line, 4326)
+        self.assertClose(back._coordinate_parts[0],
+                         line._coordinate_parts[0], 7)
+        self.assertAlmostEqual(projected_envelope.xmax, 111319.4908, 3)
+    def test_unsupported(self):
+        self.assertFalse(transforms.can_transform(4326, 2229))
+        self.assertFalse(transforms.supported(None))
+    def test_named_spatial_references(self):
+        self.assertTrue(transforms.supported('GCS_WGS_1984'))
+        self.assertTrue(transforms.supported('3857'))
+        self.assertTrue(transforms.supported({'latestWkid': 3857}))
+        x, y = transforms.transform([0.0], [0.0], 'GCS_WGS_1984',
+                                'WGS_1984_Web_Mercator_Auxiliary_Sphere')
+        self.assertClose(x + y, [0.0, 0.0])
+    def test_spatial_references_without_wkid(self):
+        wkt = 'PROJCS["WGS_1984_Web_Mercator",GEOGCS["GCS_WGS_1984"]]'
+        for sr in (wkt, {'wkt': wkt}, 'No_Such_Projection'):
+            self.assertFalse(transforms.supported(sr))
+            self.assertFalse(transforms.can_transform(4326, sr))
+            self.assertRaises(transforms.UnsupportedSpatialReference,
+                              transforms.transform, [0.0], [0.0], 4326, sr)
+        self.assertRaises(transforms.UnsupportedSpatialReference,
+                          transforms.transform, [0.0], [0.0], 4326, 2229)
+
+if __name__ == '__main__':
+    unittest.main()
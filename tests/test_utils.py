@@ -0,0 +1,68 @@
+# coding: utf-8
+"""Tests of arcrest.utils and the request error helpers of arcrest.server"""
+
+import socket
+import unittest
+
+from arcrest import compat
+from arcrest import utils
+from arcrest.server import RETRY_EXCEPTIONS, ServerError, is_transient
+
+class WithRetriesTest(unittest.TestCase):
+    def failing(self, *errors):
+        "A function raising errors in turn, then returning the call count"
+        calls = []
+        def function():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return len(calls)
+        return function
+    def test_retried(self):
+        function = utils.with_retries(
+                        self.failing(compat.URLError("down"),
+                                     ServerError("busy", 503)),
+                        2, RETRY_EXCEPTIONS, delay=0, retry_if=is_transient)
+        self.assertEqual(function(), 3)
+    def test_not_transient(self):
+        function = utils.with_retries(
+                        self.failing(ServerError("Invalid geometry", 400)),
+                        2, RETRY_EXCEPTIONS, delay=0, retry_if=is_transient)
+        self.assertRaises(ServerError, function)
+    def test_retries_exhausted(self):
+        function = utils.with_retries(
+                        self.failing(*[compat.URLError("down")] * 3),
+                        2, RETRY_EXCEPTIONS, delay=0)
+        self.assertRaises(compat.URLError, function)
+
+class IsTransientTest(unittest.TestCase):
+    def test_errors(self):
+        self.assertTrue(is_transient(compat.URLError("down")))
+        self.assertTrue(is_transient(ServerError("busy", 500)))
+        self.assertTrue(is_transient(ServerError("busy", "503")))
+        self.assertFalse(is_transient(ServerError("bad parameter", 400)))
+        self.assertFalse(is_transient(ServerError("job failed")))
+        self.assertFalse(is_transient(ValueError("bad")))
+    def test_http_errors(self):
+        def http_error(code):
+            return compat.HTTPError("http://server", code, "", {}, None)
+        self.assertTrue(is_transient(http_error(502)))
+        self.assertTrue(is_transient(http_error(429)))
+        self.assertTrue(is_transient(http_error(408)))
+        self.assertFalse(is_transient(http_error(404)))
+        self.assertFalse(is_transient(http_error(403)))
+    def test_timeout(self):
+        error = socket.timeout("timed out")
+        self.assertTrue(isinstance(error, RETRY_EXCEPTIONS))
+        self.assertTrue(is_transient(error))
+
+class ImapParallelTest(unittest.TestCase):
+    def test_order(self):
+        self.assertEqual(list(utils.imap_parallel(abs, range(-20, 0), 4)),
+                         list(range(20, 0, -1)))
+        self.assertEqual(sorted(utils.imap_parallel(abs, range(-20, 0), 4,
+                                                    ordered=False)),
+                         list(range(1, 21)))
+
+if __name__ == '__main__':
+    unittest.main()